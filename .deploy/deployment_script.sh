@@ -262,6 +262,19 @@ else:
 
     print_step "Collecting static files..."
     "$PYTHON" "$PROJECT_DIR/manage.py" collectstatic --noinput
+
+    print_step "Refreshing portfolio covers..."
+    "$PYTHON" "$PROJECT_DIR/manage.py" refresh_portfolio_covers
+
+    # списки проектов по категориям читаются только из таблицы рейтинга (после обложек - она их копирует)
+    print_step "Rebuilding category rankings..."
+    "$PYTHON" "$PROJECT_DIR/manage.py" rebuild_category_rankings
+
+    print_step "Rebuilding review threads..."
+    "$PYTHON" "$PROJECT_DIR/manage.py" rebuild_review_threads
+
+    print_step "Updating sitemap..."
+    "$PYTHON" "$PROJECT_DIR/manage.py" update_sitemaps
 }
 
 # Запуск/перезапуск приложения
@@ -9,6 +9,7 @@ from django.contrib.contenttypes.models import ContentType
 from blog.models import Article
 from exhibition.base_models import BaseImageModel
 from exhibition.models import Exhibitors, Partners
+from exhibition.utils import get_persons_for_users
 from exhibition.logic import MediaFileStorage
 from sorl.thumbnail import delete
 
@@ -95,13 +96,18 @@ class Banner(BaseImageModel):
 		).annotate(page=Value(model_name, output_field=CharField()))  # добавим значение модели как строка
 		return banners
 
+	@staticmethod
+	def attach_owners(banners):
+		"""Пакетно находит владельцев (участник или партнер) для списка баннеров (см. owner)"""
+		owners = get_persons_for_users((banner.user_id for banner in banners), (Exhibitors, Partners))
+		for banner in banners:
+			banner._owner = owners.get(banner.user_id)
+
+		return banners
+
 	def owner(self):
-		try:
-			q = Exhibitors.objects.get(user=self.user)
-		except Exhibitors.DoesNotExist:
-			try:
-				q = Partners.objects.get(user=self.user)
-			except Partners.DoesNotExist:
-				q = None
-		return q
+		if not hasattr(self, '_owner'):
+			self.attach_owners([self])
+
+		return self._owner
 
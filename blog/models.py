@@ -8,7 +8,7 @@ from django.db.models.functions import Coalesce
 from uuslug import uuslug
 from ckeditor_uploader.fields import RichTextUploadingField
 
-from exhibition.models import Exhibitors, Partners, Jury
+from exhibition.utils import get_persons_for_users
 
 
 class Category(models.Model):
@@ -52,15 +52,20 @@ class Article(models.Model):
 			self.slug = uuslug(self.title.lower(), instance=self)
 		super().save(*args, **kwargs)
 
-	def person(self):
+	@staticmethod
+	def attach_persons(articles):
+		"""Пакетно находит профили авторов для списка статей (см. person)"""
+		persons = get_persons_for_users(article.owner_id for article in articles)
+		for article in articles:
+			article._person = persons.get(article.owner_id)
+
+		return articles
 
-		post = Exhibitors.objects.filter(user=self.owner).first()
-		if not post:
-			post = Partners.objects.filter(user=self.owner).first()
-			if not post:
-				post = Jury.objects.filter(user=self.owner).first()
+	def person(self):
+		if not hasattr(self, '_person'):
+			self.attach_persons([self])
 
-		return post
+		return self._person
 
 	def __str__(self):
 		return self.title
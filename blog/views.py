@@ -5,6 +5,7 @@ from django.views.generic.detail import DetailView
 from django.views.generic.list import ListView
 
 from exhibition.mixins import BannersMixin, MetaSeoMixin
+from exhibition.utils import get_persons_for_users
 from .models import Category, Article
 
 
@@ -43,8 +44,9 @@ class ArticleList(MetaSeoMixin, BannersMixin, ListView):
 			if self.is_next_page:
 				article_list.pop()
 
-			for i, q in enumerate(article_list):
-				person = queryset[i].person()
+			persons = get_persons_for_users(q['owner_id'] for q in article_list)
+			for q in article_list:
+				person = persons.get(q['owner_id'])
 				if person:
 					q.update({'person': person.name})
 					q.update({'person_url': person.get_absolute_url()})
@@ -70,7 +72,7 @@ class ArticleList(MetaSeoMixin, BannersMixin, ListView):
 		context = super().get_context_data(**kwargs)
 		context['html_classes'] = ['articles', ]
 		context['page_title'] = self.model._meta.verbose_name_plural
-		context['article_list'] = self.object_list[:self.PAGE_SIZE]
+		context['article_list'] = Article.attach_persons(list(self.object_list[:self.PAGE_SIZE]))
 		context['filter_attributes'] = attrs
 		context['cache_timeout'] = 86400
 		return context
@@ -81,6 +83,7 @@ class ArticleDetail(MetaSeoMixin, BannersMixin, DetailView):
 
 	def get_context_data(self, **kwargs):
 		context = super().get_context_data(**kwargs)
+		context['person'] = self.object.person()
 		context['html_classes'] = ['article']
 		context['parent_link'] = '/articles/'
 		context['cache_timeout'] = 86400
@@ -1,13 +1,48 @@
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
 from django.utils.deprecation import MiddlewareMixin
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
 
+from .routers import get_replica_alias, replica_reads, has_written
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncCapableMiddleware:
+	"""
+	Основа middleware, работающих и в синхронном (WSGI), и в асинхронном (ASGI) стеке:
+	на ASGI синхронные middleware заставили бы Django выполнять асинхронные представления в потоке.
+	"""
+	sync_capable = True
+	async_capable = True
 
-class AjaxMiddleware:
 	def __init__(self, get_response):
 		self.get_response = get_response
+		if iscoroutinefunction(get_response):
+			markcoroutinefunction(self)
 
 	def __call__(self, request):
+		if iscoroutinefunction(self):
+			return self.__acall__(request)
+		return self.handle(request)
+
+	def handle(self, request):
+		return self.get_response(request)
+
+	async def __acall__(self, request):
+		return await self.get_response(request)
+
+
+class AjaxMiddleware(AsyncCapableMiddleware):
+
+	@staticmethod
+	def attach_is_ajax(request):
 		# Добавляем метод is_ajax к request
 		def is_ajax(req):
 			return (
@@ -18,8 +53,13 @@ class AjaxMiddleware:
 		# Привязываем метод к request
 		request.is_ajax = is_ajax.__get__(request, type(request))
 
-		response = self.get_response(request)
-		return response
+	def handle(self, request):
+		self.attach_is_ajax(request)
+		return self.get_response(request)
+
+	async def __acall__(self, request):
+		self.attach_is_ajax(request)
+		return await self.get_response(request)
 
 
 class FixPermissionMiddleware(MiddlewareMixin):
@@ -51,3 +91,149 @@ class FixPermissionMiddleware(MiddlewareMixin):
 			ContentType.__str__ = self._original_contenttype_str
 			Permission.__str__ = self._original_permission_str
 		return response
+
+
+class QueryStats:
+	"""Счетчик SQL-запросов и суммарного времени их выполнения по всем подключениям к БД"""
+
+	def __init__(self):
+		self.count = 0
+		self.duration = 0.0
+		self.view_name = None
+
+	def __call__(self, execute, sql, params, many, context):
+		start = time.perf_counter()
+		try:
+			return execute(sql, params, many, context)
+		finally:
+			self.count += 1
+			self.duration += time.perf_counter() - start
+
+	@contextmanager
+	def capture(self):
+		with ExitStack() as stack:
+			for connection in connections.all():
+				stack.enter_context(connection.execute_wrapper(self))
+			yield self
+
+	@property
+	def duration_ms(self):
+		return round(self.duration * 1000, 2)
+
+	def server_timing(self):
+		return f'db;dur={self.duration_ms};desc="{self.count} queries"'
+
+
+def get_query_budget(view_name):
+	"""Допустимое количество SQL-запросов для представления по имени URL (None - без ограничений)"""
+	if not view_name:
+		return None
+	return getattr(settings, 'QUERY_BUDGETS', {}).get(view_name)
+
+
+class QueryBudgetMiddleware(AsyncCapableMiddleware):
+	"""
+	Учет SQL-запросов и времени БД на каждый запрос.
+	Превышение бюджета из settings.QUERY_BUDGETS пишется в лог,
+	персоналу при включенном QUERY_COUNT_HEADER отдаются заголовки X-Query-Count и Server-Timing
+	"""
+
+	def handle(self, request):
+		stats = QueryStats()
+		with stats.capture():
+			response = self.get_response(request)
+
+		return self.finish(request, response, stats, self.is_staff(getattr(request, 'user', None)))
+
+	async def __acall__(self, request):
+		stats = QueryStats()
+		# async ORM выполняет запросы в потоке sync_to_async текущего запроса - счетчик ставим на его подключения
+		capture = stats.capture()
+		await sync_to_async(capture.__enter__)()
+		try:
+			response = await self.get_response(request)
+		finally:
+			await sync_to_async(capture.__exit__)(None, None, None)
+
+		is_staff = False
+		if getattr(settings, 'QUERY_COUNT_HEADER', False) and hasattr(request, 'auser'):
+			is_staff = self.is_staff(await request.auser())
+
+		return self.finish(request, response, stats, is_staff)
+
+	def finish(self, request, response, stats, is_staff):
+		resolver_match = getattr(request, 'resolver_match', None)
+		stats.view_name = resolver_match.view_name if resolver_match else None
+		# Статистика доступна в тестах через response.query_stats (см. crm.testing.QueryBudgetTestMixin)
+		response.query_stats = stats
+
+		budget = get_query_budget(stats.view_name)
+		if budget is not None and stats.count > budget:
+			logger.warning(
+				'Query budget exceeded for %s (%s): %s > %s queries, %s ms',
+				stats.view_name, request.path, stats.count, budget, stats.duration_ms
+			)
+
+		if getattr(settings, 'QUERY_COUNT_HEADER', False) and is_staff:
+			response['X-Query-Count'] = str(stats.count)
+			response['Server-Timing'] = stats.server_timing()
+
+		return response
+
+	@staticmethod
+	def is_staff(user):
+		return bool(user and user.is_authenticated and user.is_staff)
+
+
+class ReplicaRoutingMiddleware(AsyncCapableMiddleware):
+	"""
+	Публичные GET/HEAD-запросы читают с реплики (crm.routers.ReplicaRouter).
+	После запроса с записью (оценка, комментарий, загрузка проекта и т.п.) клиент
+	на REPLICA_PIN_SECONDS закрепляется за основной БД, чтобы сразу видеть свои изменения
+	"""
+	SAFE_METHODS = ('GET', 'HEAD')
+	PIN_COOKIE = 'db_pin'
+
+	def handle(self, request):
+		if get_replica_alias() is None:
+			return self.get_response(request)
+
+		with replica_reads(self.use_replica(request)):
+			response = self.get_response(request)
+			wrote = has_written()
+
+		return self.pin(request, response, wrote)
+
+	async def __acall__(self, request):
+		if get_replica_alias() is None:
+			return await self.get_response(request)
+
+		# флаги маршрутизатора - ContextVar, sync_to_async переносит их в поток запроса и обратно
+		with replica_reads(self.use_replica(request)):
+			response = await self.get_response(request)
+			wrote = has_written()
+
+		return self.pin(request, response, wrote)
+
+	def use_replica(self, request):
+		return (
+			request.method in self.SAFE_METHODS
+			and not self.is_pinned(request)
+			and not request.path.startswith(getattr(settings, 'REPLICA_EXCLUDED_PATHS', ()))
+		)
+
+	def pin(self, request, response, wrote):
+		if wrote or request.method not in self.SAFE_METHODS:
+			pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 15)
+			response.set_cookie(
+				self.PIN_COOKIE, str(int(time.time()) + pin_seconds),
+				max_age=pin_seconds, httponly=True, samesite='Lax',
+			)
+
+		return response
+
+	def is_pinned(self, request):
+		try:
+			return int(request.COOKIES.get(self.PIN_COOKIE, 0)) > time.time()
+		except ValueError:
+			return False
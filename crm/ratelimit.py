@@ -0,0 +1,165 @@
+"""
+Ограничение частоты запросов: token bucket в Redis.
+Состояние корзины (токены и время пополнения) меняется одним Lua-скриптом, поэтому проверка атомарна
+и стоит одного обращения к Redis (EVALSHA). Частоты задаются в settings.RATE_LIMITS по областям.
+"""
+import logging
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+
+logger = logging.getLogger(__name__)
+
+# область -> (частота пополнения, емкость корзины); переопределяются в settings.RATE_LIMITS
+DEFAULT_RATE_LIMITS = {
+	'rating': ('30/m', 15),
+	'review': ('6/m', 5),
+	'upload': ('10/m', 5),
+}
+PERIODS = {'s': 1, 'm': 60, 'h': 3600}
+
+# KEYS: корзины (пользователь, IP); ARGV: емкость, токенов в секунду, стоимость запроса.
+# Запрос проходит, только если токены есть во всех корзинах; время берется у Redis (одно на все серверы)
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+
+local tokens = {}
+local retry_after = 0
+for i, key in ipairs(KEYS) do
+	local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+	local available = tonumber(bucket[1]) or capacity
+	local ts = tonumber(bucket[2]) or now
+	available = math.min(capacity, available + math.max(0, now - ts) * rate)
+	if available < cost then
+		retry_after = math.max(retry_after, math.ceil((cost - available) / rate))
+	end
+	tokens[i] = available
+end
+
+local ttl = math.ceil(capacity / rate) + 1
+for i, key in ipairs(KEYS) do
+	local available = tokens[i]
+	if retry_after == 0 then
+		available = available - cost
+	end
+	redis.call('HSET', key, 'tokens', tostring(available), 'ts', tostring(now))
+	redis.call('EXPIRE', key, ttl)
+end
+return retry_after
+"""
+
+_script = None
+
+
+def parse_rate(rate):
+	"""'30/m' -> токенов в секунду"""
+	count, period = rate.split('/')
+	return int(count) / PERIODS[period]
+
+
+def get_rule(scope):
+	rate, capacity = {**DEFAULT_RATE_LIMITS, **getattr(settings, 'RATE_LIMITS', {})}[scope]
+	return capacity, parse_rate(rate)
+
+
+def get_remote_ip(request):
+	"""
+	Адрес клиента, который нельзя подменить заголовком: X-Real-IP и последний адрес X-Forwarded-For
+	выставляет nginx ($remote_addr, $proxy_add_x_forwarded_for), а первые адреса цепочки приходят от клиента
+	"""
+	real_ip = request.META.get('HTTP_X_REAL_IP')
+	if real_ip:
+		return real_ip.strip()
+
+	forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+	if forwarded_for:
+		return forwarded_for.split(',')[-1].strip()
+
+	return request.META.get('REMOTE_ADDR')
+
+
+def get_bucket_keys(request, scope, keys):
+	"""Корзины запроса: пользователь (для авторизованных) и IP-адрес"""
+	bucket_keys = []
+	user = getattr(request, 'user', None)
+	if 'user' in keys and user is not None and user.is_authenticated:
+		bucket_keys.append(f'ratelimit:{scope}:user:{user.pk}')
+	if 'ip' in keys:
+		bucket_keys.append(f'ratelimit:{scope}:ip:{get_remote_ip(request)}')
+	return bucket_keys
+
+
+def get_script():
+	global _script
+
+	from django_redis import get_redis_connection
+	connection = get_redis_connection('default')
+	if _script is None or _script.registered_client is not connection:
+		_script = connection.register_script(TOKEN_BUCKET_SCRIPT)
+	return _script
+
+
+def consume(scope, bucket_keys, cost=1):
+	"""Списывает токены; возвращает 0, если запрос разрешен, иначе - через сколько секунд повторить"""
+	from redis.exceptions import RedisError
+
+	capacity, rate = get_rule(scope)
+	try:
+		return int(get_script()(keys=bucket_keys, args=[capacity, rate, cost]))
+	except NotImplementedError:
+		# кэш не на Redis (разработка, тесты) - без ограничений
+		return 0
+	except RedisError as e:
+		logger.warning(f"Rate limiter is unavailable: {e}")
+		return 0
+
+
+def limited_response(retry_after):
+	response = JsonResponse({
+		'status': 'error',
+		'message': f'Слишком много запросов. Повторите через {retry_after} сек.'
+	}, status=429)
+	response['Retry-After'] = str(retry_after)
+	return response
+
+
+def rate_limit(scope, keys=('user', 'ip'), methods=('POST',)):
+	"""
+	Декоратор представления (функции или метода через method_decorator, синхронного или асинхронного):
+	запросы с методами methods сверх частоты области scope получают 429 с заголовком Retry-After
+	"""
+	def is_limited(request):
+		if not getattr(settings, 'RATE_LIMIT_ENABLED', True) or request.method not in methods:
+			return 0
+		return consume(scope, get_bucket_keys(request, scope, keys))
+
+	def decorator(view):
+		if iscoroutinefunction(view):
+			@wraps(view)
+			async def async_wrapper(request, *args, **kwargs):
+				# пользователь сессии загружается заранее: в потоке sync_to_async ленивый request.user недоступен
+				if hasattr(request, 'auser'):
+					request.user = await request.auser()
+				retry_after = await sync_to_async(is_limited, thread_sensitive=False)(request)
+				if retry_after:
+					return limited_response(retry_after)
+				return await view(request, *args, **kwargs)
+
+			return async_wrapper
+
+		@wraps(view)
+		def wrapper(request, *args, **kwargs):
+			retry_after = is_limited(request)
+			if retry_after:
+				return limited_response(retry_after)
+			return view(request, *args, **kwargs)
+
+		return wrapper
+
+	return decorator
@@ -0,0 +1,65 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Чтение с реплики разрешено только внутри публичных GET-запросов (см. ReplicaRoutingMiddleware)
+_replica_reads = ContextVar('replica_reads', default=False)
+# В текущем контексте уже была запись - дальнейшее чтение идет с основной БД
+_wrote = ContextVar('replica_wrote', default=False)
+
+
+def get_replica_alias():
+	"""Псевдоним реплики из settings.DATABASES (None, если реплика не настроена)"""
+	alias = getattr(settings, 'REPLICA_DATABASE_ALIAS', 'replica')
+	return alias if alias in settings.DATABASES else None
+
+
+@contextmanager
+def replica_reads(enabled=True):
+	"""Разрешает (или запрещает) чтение с реплики внутри блока"""
+	reads_token = _replica_reads.set(enabled)
+	wrote_token = _wrote.set(False)
+	try:
+		yield
+	finally:
+		_wrote.reset(wrote_token)
+		_replica_reads.reset(reads_token)
+
+
+def has_written():
+	return _wrote.get()
+
+
+class ReplicaRouter:
+	"""
+	Чтение в публичных представлениях - с реплики, запись и все остальное - с основной БД.
+	После первой записи в контексте и внутри транзакций чтение переключается на основную БД.
+	"""
+
+	def db_for_read(self, model, **hints):
+		if not _replica_reads.get() or _wrote.get():
+			return None
+
+		replica = get_replica_alias()
+		if replica is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+			return None
+
+		return replica
+
+	def db_for_write(self, model, **hints):
+		_wrote.set(True)
+		return DEFAULT_DB_ALIAS
+
+	def allow_relation(self, obj1, obj2, **hints):
+		databases = {DEFAULT_DB_ALIAS, get_replica_alias()}
+		if obj1._state.db in databases and obj2._state.db in databases:
+			return True
+		return None
+
+	def allow_migrate(self, db, app_label, model_name=None, **hints):
+		# реплика получает схему репликацией с основной БД
+		if db == get_replica_alias():
+			return False
+		return None
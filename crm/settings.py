@@ -52,6 +52,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
 	'django.middleware.security.SecurityMiddleware',
+	'crm.middleware.QueryBudgetMiddleware',
+	'crm.middleware.ReplicaRoutingMiddleware',
 	# 'whitenoise.middleware.WhiteNoiseMiddleware',
 	'django.contrib.sessions.middleware.SessionMiddleware',
 	'django.middleware.common.CommonMiddleware',
@@ -60,7 +62,6 @@ MIDDLEWARE = [
 	'django.contrib.messages.middleware.MessageMiddleware',
 	'django.middleware.clickjacking.XFrameOptionsMiddleware',
 	'django.middleware.cache.FetchFromCacheMiddleware',
-	'watson.middleware.SearchContextMiddleware',
 	'crm.middleware.AjaxMiddleware',
 	'crm.middleware.FixPermissionMiddleware',
 	'allauth.account.middleware.AccountMiddleware',
@@ -98,6 +99,9 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'crm.wsgi.application'
+ASGI_APPLICATION = 'crm.asgi.application'
+# Асинхронные версии JSON-эндпоинтов (exhibition.api, rating.api) - для запуска на ASGI (uvicorn), см. README
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False').lower() == 'true'
 
 # Database configuration
 DATABASES = {
@@ -108,6 +112,23 @@ DATABASES = {
 	)
 }
 
+# Реплика для чтения в публичных представлениях (crm.routers.ReplicaRouter).
+# Локально можно указать второй файл SQLite или вторую базу PostgreSQL
+REPLICA_DATABASE_URL = os.getenv('REPLICA_DATABASE_URL')
+REPLICA_DATABASE_ALIAS = 'replica'
+if REPLICA_DATABASE_URL:
+	DATABASES[REPLICA_DATABASE_ALIAS] = dj_database_url.parse(
+		REPLICA_DATABASE_URL,
+		conn_max_age=600,
+		conn_health_checks=True,
+	)
+	DATABASES[REPLICA_DATABASE_ALIAS]['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['crm.routers.ReplicaRouter']
+# Сколько секунд после записи клиент читает с основной БД (задержка репликации)
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 15))
+REPLICA_EXCLUDED_PATHS = ('/admin/', '/accounts/', '/account/', '/portfolio/', '/chaining/', '/ckeditor/')
+
 # Cache configuration
 REDIS_URL = os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/0')
 CACHES = {
@@ -442,3 +463,61 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 PORTFOLIO_COUNT_PER_PAGE = int(os.getenv('PORTFOLIO_COUNT_PER_PAGE', 20))
 # It uses in blog.views.ArticleList as parameter for queryset
 ARTICLES_COUNT_PER_PAGE = int(os.getenv('ARTICLES_COUNT_PER_PAGE', 10))
+# Веток комментариев на странице проекта (rating.services.ReviewService)
+COMMENTS_COUNT_PER_PAGE = int(os.getenv('COMMENTS_COUNT_PER_PAGE', 20))
+
+# Бюджет SQL-запросов на представление по имени URL (crm.middleware.QueryBudgetMiddleware)
+QUERY_BUDGETS = {
+	'exhibition:index': 8,
+	'exhibition:exhibitions-list-url': 5,
+	'exhibition:exhibition-detail-url': 25,
+	'exhibition:winner-detail-url': 24,
+	'exhibition:category-list-url': 8,
+	'exhibition:projects-list-url': 10,
+	'exhibition:projects-list-by-year-url': 6,
+	'exhibition:project-detail-url': 30,
+	'exhibition:exhibitors-list-all': 8,
+	'exhibition:exhibitor-detail-url': 8,
+	'exhibition:jury-list-all': 8,
+	'exhibition:jury-detail-url': 8,
+	'exhibition:partners-list-all': 8,
+	'exhibition:partner-detail-url': 8,
+	'exhibition:winners-list-all': 8,
+	'exhibition:events-list-all': 8,
+	'blog:article-list-url': 10,
+	'blog:article-detail-url': 9,
+	'admin:exhibition_portfolio_changelist': 15,
+	'admin:exhibition_exhibitors_changelist': 10,
+	'admin:exhibition_jury_changelist': 10,
+	'admin:exhibition_partners_changelist': 10,
+	'admin:exhibition_winners_changelist': 18,
+	'admin:rating_rating_changelist': 13,
+	'admin:rating_reviews_changelist': 10,
+}
+# Заголовки X-Query-Count и Server-Timing в ответах для персонала
+QUERY_COUNT_HEADER = os.getenv('QUERY_COUNT_HEADER', 'False').lower() == 'true'
+
+# Предварительно сгенерированная карта сайта (exhibition.sitemap.write_sitemaps)
+SITEMAP_ROOT = os.path.join(MEDIA_ROOT, 'sitemaps')
+SITEMAP_URL = MEDIA_URL + 'sitemaps/'
+# Фоновая перегенерация разделов при сохранении моделей (в тестах выключается)
+SITEMAP_AUTO_UPDATE = os.getenv('SITEMAP_AUTO_UPDATE', 'True').lower() == 'true'
+
+# Отложенная индексация watson (exhibition.search): размер пачки объектов фонового обновления
+SEARCH_INDEX_BATCH_SIZE = 200
+
+# Фоновые выгрузки (exhibition.jobs): срок хранения готовых файлов в MEDIA_ROOT/exports/, секунд
+EXPORT_RESULTS_TTL = int(os.getenv('EXPORT_RESULTS_TTL', 24 * 3600))
+
+# Ограничение частоты запросов (crm.ratelimit): область -> (частота пополнения, емкость корзины)
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+RATE_LIMITS = {
+	'rating': ('30/m', 15),
+	'review': ('6/m', 5),
+	'upload': ('10/m', 5),
+}
+
+# Буфер оценок посетителей в Redis (rating.buffer) - для пиковой нагрузки после окончания выставки
+RATING_BUFFER = os.getenv('RATING_BUFFER', 'False').lower() == 'true'
+# период фонового переноса голосов из буфера в БД, сек (также команда flush_rating_buffer)
+RATING_BUFFER_FLUSH_INTERVAL = int(os.getenv('RATING_BUFFER_FLUSH_INTERVAL', 10))
@@ -0,0 +1,47 @@
+import os
+
+from django.urls import reverse
+
+from .middleware import get_query_budget
+
+# отдельная БД Redis для тестов, которым нужен настоящий сервер (буфер оценок, ограничение запросов)
+REDIS_TEST_URL = os.getenv('REDIS_TEST_URL', 'redis://127.0.0.1:6379/15')
+
+
+def redis_available():
+	try:
+		from redis import Redis
+		Redis.from_url(REDIS_TEST_URL, socket_connect_timeout=0.2).ping()
+	except Exception:
+		return False
+	return True
+
+
+class QueryBudgetTestMixin:
+	"""
+	Проверка представлений на соответствие бюджету SQL-запросов из settings.QUERY_BUDGETS.
+	Статистику собирает crm.middleware.QueryBudgetMiddleware
+	"""
+
+	def assertQueryBudget(self, response, budget=None):
+		stats = getattr(response, 'query_stats', None)
+		if stats is None:
+			self.fail('Статистика запросов не собрана: QueryBudgetMiddleware не подключен')
+
+		if budget is None:
+			budget = get_query_budget(stats.view_name)
+		if budget is None:
+			self.fail(f'Для представления {stats.view_name} не задан бюджет запросов')
+
+		self.assertLessEqual(
+			stats.count, budget,
+			f'{stats.view_name}: {stats.count} SQL-запросов при бюджете {budget}'
+		)
+		return stats
+
+	def get_within_budget(self, view_name, args=None, kwargs=None, data=None, **extra):
+		"""GET-запрос к представлению по имени URL с проверкой бюджета и статуса ответа"""
+		response = self.client.get(reverse(view_name, args=args, kwargs=kwargs), data, **extra)
+		self.assertLess(response.status_code, 400, f'{view_name}: {response.status_code}')
+		self.assertQueryBudget(response)
+		return response
@@ -0,0 +1,153 @@
+from unittest import mock, skipIf
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from exhibition.models import Exhibitors, Portfolio
+from rating import api as rating_api
+from rating.models import Rating
+from .middleware import ReplicaRoutingMiddleware
+from .ratelimit import consume, get_bucket_keys
+from .routers import ReplicaRouter
+from .testing import REDIS_TEST_URL, redis_available
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+# фоновая запись карты сайта не должна писать в MEDIA_ROOT и занимать тестовую БД из другого потока
+SITEMAP_SETTINGS = override_settings(SITEMAP_AUTO_UPDATE=False)
+
+
+def setUpModule():
+	SITEMAP_SETTINGS.enable()
+
+
+def tearDownModule():
+	SITEMAP_SETTINGS.disable()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RateLimitTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		owner = Exhibitors(name='Участник', slug='limit-owner', email='limit-owner@example.com')
+		owner.save()
+		cls.portfolio = Portfolio(owner=owner, title='Проект')
+		cls.portfolio.save()
+		cls.voter = User.objects.create_user('limit-voter')
+
+	def setUp(self):
+		self.client.force_login(self.voter)
+
+	@mock.patch('crm.ratelimit.consume', return_value=7)
+	def test_limited_requests_get_429(self, consume):
+		response = self.client.post(reverse('rating:add-rating'), {'star': 4, 'portfolio': self.portfolio.pk})
+		self.assertEqual((response.status_code, response['Retry-After']), (429, '7'))
+		self.assertFalse(Rating.objects.exists())
+		consume.assert_called_once_with(
+			'rating', [f'ratelimit:rating:user:{self.voter.pk}', 'ratelimit:rating:ip:127.0.0.1']
+		)
+
+		async def auser():
+			return self.voter
+
+		request = AsyncRequestFactory().post('/', {'star': 4, 'portfolio': self.portfolio.pk})
+		request.auser = auser
+		response = async_to_sync(rating_api.AddRating.as_view())(request)
+		self.assertEqual(response.status_code, 429)
+
+		# GET и запросы при недоступном Redis не ограничиваются
+		consume.return_value = 0
+		response = self.client.post(reverse('rating:add-rating'), {'star': 4, 'portfolio': self.portfolio.pk})
+		self.assertEqual(response.status_code, 200)
+
+	def test_spoofed_forwarded_for_shares_bucket(self):
+		factory = RequestFactory()
+		# клиент подставляет свой X-Forwarded-For, nginx дописывает реальный адрес и X-Real-IP
+		requests = [
+			factory.post('/', HTTP_X_FORWARDED_FOR=f'10.0.0.{i}, 203.0.113.7', HTTP_X_REAL_IP='203.0.113.7')
+			for i in range(2)
+		]
+		requests.append(factory.post('/', HTTP_X_FORWARDED_FOR='10.0.0.9, 203.0.113.7'))
+		self.assertEqual(
+			{tuple(get_bucket_keys(request, 'rating', ('ip',))) for request in requests},
+			{('ratelimit:rating:ip:203.0.113.7',)}
+		)
+		self.assertEqual(get_bucket_keys(factory.post('/'), 'rating', ('ip',)), ['ratelimit:rating:ip:127.0.0.1'])
+
+	@skipIf(not redis_available(), 'Нужен Redis (REDIS_TEST_URL)')
+	@override_settings(RATE_LIMITS={'review': ('1/m', 2)})
+	def test_token_bucket(self):
+		redis_caches = {'default': {'BACKEND': 'django_redis.cache.RedisCache', 'LOCATION': REDIS_TEST_URL}}
+		with override_settings(CACHES=redis_caches):
+			from django_redis import get_redis_connection
+			get_redis_connection('default').delete('ratelimit:review:ip:1', 'ratelimit:review:ip:2')
+
+			self.assertEqual([consume('review', ['ratelimit:review:ip:1']) for _ in range(2)], [0, 0])
+			self.assertEqual(consume('review', ['ratelimit:review:ip:1']), 60)
+			# корзины независимы, но запрос списывает токены только если они есть во всех своих корзинах
+			self.assertEqual(consume('review', ['ratelimit:review:ip:2', 'ratelimit:review:ip:1']), 60)
+			self.assertEqual(consume('review', ['ratelimit:review:ip:2']), 0)
+
+
+@mock.patch('crm.middleware.get_replica_alias', return_value='replica')
+@mock.patch('crm.routers.get_replica_alias', return_value='replica')
+class ReplicaRoutingTests(SimpleTestCase):
+	# без TestCase: его транзакция сама по себе переключает чтение на основную БД
+	databases = {'default'}
+
+	def setUp(self):
+		self.factory = RequestFactory()
+		self.router = ReplicaRouter()
+
+	def handle(self, request, write=False):
+		"""Запрос через middleware; возвращает ответ и БД, выбранные для чтения до и после записи"""
+		databases = []
+
+		def view(request):
+			databases.append(self.router.db_for_read(Portfolio) or 'default')
+			if write:
+				self.router.db_for_write(Rating)
+				databases.append(self.router.db_for_read(Portfolio) or 'default')
+			return HttpResponse()
+
+		return ReplicaRoutingMiddleware(view)(request), databases
+
+	def test_public_reads_go_to_replica(self, *mocks):
+		response, databases = self.handle(self.factory.get('/projects/'))
+		self.assertEqual(databases, ['replica'])
+		self.assertNotIn(ReplicaRoutingMiddleware.PIN_COOKIE, response.cookies)
+		# вне запроса (фоновые задачи, команды) чтение идет с основной БД
+		self.assertIsNone(self.router.db_for_read(Portfolio))
+
+	def test_excluded_paths_and_transactions_use_primary(self, *mocks):
+		_, databases = self.handle(self.factory.get('/admin/exhibition/portfolio/'))
+		self.assertEqual(databases, ['default'])
+
+		def view(request):
+			with transaction.atomic():
+				databases.append(self.router.db_for_read(Portfolio) or 'default')
+			return HttpResponse()
+
+		databases = []
+		ReplicaRoutingMiddleware(view)(self.factory.get('/projects/'))
+		self.assertEqual(databases, ['default'])
+
+	def test_read_your_writes(self, *mocks):
+		response, databases = self.handle(self.factory.post('/rating/add/'), write=True)
+		self.assertEqual(databases, ['default', 'default'])
+		pin = response.cookies[ReplicaRoutingMiddleware.PIN_COOKIE].value
+
+		# запись в GET-запросе переключает чтение на основную БД до конца запроса
+		response, databases = self.handle(self.factory.get('/projects/'), write=True)
+		self.assertEqual(databases, ['replica', 'default'])
+		self.assertIn(ReplicaRoutingMiddleware.PIN_COOKIE, response.cookies)
+
+		# следующий запрос того же клиента читает с основной БД
+		request = self.factory.get('/projects/')
+		request.COOKIES[ReplicaRoutingMiddleware.PIN_COOKIE] = pin
+		_, databases = self.handle(request)
+		self.assertEqual(databases, ['default'])
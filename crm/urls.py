@@ -5,8 +5,7 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.views.generic.base import TemplateView
 
-from django.contrib.sitemaps.views import sitemap
-from exhibition.sitemap import sitemaps
+from exhibition.views import sitemap_index
 
 
 handler404 = 'exhibition.views.__404__'
@@ -20,7 +19,7 @@ urlpatterns = [
 	path('', include('blog.urls')),
 	re_path(r'^ckeditor/', include('ckeditor_uploader.urls')),
 	re_path(r'^chaining/', include('smart_selects.urls')),
-	re_path(r'^sitemap\.xml$', sitemap, {'sitemaps': sitemaps}, name='django.contrib.sitemaps.views.sitemap'),
+	re_path(r'^sitemap\.xml$', sitemap_index, name='sitemap-index'),
 	path('robots.txt', TemplateView.as_view(template_name="robots.txt", content_type='text/plain')),
 ]
 
@@ -1,6 +1,6 @@
 from itertools import chain
 
-from django.db.models import Q, OuterRef, Subquery, Prefetch, CharField, Case, When
+from django.db.models import Q, OuterRef, Subquery, Prefetch
 from django.db.models.expressions import F
 from django.http import Http404, JsonResponse
 from django.shortcuts import redirect
@@ -11,7 +11,7 @@ from django.views.generic.detail import DetailView
 
 from exhibition.logic import send_email
 from exhibition.mixins import MetaSeoMixin
-from exhibition.models import Categories, Nominations, Winners, Portfolio, Image
+from exhibition.models import Categories, Nominations, Winners, Portfolio
 from .forms import FeedbackForm
 from .models import Designer, Achievement
 
@@ -37,15 +37,7 @@ class MainPage(MetaSeoMixin, DetailView):
 
 		exh_portfolio = self.object.exh_portfolio.filter(status=True).annotate(
 			exh_year=F('exhibition__slug'),
-			win_year=Subquery(Winners.objects.filter(portfolio_id=OuterRef('pk')).values('exhibition__slug')[:1]),
-			project_cover=Case(
-				When(
-					Q(cover__exact='') | Q(cover__isnull=True),
-					then=Subquery(Image.objects.filter(portfolio_id=OuterRef('pk')).values('file')[:1])
-				),
-				default='cover',
-				output_field=CharField()
-			)
+			win_year=Subquery(Winners.objects.filter(portfolio_id=OuterRef('pk')).values('exhibition__slug')[:1])
 		).order_by('-exh_year')
 
 		victories = Nominations.objects.prefetch_related('nomination_for_winner').filter(
@@ -98,14 +90,6 @@ class PortfolioPage(MetaSeoMixin, DetailView):
 		).annotate(
 			exh_year=F('exhibition__slug'),
 			win_year=Subquery(Winners.objects.filter(portfolio_id=OuterRef('pk')).values('exhibition__slug')[:1]),
-			project_cover=Case(
-				When(
-					Q(cover__exact='') | Q(cover__isnull=True),
-					then=Subquery(Image.objects.filter(portfolio_id=OuterRef('pk')).values('file')[:1])
-				),
-				default='cover',
-				output_field=CharField()
-			),
 		).order_by('order')
 
 		exh_category = self.object.exh_portfolio.prefetch_related('nominations__category').annotate(
@@ -5,12 +5,15 @@ from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
-from django.shortcuts import redirect, render
-from django.urls import path
+from django.db.models import Prefetch
+from django.http import FileResponse, Http404, JsonResponse
+from django.shortcuts import redirect, render, get_object_or_404
+from django.urls import path, reverse
 from django.utils.html import format_html
 
 from blog.models import Article
 from rating.admin import RatingInline, ReviewInline
+from .cache import invalidate_exhibition_payload
 from .exports import ExportExhibitionAdmin
 from .forms import (
 	ExhibitionsForm, ImageForm, MetaSeoFieldsForm, MetaSeoForm, PortfolioAdminForm, PrepareWinnersForm
@@ -20,9 +23,9 @@ from .mixins import (
 )
 from .models import (
 	Categories, Exhibitors, Organizer, Jury, Partners, Events, Nominations, Exhibitions, Winners,
-	Portfolio, PortfolioAttributes, Gallery, Image, MetaSEO
+	Portfolio, PortfolioAttributes, Gallery, Image, MetaSEO, ExportJob
 )
-from .services import delete_cached_fragment, WinnersService
+from .services import delete_cached_fragment, WinnersService, ExhibitorSearchService
 
 admin.site.unregister(User)  # чтобы снять с регистрации модель User
 
@@ -163,6 +166,13 @@ class MetaSeoFieldsAdmin:
 class ExhibitorsAdmin(PersonAdminMixin, ProfileAdminMixin, MetaSeoFieldsAdmin, admin.ModelAdmin):
 	ordering = ('name',)
 
+	def get_search_results(self, request, queryset, search_term):
+		# виджеты автодополнения (участники выставки, владелец проекта) ищут по триграммному индексу
+		if 'autocomplete' in request.path and search_term:
+			return ExhibitorSearchService.search_queryset(queryset, search_term), False
+
+		return super().get_search_results(request, queryset, search_term)
+
 	def save_model(self, request, obj, form, change):
 		super().save_model(request, obj, form, change)
 
@@ -227,7 +237,8 @@ class ExhibitionsAdmin(ImagePreviewMixin, MediaWidgetMixin, MetaSeoFieldsAdmin,
 	list_display = ('title', 'date_start', 'date_end',)
 	list_display_links = ('title',)
 	search_fields = ('title',)
-	filter_horizontal = ('nominations', 'jury', 'partners', 'exhibitors',)
+	filter_horizontal = ('nominations', 'jury', 'partners',)
+	autocomplete_fields = ('exhibitors',)
 	date_hierarchy = 'date_start'
 	inlines = [EventsInlineAdmin, GalleryInlineAdmin, ]
 
@@ -265,12 +276,6 @@ class ExhibitionsAdmin(ImagePreviewMixin, MediaWidgetMixin, MetaSeoFieldsAdmin,
 
 		return queryset, use_distinct
 
-	# Отобразим список участников с указанием сортировки по новому полю
-	def formfield_for_manytomany(self, db_field, request, **kwargs):
-		if db_field.name == "exhibitors":
-			kwargs["queryset"] = Exhibitors.objects.order_by('name')
-		return super().formfield_for_manytomany(db_field, request, **kwargs)
-
 	def save_model(self, request, obj, form, change):
 		super().save_model(request, obj, form, change)
 
@@ -288,6 +293,7 @@ class ExhibitionsAdmin(ImagePreviewMixin, MediaWidgetMixin, MetaSeoFieldsAdmin,
 		delete_cached_fragment('exhibition_events', obj.slug)
 		delete_cached_fragment('exhibition_gallery', obj.slug)
 		delete_cached_fragment('exhibition_overlay', obj.slug)
+		invalidate_exhibition_payload(obj.id)
 		if not change:
 			delete_cached_fragment('exhibitions_list')
 
@@ -536,6 +542,7 @@ class PortfolioAdmin(ImagePreviewMixin, MediaWidgetMixin, MetaSeoFieldsAdmin, ad
 
 	list_display = ('id', 'title', 'exhibition', 'owner', 'nominations_list', 'status_field')
 	list_display_links = ('id', 'title')
+	list_select_related = ('exhibition', 'owner')
 	list_filter = ('nominations', 'owner', 'status')
 	search_fields = (
 		'title', 'owner__name', 'owner__user__first_name', 'owner__user__last_name', 'exhibition__title',
@@ -544,7 +551,7 @@ class PortfolioAdmin(ImagePreviewMixin, MediaWidgetMixin, MetaSeoFieldsAdmin, ad
 	ordering = ('-id',)
 
 	date_hierarchy = 'exhibition__date_start'
-	# autocomplete_fields = ('owner', 'exhibition')
+	autocomplete_fields = ('owner',)
 
 	fieldsets = (
 		('Основная информация', {
@@ -573,11 +580,17 @@ class PortfolioAdmin(ImagePreviewMixin, MediaWidgetMixin, MetaSeoFieldsAdmin, ad
 			# 'admin/js/portfolio_admin.js',
 		)
 
+	def get_queryset(self, request):
+		return super().get_queryset(request).prefetch_related(
+			Prefetch('nominations', queryset=Nominations.objects.only('id', 'title'))
+		)
+
 	@admin.display(description='Номинации', ordering="nominations__title", empty_value='')
 	def nominations_list(self, obj):
 		"""Отображение списка номинаций в админке"""
-		if obj.nominations.exists():
-			return ', '.join(obj.nominations.values_list('title', flat=True))
+		nominations = obj.nominations.all()
+		if nominations:
+			return ', '.join(nomination.title for nomination in nominations)
 		return 'Нет номинаций'
 
 	@admin.display(description='Видимость', boolean=True, ordering="status")
@@ -585,9 +598,6 @@ class PortfolioAdmin(ImagePreviewMixin, MediaWidgetMixin, MetaSeoFieldsAdmin, ad
 		return obj.status
 
 	def formfield_for_foreignkey(self, db_field, request, **kwargs):
-		if db_field.name == "owner":
-			kwargs["queryset"] = Exhibitors.objects.order_by('name')
-
 		if db_field.name == "exhibition":
 			kwargs["queryset"] = Exhibitions.objects.order_by('-date_start')
 
@@ -611,6 +621,9 @@ class PortfolioAdmin(ImagePreviewMixin, MediaWidgetMixin, MetaSeoFieldsAdmin, ad
 
 		Image.objects.bulk_update(images.values(), ['sort'])
 
+		# bulk_update не вызывает сигналы, а первое фото могло смениться
+		form.instance.refresh_cover()
+
 	def save_model(self, request, obj, form, change):
 		images = request.FILES.getlist('files')
 		obj.save(images=images)  # сохраним портфолио и связанные фотографии
@@ -703,3 +716,78 @@ class MetaAdmin(admin.ModelAdmin):
 		return post
 
 	root.short_description = 'Запись'
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+	list_display = ('title', 'status', 'progress', 'created_by', 'created_at', 'expires_at', 'download_link')
+	list_filter = ('kind', 'status')
+	date_hierarchy = 'created_at'
+	list_per_page = 20
+
+	change_form_template = 'admin/exhibition/export_job.html'
+
+	def has_add_permission(self, request):
+		return False
+
+	def has_change_permission(self, request, obj=None):
+		return False
+
+	@admin.display(description='Файл')
+	def download_link(self, obj):
+		if obj.is_available:
+			return format_html('<a href="{}">{}</a>', self.get_download_url(obj), obj.filename)
+		return '-'
+
+	def get_download_url(self, obj):
+		return reverse('admin:exhibition_exportjob_download', args=[obj.pk])
+
+	def get_urls(self):
+		urls = super().get_urls()
+		custom = [
+			path(
+				'<path:object_id>/status/',
+				self.admin_site.admin_view(self.job_status),
+				name='exhibition_exportjob_status'
+			),
+			path(
+				'<path:object_id>/download/',
+				self.admin_site.admin_view(self.download),
+				name='exhibition_exportjob_download'
+			),
+		]
+		return custom + urls
+
+	def get_job(self, request, object_id):
+		job = get_object_or_404(ExportJob, pk=object_id)
+		if not self.has_view_permission(request, job):
+			raise Http404
+		return job
+
+	def job_status(self, request, object_id):
+		"""Готовность задания для опроса со страницы выгрузки"""
+		job = self.get_job(request, object_id)
+		return JsonResponse({
+			'status': job.status,
+			'status_display': job.get_status_display(),
+			'progress': job.progress,
+			'error': job.error,
+			'download_url': self.get_download_url(job) if job.is_available else None,
+		})
+
+	def download(self, request, object_id):
+		"""Повторное скачивание готового файла без пересчета"""
+		job = self.get_job(request, object_id)
+		if not job.is_available:
+			raise Http404('Файл выгрузки удален или еще не сформирован')
+		return FileResponse(job.file.open('rb'), as_attachment=True, filename=job.filename)
+
+	def change_view(self, request, object_id, form_url='', extra_context=None):
+		job = self.get_job(request, object_id)
+		extra_context = {
+			**(extra_context or {}),
+			'job': job,
+			'status_url': reverse('admin:exhibition_exportjob_status', args=[job.pk]),
+			'download_url': self.get_download_url(job) if job.is_available else None,
+		}
+		return super().change_view(request, object_id, form_url, extra_context)
@@ -0,0 +1,155 @@
+"""
+Асинхронные версии JSON-эндпоинтов для развертывания на ASGI (uvicorn, см. README).
+Подключаются в urls.py при settings.ASYNC_VIEWS: запросы к БД идут через async ORM,
+к кэшу - через асинхронные методы, и воркер не простаивает в ожидании их ответа.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import BadRequest
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+
+from . import views
+from .mixins import ProjectsLazyLoadMixin
+from .models import Exhibitions, Exhibitors, Nominations
+from .services import ExhibitorSearchService
+
+
+@login_required
+async def search_exhibitors(request):
+	""" Автодополнение участников (ExhibitorSearchService) """
+	try:
+		limit = min(int(request.GET.get('limit', 50)), ExhibitorSearchService.MAX_RESULTS)
+	except ValueError:
+		raise BadRequest('Invalid limit')
+
+	results = await ExhibitorSearchService.asearch(
+		request.GET.get('q', ''),
+		limit=limit,
+		exhibition_id=request.GET.get('exhibition_id'),
+	)
+
+	return JsonResponse({'exhibitors': results})
+
+
+@login_required
+async def get_nominations_for_exhibition(request):
+	""" Номинации выбранной выставки """
+	exhibition_id = request.GET.get('exhibition_id')
+	selected_ids = request.GET.get('selected', '').split(',')
+
+	if not exhibition_id:
+		return JsonResponse({'nominations': []})
+
+	try:
+		nominations = Nominations.objects.filter(nominations_for_exh__id=exhibition_id).values('id', 'title')
+		nominations_data = [
+			{'id': nom['id'], 'title': nom['title'], 'selected': str(nom['id']) in selected_ids}
+			async for nom in nominations
+		]
+	except ValueError:
+		nominations_data = []
+
+	return JsonResponse({'nominations': nominations_data})
+
+
+@login_required
+async def get_exhibitions_by_owner(request):
+	""" Выставки выбранного участника """
+	owner_id = request.GET.get('owner_id')
+
+	if not owner_id:
+		return JsonResponse({'exhibitions': []})
+
+	try:
+		exhibitions = Exhibitions.objects.filter(
+			exhibitors__id=owner_id, exhibitors__status=True
+		).values('id', 'title', 'date_start', 'slug').order_by('-date_start')
+		exhibitions_data = [
+			{
+				'id': exh['id'],
+				'title': exh['title'],
+				'year': exh['date_start'].year if exh['date_start'] else '',
+				'date_start': exh['date_start'].strftime('%d-%m-%Y') if exh['date_start'] else '',
+				'slug': exh['slug'],
+			}
+			async for exh in exhibitions
+		]
+	except ValueError:
+		exhibitions_data = []
+
+	return JsonResponse({'exhibitions': exhibitions_data})
+
+
+@login_required
+async def get_exhibitors_by_exhibition(request):
+	""" Участники выбранной выставки """
+	exhibition_id = request.GET.get('exhibition_id')
+
+	if not exhibition_id:
+		return JsonResponse({'exhibitors': []})
+
+	try:
+		exhibitors = Exhibitors.objects.filter(exhibitors_for_exh__id=exhibition_id).values(
+			'id', 'name', 'user__first_name', 'user__last_name'
+		)
+		exhibitors_data = [
+			{
+				'id': exh['id'],
+				'name': exh['name'] or f"{exh['user__first_name']} {exh['user__last_name']}".strip(),
+			}
+			async for exh in exhibitors
+		]
+	except ValueError:
+		exhibitors_data = []
+
+	return JsonResponse({'exhibitors': exhibitors_data})
+
+
+async def lazy_load_projects(view_class, request, **kwargs):
+	"""
+	JSON-ответ подгрузки проектов (?page=/?cursor=) представления view_class.
+	Права пользователя и валидаторы условного GET проверяются прежними синхронными методами,
+	страница проектов читается через async ORM.
+	"""
+	request.user = await request.auser()
+
+	view = view_class()
+	await sync_to_async(view.setup)(request, **kwargs)
+	view.init_pagination(request)
+
+	validators = await sync_to_async(view.get_validators)(request)
+	etag = view.build_etag(request, validators)
+	response = get_conditional_response(request, etag=etag)
+
+	if response is None:
+		queryset = await sync_to_async(view.get_lazy_load_queryset)()
+		items = await view.apaginate_queryset(queryset)
+
+		# миниатюры без манифеста строятся на лету (sorl) - это синхронная работа с хранилищем
+		if all(item.get('cover_thumbs') or not item.get('project_cover') for item in items):
+			response = view.build_projects_response(items)
+		else:
+			response = await sync_to_async(view.build_projects_response)(items)
+
+	return view.patch_conditional_response(response, etag)
+
+
+_projects_list = sync_to_async(views.ProjectsList.as_view())
+_exhibitor_detail = sync_to_async(views.ExhibitorDetail.as_view())
+
+
+async def projects_list(request, slug):
+	""" Проекты категории: подгрузка - асинхронно, HTML-страница - прежним представлением """
+	if request.GET.getlist('filter-group') or ProjectsLazyLoadMixin.is_lazy_load_request(request):
+		return await lazy_load_projects(views.ProjectsList, request, slug=slug)
+
+	return await _projects_list(request, slug=slug)
+
+
+async def exhibitor_detail(request, slug):
+	""" Страница участника: подгрузка проектов - асинхронно, HTML-страница - прежним представлением """
+	if ProjectsLazyLoadMixin.is_lazy_load_request(request):
+		return await lazy_load_projects(views.ExhibitorDetail, request, slug=slug)
+
+	return await _exhibitor_detail(request, slug=slug)
@@ -9,6 +9,7 @@ class ExhibitionConfig(AppConfig):
 
 	def ready(self):
 		import exhibition.signals
+		from exhibition.search import defer_index_updates
 
 		Exhibtitors = self.get_model("Exhibitors")
 		watson.register(Exhibtitors, store=("description",))
@@ -21,10 +22,12 @@ class ExhibitionConfig(AppConfig):
 		Exhibtions = self.get_model("Exhibitions")
 		watson.register(Exhibtions, ExhibitionsAdapter)
 		Portfolio = self.get_model("Portfolio")
-		watson.register(Portfolio.objects.prefetch_related('images'), PortfolioAdapter)
+		watson.register(Portfolio.objects.select_related('owner').prefetch_related('images'), PortfolioAdapter)
 		Nominations = self.get_model("Nominations")
 		watson.register(Nominations, NominationsAdapter, fields=("category__title", "category__description", "category__logo"))
 
+		defer_index_updates(watson.default_search_engine)
+
 
 class ExhibitionsAdapter(watson.SearchAdapter):
 	def get_title(self, obj):
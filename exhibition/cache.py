@@ -1,9 +1,82 @@
+from django.core.cache import cache
+
 from exhibition.services import delete_cached_fragment
 from exhibition.models import Portfolio
 
+EXHIBITION_PAYLOAD_TIMEOUT = 86400
+
+
+def _exhibition_payload_version_key(exhibition_id):
+    return f'exhibition:payload:version:{exhibition_id}'
+
+
+def get_exhibition_payload_key(exhibition_id, role):
+    """Ключ данных страницы выставки для класса пользователей (role)"""
+    version = cache.get_or_set(_exhibition_payload_version_key(exhibition_id), 1, None)
+    return f'exhibition:payload:{exhibition_id}:{version}:{role}'
+
+
+def invalidate_exhibition_payload(exhibition_id):
+    """Сброс данных страницы выставки сразу для всех классов пользователей"""
+    if not exhibition_id:
+        return
+
+    try:
+        cache.incr(_exhibition_payload_version_key(exhibition_id))
+    except ValueError:
+        # версии еще нет - значит, и закэшированных данных нет
+        pass
+
+
+def _jury_report_version_key(exhibition_id):
+    return f'exhibition:jury-report:version:{exhibition_id}'
+
+
+def get_jury_report_key(exhibition_id):
+    """Ключ матрицы оценок жюри: меняется вместе с данными выставки и при каждой оценке жюри"""
+    payload_version = cache.get_or_set(_exhibition_payload_version_key(exhibition_id), 1, None)
+    ratings_version = cache.get_or_set(_jury_report_version_key(exhibition_id), 1, None)
+    return f'exhibition:jury-report:{exhibition_id}:{payload_version}:{ratings_version}'
+
+
+def invalidate_jury_report(exhibition_id):
+    """Сброс матрицы оценок жюри выставки (см. JuryReportService)"""
+    if not exhibition_id:
+        return
+
+    try:
+        cache.incr(_jury_report_version_key(exhibition_id))
+    except ValueError:
+        pass
+
+
+def _jury_progress_version_key(exhibition_id):
+    return f'exhibition:jury-progress:version:{exhibition_id}'
+
+
+def get_jury_progress_version(exhibition_id):
+    """Версия счетчиков голосования жюри: по ней поток панели прогресса узнает об изменениях без запросов к БД"""
+    return cache.get_or_set(_jury_progress_version_key(exhibition_id), 1, None)
+
+
+async def aget_jury_progress_version(exhibition_id):
+    return await cache.aget_or_set(_jury_progress_version_key(exhibition_id), 1, None)
+
+
+def invalidate_jury_progress(exhibition_id):
+    """Счетчики голосования жюри изменились (см. JuryProgressService)"""
+    if not exhibition_id:
+        return
+
+    try:
+        cache.incr(_jury_progress_version_key(exhibition_id))
+    except ValueError:
+        pass
+
 
 def invalidate_portfolio_cache(portfolio: "Portfolio"):
     owner = portfolio.owner
+    invalidate_exhibition_payload(portfolio.exhibition_id)
 
     delete_cached_fragment('portfolio_list', owner.slug, portfolio.project_id, True)
     delete_cached_fragment('portfolio_list', owner.slug, portfolio.project_id, False)
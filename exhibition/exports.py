@@ -1,21 +1,182 @@
+import tempfile
 from io import BytesIO
 from urllib.parse import quote
 
+from django.conf import settings
 from django.contrib import admin
-from django.db import models
-from django.http import HttpResponse
-from django.shortcuts import render, get_object_or_404
+from django.http import HttpResponse, FileResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import redirect, render, get_object_or_404
 from django.urls import path, reverse
 from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, Border, Side
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, Border, Side, NamedStyle
 from openpyxl.utils import get_column_letter
 
-from exhibition.models import Exhibitions, Portfolio
-from rating.models import Rating
+from exhibition.models import Exhibitions
+from exhibition.jobs import register_export, start_export
+from exhibition.services import JuryReportService, JuryProgressService
+
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def get_report_styles():
+	"""Именованные стили протокола: в xlsx хранятся один раз, ячейки ссылаются на них по имени"""
+	center = Alignment(horizontal='center', vertical='center', wrap_text=True)
+	left = Alignment(horizontal='left', vertical='center', wrap_text=True)
+	thin = Side(style='thin')
+	border = Border(left=thin, right=thin, top=thin, bottom=thin)
+
+	def font(**kwargs):
+		return Font(name='Calibri', size=kwargs.pop('size', 11), **kwargs)
+
+	return [
+		NamedStyle('report_title', font=font(bold=True, size=15), alignment=center),
+		NamedStyle('report_subtitle', font=font(bold=True, size=14), alignment=center),
+		NamedStyle('nomination_title', font=font(bold=True, size=13), alignment=left),
+		NamedStyle('header', font=font(bold=True), alignment=center),
+		NamedStyle('table_header', font=font(bold=True), alignment=center, border=border),
+		NamedStyle('cell_left', font=font(), alignment=left),
+		NamedStyle('cell_center', font=font(), alignment=center),
+		NamedStyle('table_left', font=font(), alignment=left, border=border),
+		NamedStyle('table_center', font=font(), alignment=center, border=border),
+		NamedStyle('table_cell', font=font(), border=border),
+		NamedStyle('table_winner', font=font(bold=True), alignment=center, border=border),
+	]
+
+
+class JuryReportWriter:
+	"""
+	Потоковая запись протокола жюри: openpyxl в режиме write_only сбрасывает строки
+	во временные xml-файлы по мере добавления, стили ячеек - общие именованные.
+	Содержимое совпадает с ExportExhibitionAdmin._generate_excel_report.
+	"""
+
+	def __init__(self, report_data):
+		self.report_data = report_data
+		self.wb = Workbook(write_only=True)
+		for style in get_report_styles():
+			self.wb.add_named_style(style)
+
+	def cell(self, ws, value, style=None):
+		cell = WriteOnlyCell(ws, value=value)
+		if style:
+			cell.style = style
+		return cell
+
+	def save(self, fileobj, progress=None):
+		"""progress(percent) - необязательный обработчик готовности (см. exhibition.jobs)"""
+		for percent, write_sheet in (
+			(70, self.write_results_sheet),
+			(80, self.write_winners_summary_sheet),
+			(90, self.write_jury_control_sheet),
+		):
+			write_sheet()
+			if progress:
+				progress(percent)
+		self.wb.save(fileobj)
+
+	def write_results_sheet(self):
+		ws = self.wb.create_sheet(title='Итоги')
+		jury_list = self.report_data['jury_list']
+
+		total_col = len(jury_list) + 2
+		max_col = total_col + 1
+		winner_col = max_col + 1
+		total_letter = get_column_letter(total_col)
+		max_letter = get_column_letter(max_col)
+
+		# размеры колонок задаются до первой строки
+		for col in range(1, winner_col + 1):
+			ws.column_dimensions[get_column_letter(col)].width = 18
+		ws.column_dimensions[max_letter].hidden = True
+
+		row = 1
+		ws.merged_cells.add(f'A{row}:{get_column_letter(winner_col)}{row}')
+		ws.append([self.cell(ws, self.report_data['title'] or 'ИТОГОВЫЙ ПРОТОКОЛ ЖЮРИ', 'report_title')])
+		ws.append([])
+		row += 2
+
+		headers = ['Проект'] + [jury.name or jury.user_name for jury in jury_list] + ['Ср.балл', 'Макс.', 'Победитель']
+
+		for nomination in self.report_data['nominations']:
+			ws.merged_cells.add(f'A{row}:{get_column_letter(winner_col)}{row}')
+			ws.append([self.cell(ws, f"Номинация: {nomination['title']}", 'nomination_title')])
+			ws.append([self.cell(ws, title, 'table_header') for title in headers])
+			row += 2
+
+			projects = nomination['top_projects'] + nomination['other_projects']
+			start_row, end_row = row, row + len(projects) - 1
+			max_formula = f"=MAX(${total_letter}${start_row}:${total_letter}${end_row})"
+
+			for project in projects:
+				scores = [project['jury_scores'].get(jury.id) for jury in jury_list]
+				average = (
+					f"=IFERROR(AVERAGE(B{row}:{get_column_letter(total_col - 1)}{row}),0)" if jury_list else 0
+				)
+				ws.append(
+					[self.cell(ws, str(project['portfolio']), 'table_left')]
+					+ [self.cell(ws, score, 'table_center') for score in scores]
+					+ [
+						self.cell(ws, average, 'table_center'),
+						self.cell(ws, max_formula, 'table_cell'),
+						self.cell(ws, f'=IF({total_letter}{row}={max_letter}{row},"①","")', 'table_winner'),
+					]
+				)
+				row += 1
+
+			ws.append([])
+			ws.append([])
+			row += 2
+
+	def write_winners_summary_sheet(self):
+		ws = self.wb.create_sheet(title='Сводка победителей')
+		for letter, width in (('A', 60), ('B', 40), ('C', 10)):
+			ws.column_dimensions[letter].width = width
+
+		ws.merged_cells.add('A1:C1')
+		ws.append([self.cell(ws, 'СВОДКА ПОБЕДИТЕЛЕЙ', 'report_title')])
+		ws.append([])
+		ws.append([self.cell(ws, title, 'header') for title in ('Номинация', 'Проект', 'Баллы')])
+
+		for nomination in self.report_data['nominations']:
+			for winner in nomination['winners']:
+				ws.append([
+					self.cell(ws, nomination['title'], 'cell_left'),
+					self.cell(ws, str(winner['portfolio']), 'cell_left'),
+					self.cell(ws, winner['score'], 'cell_center'),
+				])
+
+	def write_jury_control_sheet(self):
+		ws = self.wb.create_sheet(title='Контроль жюри')
+		for letter, width in (('A', 30), ('B', 35), ('C', 14), ('D', 14), ('E', 14)):
+			ws.column_dimensions[letter].width = width
+
+		ws.merged_cells.add('A1:E1')
+		ws.append([self.cell(ws, 'КОНТРОЛЬ ГОЛОСОВАНИЯ ЖЮРИ', 'report_subtitle')])
+		ws.append([])
+		ws.append([
+			self.cell(ws, title, 'header') for title in ('Жюри', 'Номинация', 'Проголосовано', 'Должно', 'Пропущено')
+		])
+
+		for item in self.report_data['not_voted_jury'].values():
+			jury_name = item['jury'].name or item['jury'].user_name
+			for nom in item['nominations']:
+				ws.append([
+					self.cell(ws, jury_name, 'cell_left'),
+					self.cell(ws, nom['nomination'].title, 'cell_left'),
+					self.cell(ws, nom['voted'], 'cell_center'),
+					self.cell(ws, nom['total'], 'cell_center'),
+					self.cell(ws, nom['missing'], 'cell_center'),
+				])
 
 
 class ExportExhibitionAdmin(admin.ModelAdmin):
 	DEFAULT_PROJECTS_PER_NOMINATION = 3
+	# потоковая выгрузка (JuryReportWriter) вместо сборки всей книги в памяти
+	STREAMING_EXPORT = True
+	# файл формируется фоновым заданием (exhibition.jobs), страница задания показывает готовность
+	BACKGROUND_EXPORT = True
 
 	def get_urls(self):
 		urls = super().get_urls()
@@ -27,7 +188,24 @@ class ExportExhibitionAdmin(admin.ModelAdmin):
 				self.admin_site.admin_view(self.export_jury_ratings),
 				name='%s_%s_export_jury_ratings' % info,
 			),
+			path(
+				'<path:object_id>/jury-progress/',
+				self.admin_site.admin_view(self.jury_progress),
+				name='%s_%s_jury_progress' % info,
+			),
+			path(
+				'<path:object_id>/jury-progress/state/',
+				self.admin_site.admin_view(self.jury_progress_state),
+				name='%s_%s_jury_progress_state' % info,
+			),
 		]
+		if settings.ASYNC_VIEWS:
+			# долгий поток только на ASGI: синхронный воркер занимался бы им целиком
+			custom_urls.append(path(
+				'<path:object_id>/jury-progress/stream/',
+				self.admin_site.admin_view(self.jury_progress_stream),
+				name='%s_%s_jury_progress_stream' % info,
+			))
 		return custom_urls + urls
 
 	def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
@@ -36,25 +214,9 @@ class ExportExhibitionAdmin(admin.ModelAdmin):
 			extra_context['show_export_button'] = True
 			info = self.model._meta.app_label, self.model._meta.model_name
 			extra_context['export_url'] = reverse('admin:%s_%s_export_jury_ratings' % info, args=[object_id])
+			extra_context['progress_url'] = reverse('admin:%s_%s_jury_progress' % info, args=[object_id])
 		return super().changeform_view(request, object_id, form_url, extra_context)
 
-	@staticmethod
-	def _get_ratings_map(exhibition):
-		ratings = (
-			Rating.objects
-			.filter(
-				portfolio__exhibition=exhibition,
-				is_jury_rating=True
-			)
-			.values('portfolio_id', 'user_id')
-			.annotate(score=models.Sum('star'))
-		)
-
-		return {
-			(r['portfolio_id'], r['user_id']): r['score']
-			for r in ratings
-		}
-
 	def export_jury_ratings(self, request, object_id):
 		"""Страница экспорта оценок жюри"""
 		exhibition = get_object_or_404(Exhibitions, pk=object_id)
@@ -71,24 +233,38 @@ class ExportExhibitionAdmin(admin.ModelAdmin):
 			if not filename:
 				filename = f"jury_ratings_{exhibition.slug}"
 
+			if not filename.lower().endswith('.xlsx'):
+				filename += '.xlsx'
+
+			if self.BACKGROUND_EXPORT:
+				job = start_export(
+					'jury_ratings',
+					{'exhibition_id': exhibition.pk, 'limit': projects_per_nom},
+					filename,
+					user=request.user,
+					title=f'Протокол оценок жюри: {exhibition.title}',
+				)
+				return redirect('admin:exhibition_exportjob_change', job.pk)
+
 			# Получаем те же данные, что и для HTML
 			report_data = self._get_report_data(exhibition, projects_per_nom)
 
+			if self.STREAMING_EXPORT:
+				# файл отдается частями из временного файла, без копии книги в памяти
+				output = tempfile.TemporaryFile()
+				JuryReportWriter(report_data).save(output)
+				output.seek(0)
+				return FileResponse(output, as_attachment=True, filename=filename, content_type=XLSX_CONTENT_TYPE)
+
 			wb = self._generate_excel_report(report_data)
 
 			output = BytesIO()
 			wb.save(output)
 			output.seek(0)
 
-			if not filename.lower().endswith('.xlsx'):
-				filename += '.xlsx'
-
 			encoded_filename = quote(filename)
 
-			response = HttpResponse(
-				output.read(),
-				content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-			)
+			response = HttpResponse(output.read(), content_type=XLSX_CONTENT_TYPE)
 			response['Content-Disposition'] = (
 				f"attachment; filename*=UTF-8''{encoded_filename}"
 			)
@@ -113,169 +289,54 @@ class ExportExhibitionAdmin(admin.ModelAdmin):
 			context
 		)
 
-	def _get_report_data(self, exhibition, projects_per_nomination):
-		from django.db.models import Avg, Count
-
-		jury_list = list(exhibition.jury.select_related('user'))
-		jury_ids = [j.user_id for j in jury_list]
-
-		# --- Агрегированные оценки жюри по всем проектам сразу ---
-		jury_stats_map = {
-			item['portfolio_id']: {
-				'avg': item['avg'] or 0,
-				'count': item['count'] or 0,
-			}
-			for item in (
-				Rating.objects
-				.filter(
-					portfolio__exhibition=exhibition,
-					is_jury_rating=True,
-					user_id__in=jury_ids
-				)
-				.values('portfolio_id')
-				.annotate(
-					avg=Avg('star'),
-					count=Count('star')
-				)
-			)
-		}
-
-		# --- Карта индивидуальных оценок (для Excel поимённо) ---
-		ratings_map = self._get_ratings_map(exhibition)
-
-		portfolios = (
-			Portfolio.objects
-			.filter(exhibition=exhibition, status=True)
-			.prefetch_related('nominations')
-			.select_related('owner')
-		)
-
-		portfolios_by_nom = {}
-		for p in portfolios:
-			for nom in p.nominations.all():
-				portfolios_by_nom.setdefault(nom.id, []).append(p)
+	def jury_progress(self, request, object_id):
+		"""
+		Панель прогресса голосования жюри. На ASGI обновляется потоком jury_progress_stream,
+		на WSGI страница опрашивает jury_progress_state
+		"""
+		exhibition = get_object_or_404(Exhibitions, pk=object_id)
+		info = self.model._meta.app_label, self.model._meta.model_name
 
-		report_data = {
-			'title': f'Протокол оценок жюри: {exhibition.title}',
-			'jury_list': jury_list,
-			'nominations': [],
-			'jury_stats': {},
-			'not_voted_jury': {},
-			'total_stats': {
-				'total_jury': len(jury_list),
-				'total_nominations': exhibition.nominations.count(),
-				'total_projects': 0,
-				'total_ratings': 0,
-			}
+		context = {
+			**self.admin_site.each_context(request),
+			'title': f'Прогресс голосования жюри: {exhibition.title}',
+			'exhibition': exhibition,
+			'progress': JuryProgressService.get_state(exhibition.pk),
+			'version': JuryProgressService.get_version(exhibition.pk),
+			'state_url': reverse('admin:%s_%s_jury_progress_state' % info, args=[exhibition.pk]),
+			'stream_url': reverse(
+				'admin:%s_%s_jury_progress_stream' % info, args=[exhibition.pk]
+			) if settings.ASYNC_VIEWS else '',
+			'poll_interval': JuryProgressService.POLL_INTERVAL * 1000,
+			'opts': self.model._meta,
 		}
 
-		# --- Статистика по жюри ---
-		jury_vote_totals = (
-			Rating.objects
-			.filter(
-				portfolio__exhibition=exhibition,
-				is_jury_rating=True,
-				user_id__in=jury_ids
-			)
-			.values('user_id')
-			.annotate(count=Count('id'))
-		)
-
-		jury_vote_map = {item['user_id']: item['count'] for item in jury_vote_totals}
-
-		for jury in jury_list:
-			count = jury_vote_map.get(jury.user_id, 0)
-
-			report_data['jury_stats'][jury.id] = {
-				'name': jury.name or jury.user_name
-			}
+		return render(request, 'admin/exhibition/jury_progress.html', context)
 
-			report_data['total_stats']['total_ratings'] += count
+	def jury_progress_state(self, request, object_id):
+		"""Один снимок состояния панели; 204 без запросов к БД, если версия счетчиков не изменилась"""
+		version = JuryProgressService.get_version(object_id)
+		if request.GET.get('version') == version:
+			return HttpResponse(status=204)
 
-			report_data['not_voted_jury'][jury.id] = {
-				'jury': jury,
-				'nominations': [],
-				'total_missing': 0
-			}
+		exhibition = get_object_or_404(Exhibitions.objects.only('id'), pk=object_id)
+		return JsonResponse({'version': version, 'state': JuryProgressService.get_state(exhibition.pk)})
 
-		# --- По номинациям ---
-		for nomination in exhibition.nominations.all():
-			projects_data = []
-			jury_vote_counter = {j.id: 0 for j in jury_list}
-
-			portfolios_in_nom = portfolios_by_nom.get(nomination.id, [])
-
-			for portfolio in portfolios_in_nom:
-				stats = jury_stats_map.get(portfolio.id, {'avg': 0, 'count': 0})
-
-				# исключаем проекты без голосов
-				# if stats['count'] == 0:
-				# 	continue
-
-				jury_scores = {}
-				for jury in jury_list:
-					score = ratings_map.get((portfolio.id, jury.user.id))
-					jury_scores[jury.id] = score
-					if score is not None:
-						jury_vote_counter[jury.id] += 1
-
-				projects_data.append({
-					'portfolio': portfolio,
-					'jury_scores': jury_scores,
-					'total_score': round(stats['avg'], 2),
-					'votes': stats['count'],
-				})
-
-			# --- Сортировка ---
-			projects_data.sort(key=lambda x: (x['total_score'], x['votes']), reverse=True)
-
-			# --- Победители ---
-			winners = []
-
-			if projects_data:
-				max_score = projects_data[0]['total_score']
-
-				winners = [{
-					'portfolio': p['portfolio'],
-					'score': p['total_score'],
-					'medal': 'gold',
-					'position': 1
-				} for p in projects_data
-					if p['total_score'] == max_score and p['votes'] > 0
-				]
-
-			# --- Контроль непроголосовавших ---
-			for jury in jury_list:
-				expected = len(projects_data)
-				actual = jury_vote_counter[jury.id]
-
-				if actual < expected:
-					report_data['not_voted_jury'][jury.id]['nominations'].append({
-						'nomination': nomination,
-						'voted': actual,
-						'total': expected,
-						'missing': expected - actual
-					})
-					report_data['not_voted_jury'][jury.id]['total_missing'] += expected - actual
-
-			report_data['nominations'].append({
-				'title': nomination.title,
-				'all_projects': len(projects_data),
-				'top_projects': projects_data[:projects_per_nomination],
-				'other_projects': projects_data[projects_per_nomination:],
-				'winners': winners,
-				'jury_counts': jury_vote_counter,
-			})
-
-			report_data['total_stats']['total_projects'] += len(projects_data)
-
-		# убрать тех, у кого нет пропусков
-		report_data['not_voted_jury'] = {
-			k: v for k, v in report_data['not_voted_jury'].items()
-			if v['total_missing'] > 0
-		}
+	def jury_progress_stream(self, request, object_id):
+		"""Server-Sent Events (только ASGI): состояние панели при каждом изменении счетчиков жюри"""
+		exhibition = get_object_or_404(Exhibitions.objects.only('id'), pk=object_id)
+		response = StreamingHttpResponse(
+			JuryProgressService.astream(exhibition.pk, request.headers.get('Last-Event-ID')),
+			content_type='text/event-stream',
+		)
+		response['Cache-Control'] = 'no-cache'
+		# nginx не должен буферизовать поток
+		response['X-Accel-Buffering'] = 'no'
+		return response
 
-		return report_data
+	def _get_report_data(self, exhibition, projects_per_nomination):
+		# HTML-страница и Excel-выгрузка строятся из одной кэшированной матрицы оценок
+		return JuryReportService.get_report_data(exhibition, projects_per_nomination)
 
 	@staticmethod
 	def _add_jury_control_sheet(wb, report_data):
@@ -482,3 +543,13 @@ class ExportExhibitionAdmin(admin.ModelAdmin):
 
 		return wb
 
+
+@register_export(
+	'jury_ratings', 'Протокол оценок жюри',
+	version=lambda params: JuryReportService.get_export_version(params['exhibition_id']),
+)
+def export_jury_ratings(params, fileobj, progress):
+	exhibition = Exhibitions.objects.get(pk=params['exhibition_id'])
+	report_data = JuryReportService.get_report_data(exhibition, params['limit'])
+	progress(50)
+	JuryReportWriter(report_data).save(fileobj, progress)
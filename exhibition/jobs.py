@@ -0,0 +1,197 @@
+import hashlib
+import json
+import logging
+import os
+import secrets
+import shutil
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ExportJob
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FOLDER = 'exports/'
+# задания, не завершившиеся за это время (процесс перезапущен во время выгрузки), считаются ошибочными
+EXPORT_JOB_TIMEOUT = timedelta(hours=1)
+
+_exporters = {}
+
+
+def get_export_ttl():
+	return timedelta(seconds=getattr(settings, 'EXPORT_RESULTS_TTL', 24 * 3600))
+
+
+def register_export(kind, title, version=None):
+	"""
+	Регистрирует выгрузку: func(params, fileobj, progress) пишет файл в fileobj
+	и сообщает готовность вызовом progress(percent).
+	version(params) - версия исходных данных: пока она не изменилась, готовый файл отдается повторно.
+	"""
+	def decorator(func):
+		_exporters[kind] = {'func': func, 'title': title, 'version': version}
+		return func
+
+	return decorator
+
+
+def get_exporter(kind):
+	if kind not in _exporters:
+		raise ValueError(f"Unknown export kind: {kind}")
+
+	return _exporters[kind]
+
+
+def get_job_key(kind, params):
+	exporter = get_exporter(kind)
+	version = exporter['version'](params) if exporter['version'] else ''
+	payload = json.dumps([kind, params, version], sort_keys=True, ensure_ascii=False, default=str)
+	return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def start_export(kind, params, filename, user=None, title=None):
+	"""
+	Ставит выгрузку в очередь и возвращает задание. Если выгрузка с теми же параметрами
+	уже формируется или готова и данные не изменились, возвращается существующее задание.
+	"""
+	exporter = get_exporter(kind)
+	key = get_job_key(kind, params)
+
+	job = ExportJob.objects.filter(
+		Q(status__in=[ExportJob.PENDING, ExportJob.RUNNING]) |
+		Q(status=ExportJob.DONE, expires_at__gt=timezone.now()),
+		key=key,
+	).first()
+
+	if job:
+		if job.filename != filename:
+			job.filename = filename
+			job.save(update_fields=['filename'])
+		return job
+
+	job = ExportJob.objects.create(
+		kind=kind,
+		title=title or exporter['title'],
+		params=params,
+		key=key,
+		filename=filename,
+		created_by=user if user and user.is_authenticated else None,
+	)
+	transaction.on_commit(lambda: schedule_export_job(job.pk))
+	return job
+
+
+def get_job_path(job):
+	"""Путь файла относительно MEDIA_ROOT: случайный каталог, чтобы ссылку на файл нельзя было подобрать"""
+	extension = os.path.splitext(job.filename)[1]
+	return f'{EXPORT_FOLDER}{secrets.token_hex(8)}/{job.pk}{extension}'
+
+
+def run_export_job(job_id):
+	"""Формирует файл задания. Задание забирает только один процесс, возвращает True, если оно выполнено"""
+	claimed = ExportJob.objects.filter(pk=job_id, status=ExportJob.PENDING).update(status=ExportJob.RUNNING)
+	if not claimed:
+		return False
+
+	job = ExportJob.objects.get(pk=job_id)
+	name = get_job_path(job)
+	path = os.path.join(settings.MEDIA_ROOT, name)
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+
+	last_progress = 0
+
+	def progress(percent):
+		nonlocal last_progress
+		percent = max(0, min(int(percent), 99))
+		if percent > last_progress:
+			last_progress = percent
+			ExportJob.objects.filter(pk=job_id).update(progress=percent)
+
+	try:
+		with open(path, 'wb') as fileobj:
+			get_exporter(job.kind)['func'](job.params, fileobj, progress)
+	except Exception as e:
+		logger.error(f"Error running export job {job_id} ({job.kind}): {e}")
+		shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+		ExportJob.objects.filter(pk=job_id).update(
+			status=ExportJob.FAILED, error=str(e), finished_at=timezone.now()
+		)
+		return False
+
+	finished_at = timezone.now()
+	ExportJob.objects.filter(pk=job_id).update(
+		status=ExportJob.DONE,
+		progress=100,
+		file=name,
+		finished_at=finished_at,
+		expires_at=finished_at + get_export_ttl(),
+	)
+	return True
+
+
+def delete_job_file(job):
+	if job.file:
+		shutil.rmtree(os.path.dirname(job.file.path), ignore_errors=True)
+
+
+def cleanup_export_jobs():
+	"""Удаляет задания с истекшим сроком хранения (файлы удаляются сигналом) и старые ошибочные задания"""
+	now = timezone.now()
+	ExportJob.objects.filter(
+		status__in=[ExportJob.PENDING, ExportJob.RUNNING], created_at__lte=now - EXPORT_JOB_TIMEOUT
+	).update(status=ExportJob.FAILED, error='Превышено время формирования выгрузки', finished_at=now)
+
+	expired = ExportJob.objects.filter(
+		Q(status=ExportJob.DONE, expires_at__lte=now) |
+		Q(status=ExportJob.FAILED, created_at__lte=now - get_export_ttl())
+	)
+	count = 0
+	for job in expired:
+		job.delete()
+		count += 1
+
+	return count
+
+
+_pending_jobs = []
+_pending_lock = threading.Lock()
+_worker_running = False
+
+
+def schedule_export_job(job_id):
+	"""Фоновое выполнение: задания процесса выполняются по очереди одним потоком"""
+	global _worker_running
+
+	with _pending_lock:
+		if job_id not in _pending_jobs:
+			_pending_jobs.append(job_id)
+		if _worker_running:
+			return
+		_worker_running = True
+
+	threading.Thread(target=_run_pending_export_jobs, daemon=True).start()
+
+
+def _run_pending_export_jobs():
+	global _worker_running
+
+	try:
+		while True:
+			with _pending_lock:
+				if not _pending_jobs:
+					_worker_running = False
+					return
+				job_id = _pending_jobs.pop(0)
+
+			try:
+				run_export_job(job_id)
+				cleanup_export_jobs()
+			except Exception as e:
+				logger.error(f"Error processing export job {job_id}: {e}")
+	finally:
+		connections.close_all()
@@ -11,6 +11,7 @@ from sys import getsizeof
 import PIL
 from PIL import Image as PILImage, ImageOps
 from django.core.files.base import ContentFile
+from django.db import transaction
 from django.db.models.fields.files import ImageFieldFile
 from django.http import HttpResponse
 from django.conf import settings
@@ -109,6 +110,41 @@ def process_image(
 	)
 
 
+def optimize_image_fields(obj, field_names, to_webp=True):
+	""" Оптимизация изображений в полях объекта без сохранения в БД. Возвращает True, если файлы заменены """
+	updated = False
+	for field_name in field_names:
+		field = getattr(obj, field_name, None)
+		if not field or not field.name:
+			continue
+
+		# Проверяем, что это изображение (не SVG и т.д.)
+		ext = path.splitext(field.name)[1].lower()
+		if ext not in ALLOWED_IMAGE_EXTENSIONS:
+			continue
+
+		try:
+			field.seek(0)  # перематываем на начало
+			result = process_image(
+				field,
+				force_format='WEBP' if to_webp else 'JPEG'
+			)
+
+			# Сохраняем обработанный файл в таблицу
+			new_name = field.name.rsplit('.', 1)[0] + result.extension
+			field.save(
+				new_name,
+				ContentFile(result.buffer.read()),
+				save=False
+			)
+			updated = True
+
+		except Exception as e:
+			logger.error(f"Error optimizing {field_name}: {e}")
+
+	return updated
+
+
 def optimize_image_fields_async(instance, field_names, to_webp=True):
 	pk = instance.pk
 	model = instance.__class__
@@ -116,40 +152,89 @@ def optimize_image_fields_async(instance, field_names, to_webp=True):
 	def worker():
 		obj = model.objects.get(pk=pk)
 
-		updated = False
-		for field_name in field_names:
-			field = getattr(obj, field_name, None)
-			if not field or not field.name:
-				continue
+		if optimize_image_fields(obj, field_names, to_webp=to_webp):
+			obj.save(update_fields=field_names)
 
-			# Проверяем, что это изображение (не SVG и т.д.)
-			ext = path.splitext(field.name)[1].lower()
-			if ext not in ALLOWED_IMAGE_EXTENSIONS:
-				continue
+	# поток читает объект из БД, поэтому запускается после фиксации транзакции сохранения
+	transaction.on_commit(lambda: Thread(target=worker, daemon=True).start())
 
-			try:
-				field.seek(0)  # перематываем на начало
-				result = process_image(
-					field,
-					force_format='WEBP' if to_webp else 'JPEG'
-				)
 
-				# Сохраняем обработанный файл в таблицу
-				new_name = field.name.rsplit('.', 1)[0] + result.extension
-				field.save(
-					new_name,
-					ContentFile(result.buffer.read()),
-					save=False
-				)
-				updated = True
+def optimize_images_batch(model, pks, field_names, to_webp=True, on_complete=None):
+	"""
+	Оптимизация пакета объектов с сохранением одним bulk_update.
+	bulk_update не вызывает сигналы, поэтому зависимые данные обновляются в on_complete.
+	Возвращает список замененных объектов
+	"""
+	updated = [
+		obj for obj in model.objects.filter(pk__in=pks)
+		if optimize_image_fields(obj, field_names, to_webp=to_webp)
+	]
 
-			except Exception as e:
-				logger.error(f"Error optimizing {field_name}: {e}")
+	if updated:
+		model.objects.bulk_update(updated, list(field_names))
+		if on_complete:
+			on_complete(updated)
 
-		if updated:
-			obj.save(update_fields=field_names)
+	return updated
 
-	Thread(target=worker, daemon=True).start()
+
+def optimize_images_batch_async(model, pks, field_names, to_webp=True, on_complete=None):
+	""" Один фоновый поток на пакет загруженных изображений """
+	pks = list(pks)
+
+	def worker():
+		try:
+			optimize_images_batch(model, pks, field_names, to_webp=to_webp, on_complete=on_complete)
+		except Exception as e:
+			logger.error(f"Error optimizing images batch of {model.__name__}: {e}")
+
+	# строки пакета видны потоку только после фиксации транзакции, в которой они вставлены
+	transaction.on_commit(lambda: Thread(target=worker, daemon=True).start())
+
+
+def build_cover_thumbs(cover):
+	""" Манифест миниатюр обложки для карточек проектов """
+	default_quality = getattr(settings, 'THUMBNAIL_QUALITY', 85)
+
+	mini = get_thumbnail(cover, '100x100', crop='center', quality=75)
+	xs = get_thumbnail(cover, '320', quality=default_quality)
+	sm = get_thumbnail(cover, '576', quality=default_quality)
+
+	return {
+		'thumb_mini': settings.MEDIA_URL + str(mini),
+		'thumb_xs': settings.MEDIA_URL + str(xs),
+		'thumb_sm': settings.MEDIA_URL + str(sm),
+		'thumb_xs_w': 320,
+		'thumb_sm_w': 576,
+	}
+
+
+def update_cover_thumbs(pk, cover, model=None):
+	""" Генерация миниатюр обложки и сохранение манифеста в портфолио, если обложка не сменилась """
+	if model is None:
+		from .models import Portfolio as model
+
+	try:
+		thumbs = build_cover_thumbs(cover)
+	except Exception as e:
+		logger.error(f"Error building cover thumbnails for portfolio {pk}: {e}")
+		return False
+
+	# обложка могла смениться, пока генерировались миниатюры
+	if model.objects.filter(pk=pk, project_cover=cover).update(cover_thumbs=thumbs):
+		from .services import CategoryRankingService
+		CategoryRankingService.refresh([pk])
+		return True
+
+	return False
+
+
+def update_cover_thumbs_async(instance):
+	""" То же в фоне после фиксации транзакции, иначе поток не увидит новую обложку (см. update_cover_thumbs) """
+	thread = Thread(
+		target=update_cover_thumbs, args=(instance.pk, instance.project_cover, instance.__class__), daemon=True
+	)
+	transaction.on_commit(thread.start)
 
 
 class MediaFileStorage(FileSystemStorage):
@@ -0,0 +1,261 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from importlib import import_module
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.urls import reverse
+
+from exhibition.models import Exhibitions, Exhibitors
+
+MODES = ('wsgi', 'asgi')
+
+
+def get_default_paths():
+	"""JSON-эндпоинты с параметрами из реальных данных"""
+	exhibition = Exhibitions.objects.order_by('-date_start').first()
+	exhibitor = Exhibitors.objects.exclude(name='').order_by('id').first()
+	if exhibition is None or exhibitor is None:
+		raise CommandError('Benchmark needs at least one exhibition and one exhibitor')
+
+	return [
+		f"{reverse('exhibition:search-exhibitors')}?q={exhibitor.name.split()[0][:3]}",
+		f"{reverse('exhibition:get-nominations-for-exhibition-url')}?exhibition_id={exhibition.id}",
+		f"{reverse('exhibition:get_exhibitors_by_exhibition')}?exhibition_id={exhibition.id}",
+		f"{reverse('exhibition:get_exhibitions_by_owner')}?owner_id={exhibitor.id}",
+	]
+
+
+def create_session_cookie(user):
+	"""Cookie авторизованной сессии: эндпоинты закрыты login_required"""
+	session = import_module(settings.SESSION_ENGINE).SessionStore()
+	session[SESSION_KEY] = str(user.pk)
+	session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+	session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+	session.create()
+	return f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+
+def get_host():
+	host = settings.ALLOWED_HOSTS[0].lstrip('.') if settings.ALLOWED_HOSTS else 'localhost'
+	return 'localhost' if host == '*' else host
+
+
+def add_db_latency(latency):
+	"""Имитация сетевой задержки до БД: каждый запрос ждет latency секунд"""
+	def wrapper(execute, sql, params, many, context):
+		time.sleep(latency)
+		return execute(sql, params, many, context)
+
+	def on_connection_created(sender, connection, **kwargs):
+		connection.execute_wrappers.append(wrapper)
+
+	connection_created.connect(on_connection_created, weak=False)
+	for connection in connections.all(initialized_only=True):
+		connection.execute_wrappers.append(wrapper)
+
+
+class WSGIRunner:
+	"""Синхронный воркер: обслуживает один запрос за раз (как gunicorn sync)"""
+
+	def __init__(self, cookie):
+		self.handler = WSGIHandler()
+		self.cookie = cookie
+		self.host = get_host()
+
+	def request(self, path):
+		url = urlsplit(path)
+		environ = {
+			'REQUEST_METHOD': 'GET',
+			'PATH_INFO': url.path,
+			'QUERY_STRING': url.query,
+			'SERVER_NAME': self.host,
+			'SERVER_PORT': '80',
+			'SERVER_PROTOCOL': 'HTTP/1.1',
+			'REMOTE_ADDR': '127.0.0.1',
+			'HTTP_HOST': self.host,
+			'HTTP_COOKIE': self.cookie,
+			'wsgi.input': BytesIO(),
+			'wsgi.errors': sys.stderr,
+			'wsgi.url_scheme': 'http',
+			'wsgi.multithread': True,
+			'wsgi.multiprocess': False,
+		}
+		status = []
+		started = time.perf_counter()
+		response = self.handler(environ, lambda code, headers, exc_info=None: status.append(int(code[:3])))
+		try:
+			b''.join(response)
+		finally:
+			response.close()
+
+		return status[0], time.perf_counter() - started
+
+	def run(self, paths, concurrency):
+		return [self.request(path) for path in paths]
+
+
+class ASGIRunner:
+	"""Асинхронный воркер: цикл событий держит до concurrency запросов одновременно (как uvicorn)"""
+
+	def __init__(self, cookie):
+		self.handler = ASGIHandler()
+		self.cookie = cookie.encode()
+		self.host = get_host().encode()
+
+	async def request(self, path):
+		url = urlsplit(path)
+		scope = {
+			'type': 'http',
+			'asgi': {'version': '3.0'},
+			'http_version': '1.1',
+			'method': 'GET',
+			'scheme': 'http',
+			'path': url.path,
+			'raw_path': url.path.encode(),
+			'query_string': url.query.encode(),
+			'root_path': '',
+			'headers': [(b'host', self.host), (b'cookie', self.cookie)],
+			'client': ('127.0.0.1', 0),
+			'server': (self.host.decode(), 80),
+		}
+		finished = asyncio.Event()
+		received = False
+		status = []
+
+		async def receive():
+			nonlocal received
+			if not received:
+				received = True
+				return {'type': 'http.request', 'body': b'', 'more_body': False}
+			await finished.wait()
+			return {'type': 'http.disconnect'}
+
+		async def send(message):
+			if message['type'] == 'http.response.start':
+				status.append(message['status'])
+			elif message['type'] == 'http.response.body' and not message.get('more_body'):
+				finished.set()
+
+		started = time.perf_counter()
+		await self.handler(scope, receive, send)
+		finished.set()
+		return status[0], time.perf_counter() - started
+
+	async def run_worker(self, paths, concurrency):
+		semaphore = asyncio.Semaphore(concurrency)
+
+		async def limited(path):
+			async with semaphore:
+				return await self.request(path)
+
+		return await asyncio.gather(*(limited(path) for path in paths))
+
+	def run(self, paths, concurrency):
+		return asyncio.run(self.run_worker(paths, concurrency))
+
+
+class Command(BaseCommand):
+	help = (
+		'Compare throughput of the sync (WSGI) and async (ASGI) JSON endpoints at equal worker counts. '
+		'Every worker is a separate process with ASYNC_VIEWS set for its mode; use a real database (PostgreSQL).'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--mode', choices=MODES + ('both',), default='both')
+		parser.add_argument('--workers', type=int, default=2, help='Worker processes per mode')
+		parser.add_argument('--concurrency', type=int, default=32, help='Requests in flight per async worker')
+		parser.add_argument('--requests', type=int, default=400, help='Requests per mode')
+		parser.add_argument('--db-latency', type=float, default=10, help='Simulated latency per SQL query, ms')
+		parser.add_argument('--username', help='Authenticated user (first superuser by default)')
+		parser.add_argument('--path', action='append', dest='paths', help='URL to request (repeatable)')
+		# запуск одного воркера дочерним процессом
+		parser.add_argument('--worker', choices=MODES, help=argparse.SUPPRESS)
+		parser.add_argument('--start-at', type=float, help=argparse.SUPPRESS)
+
+	def handle(self, *args, **options):
+		if options['worker']:
+			return self.run_worker(options)
+
+		for mode in MODES if options['mode'] == 'both' else (options['mode'],):
+			self.run_mode(mode, options)
+
+	def run_mode(self, mode, options):
+		"""Воркеры стартуют одновременно после прогрева, пропускная способность считается по общему времени"""
+		workers = max(options['workers'], 1)
+		start_at = time.time() + 5 + workers
+		processes = []
+		for index in range(workers):
+			command = [
+				sys.executable, sys.argv[0], 'benchmark_async_api', '--worker', mode,
+				'--start-at', str(start_at),
+				'--concurrency', str(options['concurrency']),
+				'--requests', str(len(range(index, options['requests'], workers))),
+				'--db-latency', str(options['db_latency']),
+			]
+			if options['username']:
+				command += ['--username', options['username']]
+			for path in options['paths'] or ():
+				command += ['--path', path]
+
+			env = dict(os.environ, ASYNC_VIEWS=str(mode == 'asgi').lower())
+			processes.append(subprocess.Popen(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True))
+
+		results, finished_at = [], start_at
+		for process in processes:
+			stdout, stderr = process.communicate()
+			if process.returncode:
+				raise CommandError(stderr.strip().splitlines()[-1] if stderr.strip() else f'{mode} worker failed')
+
+			report = json.loads(stdout.strip().splitlines()[-1])
+			results += report['results']
+			finished_at = max(finished_at, report['finished_at'])
+
+		errors = sum(1 for status, _ in results if status != 200)
+		timings = sorted(duration for _, duration in results)
+		p95 = timings[max(int(len(timings) * 0.95) - 1, 0)]
+		self.stdout.write(
+			f"{mode}: {len(results) / (finished_at - start_at):.1f} req/s, "
+			f"median {statistics.median(timings) * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms, "
+			f"{errors} errors ({workers} workers, {len(results)} requests)"
+		)
+
+	def run_worker(self, options):
+		is_async = options['worker'] == 'asgi'
+		if settings.ASYNC_VIEWS != is_async:
+			raise CommandError(f"Run {options['worker']} worker with ASYNC_VIEWS={str(is_async).lower()}")
+
+		user_model = get_user_model()
+		if options['username']:
+			user = user_model.objects.get(username=options['username'])
+		else:
+			user = user_model.objects.filter(is_superuser=True).order_by('pk').first()
+		if user is None:
+			raise CommandError('No user to authenticate requests with')
+
+		paths = options['paths'] or get_default_paths()
+		cookie = create_session_cookie(user)
+		connections.close_all()
+		if options['db_latency']:
+			add_db_latency(options['db_latency'] / 1000)
+
+		runner = (ASGIRunner if is_async else WSGIRunner)(cookie)
+		# прогрев: загрузка URLconf, шаблонов и кэша
+		runner.run(paths, options['concurrency'])
+
+		time.sleep(max(options['start_at'] - time.time(), 0))
+		results = runner.run([paths[i % len(paths)] for i in range(options['requests'])], options['concurrency'])
+		self.stdout.write(json.dumps({'results': results, 'finished_at': time.time()}))
@@ -0,0 +1,109 @@
+import time
+import tempfile
+import tracemalloc
+from io import BytesIO
+from types import SimpleNamespace
+
+from django.contrib import admin
+from django.core.management.base import BaseCommand
+
+from exhibition.exports import JuryReportWriter
+from exhibition.models import Exhibitions
+
+
+def build_report_data(nominations, projects, jurors):
+	"""Синтетический протокол того же вида, что и ExportExhibitionAdmin._get_report_data"""
+	jury_list = [SimpleNamespace(id=j, name=f'Член жюри {j}', user_name='') for j in range(1, jurors + 1)]
+
+	report_nominations = []
+	for n in range(nominations):
+		projects_data = [
+			{
+				'portfolio': f'Проект {n}-{p}',
+				'jury_scores': {jury.id: (n + p + jury.id) % 5 + 1 for jury in jury_list if (p + jury.id) % 7},
+				'total_score': round(3 + (p % 20) / 10, 2),
+				'votes': jurors,
+			}
+			for p in range(projects)
+		]
+		report_nominations.append({
+			'title': f'Номинация {n}',
+			'all_projects': projects,
+			'top_projects': projects_data[:3],
+			'other_projects': projects_data[3:],
+			'winners': [{'portfolio': projects_data[0]['portfolio'], 'score': projects_data[0]['total_score']}],
+			'jury_counts': {},
+		})
+
+	return {
+		'title': 'Протокол оценок жюри: benchmark',
+		'jury_list': jury_list,
+		'nominations': report_nominations,
+		'not_voted_jury': {
+			jury.id: {
+				'jury': jury,
+				'nominations': [
+					{'nomination': SimpleNamespace(title=f'Номинация {n}'), 'voted': 1, 'total': projects, 'missing': projects - 1}
+					for n in range(nominations)
+				],
+			}
+			for jury in jury_list
+		},
+	}
+
+
+class Command(BaseCommand):
+	help = 'Compare peak memory and time of the in-memory and streaming jury protocol Excel exports'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--nominations', type=int, default=20)
+		parser.add_argument('--projects', type=int, default=150, help='Projects per nomination')
+		parser.add_argument('--jurors', type=int, default=25)
+		parser.add_argument('--repeat', type=int, default=3, help='Timed runs per export mode (best time is reported)')
+
+	def handle(self, *args, **options):
+		report_data = build_report_data(options['nominations'], options['projects'], options['jurors'])
+		model_admin = admin.site.get_model_admin(Exhibitions)
+
+		def in_memory():
+			# текущий путь: книга целиком в памяти -> BytesIO -> копия в HttpResponse
+			wb = model_admin._generate_excel_report(report_data)
+			output = BytesIO()
+			wb.save(output)
+			output.seek(0)
+			return len(output.read())
+
+		def streaming():
+			with tempfile.TemporaryFile() as output:
+				JuryReportWriter(report_data).save(output)
+				return output.tell()
+
+		cells = options['nominations'] * options['projects'] * (options['jurors'] + 4)
+		self.stdout.write(
+			f"{options['nominations']} nominations x {options['projects']} projects x {options['jurors']} jurors "
+			f"(~{cells} table cells)"
+		)
+		for name, export in (('in-memory', in_memory), ('streaming', streaming)):
+			size, elapsed, peak = self.measure(export, options['repeat'])
+			self.stdout.write(
+				f"{name:>10}: {elapsed:.2f}s, peak {peak / 1024 / 1024:.1f} MiB, file {size / 1024:.0f} KiB"
+			)
+
+	@staticmethod
+	def measure(export, repeat):
+		"""Лучшее время без трассировки и пик памяти Python-объектов отдельным прогоном под tracemalloc"""
+		best_time = None
+		for _ in range(max(repeat, 1)):
+			started = time.perf_counter()
+			size = export()
+			elapsed = time.perf_counter() - started
+			best_time = elapsed if best_time is None else min(best_time, elapsed)
+
+		tracemalloc.start()
+		try:
+			export()
+			peak = tracemalloc.get_traced_memory()[1]
+		finally:
+			tracemalloc.stop()
+
+		return size, best_time, peak
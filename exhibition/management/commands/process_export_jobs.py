@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from exhibition.jobs import run_export_job, cleanup_export_jobs
+from exhibition.models import ExportJob
+
+
+class Command(BaseCommand):
+	help = 'Run export jobs left in the queue (e.g. after a worker restart) and delete expired export files'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--cleanup-only', action='store_true', help='Only delete expired export jobs and files')
+
+	def handle(self, *args, **options):
+		if not options['cleanup_only']:
+			pending = ExportJob.objects.filter(status=ExportJob.PENDING).order_by('created_at')
+			for job_id in pending.values_list('pk', flat=True):
+				if run_export_job(job_id):
+					self.stdout.write(f"Export job {job_id} done")
+
+		deleted = cleanup_export_jobs()
+		self.stdout.write(f"Deleted {deleted} expired export jobs")
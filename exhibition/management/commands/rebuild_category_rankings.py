@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from exhibition.models import Portfolio, CategoryRanking
+from exhibition.services import CategoryRankingService
+
+
+class Command(BaseCommand):
+	help = 'Rebuild the category ranking table (CategoryRanking) for all portfolios'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=200, help='Portfolios per refresh batch')
+
+	def handle(self, *args, **options):
+		CategoryRankingService.refresh_portfolios(Portfolio.objects.all(), batch_size=options['batch_size'])
+		self.stdout.write(self.style.SUCCESS(f"Category rankings: {CategoryRanking.objects.count()} row(s)"))
@@ -0,0 +1,85 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils.translation import activate
+from watson.models import SearchEntry
+from watson.search import SearchEngine
+
+from exhibition.search import SEARCH_INDEX_BATCH_SIZE, get_index_queryset, index_objects
+from exhibition.services import SiteSearchService
+
+
+def chunked(iterable, size):
+	iterator = iter(iterable)
+	while chunk := list(islice(iterator, size)):
+		yield chunk
+
+
+class Command(BaseCommand):
+	help = 'Rebuild the watson search index in parallel batches and report throughput'
+
+	def add_arguments(self, parser):
+		parser.add_argument('models', nargs='*', help='Models to reindex as app_label.Model (default: all registered)')
+		parser.add_argument('--engine', default='default', help='Search engine slug')
+		parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1), help='Parallel worker threads')
+		parser.add_argument('--batch-size', type=int, default=SEARCH_INDEX_BATCH_SIZE, help='Objects per worker batch')
+
+	def handle(self, *args, **options):
+		activate(settings.LANGUAGE_CODE)
+		engine = dict(SearchEngine.get_created_engines()).get(options['engine'])
+		if engine is None:
+			raise CommandError(f"Search engine \"{options['engine']}\" is not registered")
+
+		registered = {model._meta.label_lower: model for model in engine.get_registered_models()}
+		labels = [label.lower() for label in options['models']]
+		unknown = set(labels) - set(registered)
+		if unknown:
+			raise CommandError(f"Models are not registered with the search engine: {', '.join(sorted(unknown))}")
+
+		models = [registered[label] for label in labels] if labels else list(registered.values())
+		workers = max(options['workers'], 1)
+		batch_size = max(options['batch_size'], 1)
+
+		total, started = 0, time.monotonic()
+		for model in models:
+			engine.cleanup_model_index(model)
+			pks = list(get_index_queryset(engine, model).order_by('pk').values_list('pk', flat=True))
+			batches = chunked(pks, batch_size)
+
+			model_started = time.monotonic()
+			if workers == 1:
+				indexed = sum(index_objects(engine, model, batch, batch_size) for batch in batches)
+			else:
+				with ThreadPoolExecutor(max_workers=workers) as executor:
+					indexed = sum(executor.map(lambda batch: self.index_batch(engine, model, batch, batch_size), batches))
+
+			total += indexed
+			self.stdout.write(self.format_rate(model._meta.label, indexed, time.monotonic() - model_started))
+
+		if not labels:
+			# записи индекса моделей, снятых с регистрации
+			content_types = ContentType.objects.get_for_models(*models).values()
+			stale, _ = SearchEntry.objects.filter(engine_slug=options['engine']).exclude(content_type__in=content_types).delete()
+			if stale:
+				self.stdout.write(f"Deleted {stale} stale search entry(s)")
+
+		SiteSearchService.invalidate()
+		self.stdout.write(self.style.SUCCESS(self.format_rate('Total', total, time.monotonic() - started) + f" with {workers} worker(s)"))
+
+	@staticmethod
+	def index_batch(engine, model, pks, batch_size):
+		try:
+			return index_objects(engine, model, pks, batch_size)
+		finally:
+			connections.close_all()
+
+	@staticmethod
+	def format_rate(label, count, elapsed):
+		rate = count / elapsed if elapsed > 0 else 0
+		return f"{label}: {count} object(s) in {elapsed:.2f}s ({rate:.0f} obj/s)"
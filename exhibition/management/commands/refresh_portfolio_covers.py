@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from exhibition.logic import build_cover_thumbs
+from exhibition.models import Portfolio
+
+
+class Command(BaseCommand):
+	help = 'Fill stored portfolio covers (project_cover) and their thumbnail manifests'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--force', action='store_true', help='Rebuild thumbnail manifests for all portfolios')
+
+	def handle(self, *args, **options):
+		refreshed = 0
+		thumbs = 0
+
+		portfolios = Portfolio.objects.only('id', 'cover', 'project_cover', 'cover_thumbs').order_by('id')
+		for portfolio in portfolios.iterator(chunk_size=200):
+			project_cover = portfolio.get_effective_cover()
+			if project_cover != portfolio.project_cover:
+				refreshed += 1
+
+			manifest = portfolio.cover_thumbs
+			if project_cover and (options['force'] or not manifest or project_cover != portfolio.project_cover):
+				try:
+					manifest = build_cover_thumbs(project_cover)
+					thumbs += 1
+				except Exception as e:
+					self.stderr.write(f"Portfolio {portfolio.id}: {e}")
+					manifest = {}
+			elif not project_cover:
+				manifest = {}
+
+			# повторный запуск (например, при каждом деплое) не переписывает актуальные строки
+			if (project_cover, manifest) != (portfolio.project_cover, portfolio.cover_thumbs):
+				Portfolio.objects.filter(pk=portfolio.pk).update(project_cover=project_cover, cover_thumbs=manifest)
+
+		self.stdout.write(self.style.SUCCESS(f"Covers refreshed: {refreshed}, thumbnail manifests built: {thumbs}"))
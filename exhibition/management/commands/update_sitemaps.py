@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from exhibition.sitemap import sitemaps, write_sitemaps
+
+
+class Command(BaseCommand):
+	help = 'Render gzipped sitemap sections and the sitemap index into SITEMAP_ROOT'
+
+	def add_arguments(self, parser):
+		parser.add_argument('sections', nargs='*', help=f"Sections to rebuild (default: all): {', '.join(sitemaps)}")
+
+	def handle(self, *args, **options):
+		sections = options['sections']
+		unknown = set(sections) - set(sitemaps)
+		if unknown:
+			raise CommandError(f"Unknown sitemap sections: {', '.join(sorted(unknown))}")
+
+		changed = write_sitemaps(sections or None)
+		self.stdout.write(self.style.SUCCESS('Sitemap updated' if changed else 'Sitemap is up to date'))
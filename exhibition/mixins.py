@@ -1,15 +1,22 @@
+import hashlib
+import operator
+from functools import reduce
+
 from django.conf import settings
 from django.contrib import admin
-from django.core.exceptions import FieldDoesNotExist
-from django.db.models import ImageField, FileField
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist, BadRequest
+from django.db.models import ImageField, FileField, F, Q
 from django.http import JsonResponse
 from django.shortcuts import redirect
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers, quote_etag
 from django.utils.html import format_html
-from sorl.thumbnail import get_thumbnail
 
 from ads.models import Banner
+from .cache import invalidate_exhibition_payload
 from .forms import ImageInlineForm, ImageInlineFormSet
+from .logic import build_cover_thumbs
 from .models import MetaSEO, Exhibitors, Jury, Partners
 from .services import delete_cached_fragment
 from .widgets import MediaWidget
@@ -112,6 +119,7 @@ class PersonAdminMixin(ImagePreviewMixin, MediaWidgetMixin):
 	prepopulated_fields = {"slug": ('name',)}
 	list_display = ('user_name', 'name',)
 	list_display_links = ('user_name', 'name',)
+	list_select_related = ('user',)
 	list_per_page = 20
 	search_fields = ('name', 'slug', 'user__first_name', 'user__last_name', 'description',)
 
@@ -167,6 +175,7 @@ class PersonAdminMixin(ImagePreviewMixin, MediaWidgetMixin):
 
 			# Также очищаем кэш контента выставки
 			delete_cached_fragment('exhibition_content', exh.slug)
+			invalidate_exhibition_payload(exh.id)
 
 		return f"Cleared cache for {absolute_url}"
 
@@ -265,41 +274,108 @@ class ExhibitionsYearsMixin:
 
 
 class ProjectsLazyLoadMixin:
+	"""
+	Ленивая подгрузка проектов.
+	Поддерживает курсорную пагинацию (?cursor=<next>): каждая страница выбирается по ключам сортировки
+	последнего показанного проекта, без OFFSET. Старый параметр ?page=N работает как раньше.
+	"""
 	PAGE_SIZE = getattr(settings, 'PORTFOLIO_COUNT_PER_PAGE', 20)
+	# Ключи сортировки (все по убыванию, NULL в конце). Последний ключ должен быть уникальным
+	CURSOR_ORDERING = ('id',)
+	# для колонок без NULL порядок без NULLS LAST совпадает с обычным индексом по убыванию
+	CURSOR_NULLS_LAST = True
+	CURSOR_SALT = 'exhibition.projects.cursor'
+
+	@staticmethod
+	def is_lazy_load_request(request):
+		return 'page' in request.GET or 'cursor' in request.GET
 
 	def init_pagination(self, request):
-		self.page = int(request.GET.get('page', 1))
+		self.cursor = self.decode_cursor(request.GET.get('cursor'))
+		self.page = self.cursor['p'] if self.cursor else int(request.GET.get('page', 1))
 		self.is_next_page = False
+		self.next_cursor = None
 
-	def paginate_queryset(self, queryset):
-		start = (self.page - 1) * self.PAGE_SIZE
+	def get_cursor_ordering(self):
+		nulls_last = True if self.CURSOR_NULLS_LAST else None
+		return [F(field).desc(nulls_last=nulls_last) for field in self.CURSOR_ORDERING]
+
+	def encode_cursor(self, item):
+		keys = [item[field] for field in self.CURSOR_ORDERING]
+		return signing.dumps({'p': self.page + 1, 'k': keys}, salt=self.CURSOR_SALT, compress=True)
+
+	def decode_cursor(self, token):
+		if not token:
+			return None
+
+		try:
+			cursor = signing.loads(token, salt=self.CURSOR_SALT)
+		except signing.BadSignature:
+			raise BadRequest('Invalid cursor')
+
+		if len(cursor.get('k', ())) != len(self.CURSOR_ORDERING):
+			raise BadRequest('Invalid cursor')
+
+		return cursor
+
+	def filter_after_cursor(self, queryset, keys):
+		"""Проекты строго после курсора в порядке get_cursor_ordering()"""
+		conditions = []
+		equal = Q()
+
+		for field, value in zip(self.CURSOR_ORDERING, keys):
+			if value is None:
+				# NULL идут в конце: после него по этому ключу могут быть только NULL
+				equal &= Q(**{f'{field}__isnull': True})
+				continue
+
+			conditions.append(equal & (Q(**{f'{field}__lt': value}) | Q(**{f'{field}__isnull': True})))
+			equal &= Q(**{field: value})
+
+		if not conditions:
+			return queryset.none()
+
+		return queryset.filter(reduce(operator.or_, conditions))
+
+	def get_page_queryset(self, queryset):
+		"""Срез на страницу с одним лишним проектом - признаком следующей страницы"""
 		limit = self.PAGE_SIZE + 1
 
-		items = list(queryset[start:start + limit])
+		if self.cursor:
+			return self.filter_after_cursor(queryset, self.cursor['k'])[:limit]
+
+		start = (self.page - 1) * self.PAGE_SIZE
+		return queryset[start:start + limit]
+
+	def finish_page(self, items):
 		self.is_next_page = len(items) > self.PAGE_SIZE
+		items = items[:self.PAGE_SIZE]
 
-		return items[:self.PAGE_SIZE]
+		if self.is_next_page:
+			self.next_cursor = self.encode_cursor(items[-1])
+
+		return items
+
+	def paginate_queryset(self, queryset):
+		return self.finish_page(list(self.get_page_queryset(queryset)))
+
+	async def apaginate_queryset(self, queryset):
+		return self.finish_page([item async for item in self.get_page_queryset(queryset)])
+
+	def get_lazy_load_queryset(self):
+		"""Проекты для JSON-ответа подгрузки (?page=/?cursor=)"""
+		raise NotImplementedError
 
 	@staticmethod
 	def enrich_queryset_with_thumbnails(queryset):
-		default_quality = getattr(settings, 'THUMBNAIL_QUALITY', 85)
-
 		for item in queryset:
+			thumbs = item.pop('cover_thumbs', None)
 			cover = item.get('project_cover')
 			if not cover:
 				continue
 
-			mini = get_thumbnail(cover, '100x100', crop='center', quality=75)
-			xs = get_thumbnail(cover, '320', quality=default_quality)
-			sm = get_thumbnail(cover, '576', quality=default_quality)
-
-			item.update({
-				'thumb_mini': settings.MEDIA_URL + str(mini),
-				'thumb_xs': settings.MEDIA_URL + str(xs),
-				'thumb_sm': settings.MEDIA_URL + str(sm),
-				'thumb_xs_w': 320,
-				'thumb_sm_w': 576,
-			})
+			# манифест еще не готов (миниатюры генерируются в фоне) - строим на лету
+			item.update(thumbs or build_cover_thumbs(cover))
 
 		return queryset
 
@@ -309,20 +385,69 @@ class ProjectsLazyLoadMixin:
 		return JsonResponse({
 			'current_page': self.page,
 			'next_page': self.is_next_page,
+			'next': self.next_cursor,
 			'projects_list': list(queryset),
 			'default_placeholder': settings.MEDIA_URL + getattr(settings, 'DEFAULT_NO_IMAGE', ''),
 		})
 
 
+class ConditionalGetMixin:
+	"""
+	Условный GET по ETag.
+	Если браузер прислал совпадающий валидатор, отдаем 304 без выполнения основных запросов страницы.
+	Last-Modified не отдаем: удаление проекта или оценки не сдвигает время изменения вперед,
+	и проверка по If-Modified-Since вернула бы 304 для устаревшей страницы.
+	"""
+
+	def get_validators(self, request):
+		"""
+		Возвращает части ETag для текущего запроса
+		или None, если страница не поддерживает условный GET.
+		"""
+		return None
+
+	@staticmethod
+	def build_etag(request, etag_parts):
+		# Ответ зависит от пользователя, поэтому учитываем его в валидаторе
+		user_key = request.user.pk if request.user.is_authenticated else 'anon'
+		raw = '|'.join(str(part) for part in (request.get_full_path(), user_key, *etag_parts))
+		return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+	@staticmethod
+	def patch_conditional_response(response, etag):
+		if response.status_code in (200, 304):
+			response.headers.setdefault('ETag', etag)
+
+			# страница персональная - разрешаем хранить только в браузере и всегда перепроверять
+			patch_cache_control(response, private=True, no_cache=True)
+			patch_vary_headers(response, ('Cookie',))
+
+		return response
+
+	def dispatch(self, request, *args, **kwargs):
+		if request.method not in ('GET', 'HEAD'):
+			return super().dispatch(request, *args, **kwargs)
+
+		validators = self.get_validators(request)
+		if not validators:
+			return super().dispatch(request, *args, **kwargs)
+
+		etag = self.build_etag(request, validators)
+		response = get_conditional_response(request, etag=etag)
+		if response is None:
+			response = super().dispatch(request, *args, **kwargs)
+
+		return self.patch_conditional_response(response, etag)
+
+
 class BannersMixin:
 	def get_context_data(self, **kwargs):
 		context = super().get_context_data(**kwargs)
 		model_name = self.model.__name__.lower()
-		banners = Banner.get_banners(model_name)
-		context['ads_banners'] = list(banners)
+		banners = Banner.attach_owners(list(Banner.get_banners(model_name)))
+		context['ads_banners'] = banners
 		if banners and banners[0].is_general:
-			context['general_banner'] = banners[0]
-			del context['ads_banners'][0]
+			context['general_banner'] = banners.pop(0)
 		return context
 
 
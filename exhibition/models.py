@@ -8,8 +8,9 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.core.validators import RegexValidator
+from django.db import connections, router, transaction
 from django.db.models import F
-from django.db.models.functions import Coalesce
+from django.db.models.functions import Coalesce, Greatest
 # from django.utils.text import slugify
 from django.urls import reverse  # Used to generate URLs by reversing the URL patterns
 from django.utils import timezone
@@ -23,9 +24,9 @@ from crm import models
 from .base_models import UserModel, BaseImageModel
 from .fields import SVGField
 from .logic import (
-	MediaFileStorage, portfolio_upload_to, cover_upload_to, gallery_upload_to, limit_file_size
+	MediaFileStorage, portfolio_upload_to, cover_upload_to, gallery_upload_to, limit_file_size,
+	update_cover_thumbs_async
 )
-from .services import update_google_sitemap
 
 LOGO_FOLDER = 'logos/'
 BANNER_FOLDER = 'banners/'
@@ -153,6 +154,11 @@ class Profile(models.Model):
 
 
 class Exhibitors(Person, Profile):
+	# счетчик для выдачи project_id новых портфолио (см. PortfolioManager.allocate_project_id)
+	last_project_id = models.PositiveIntegerField('Последний номер проекта', default=0, editable=False)
+	# нормализованные имя участника и пользователя для автодополнения (см. ExhibitorSearchService)
+	search_name = models.CharField('Имя для поиска', max_length=400, blank=True, editable=False)
+
 	class Meta(Person.Meta):
 		verbose_name = 'Участник выставки'
 		verbose_name_plural = 'Участники выставки'
@@ -160,6 +166,12 @@ class Exhibitors(Person, Profile):
 		unique_together = ['user', ]
 		db_table = 'exhibitors'
 
+	def save(self, *args, **kwargs):
+		from .services import ExhibitorSearchService
+
+		self.search_name = ExhibitorSearchService.get_search_name(self)
+		super().save(*args, **kwargs)
+
 	def get_absolute_url(self):
 		return reverse('exhibition:exhibitor-detail-url', kwargs={'slug': self.slug})
 
@@ -181,10 +193,6 @@ class Jury(Person):
 		ordering = [Coalesce("sort", F('id') + 500)]  # сортировка в приоритете по полю sort, а потом уже по-умолчанию
 		db_table = 'jury'
 
-	def save(self, *args, **kwargs):
-		super().save(*args, **kwargs)
-		update_google_sitemap()
-
 	def get_absolute_url(self):
 		return reverse('exhibition:jury-detail-url', kwargs={'slug': self.slug})
 
@@ -196,10 +204,6 @@ class Partners(Person, Profile):
 		db_table = 'partners'
 		ordering = [Coalesce("sort", F('id') + 500)]  # сортировка в приоритете по полю sort, а потом уже по-умолчанию
 
-	def save(self, *args, **kwargs):
-		super().save(*args, **kwargs)
-		update_google_sitemap()
-
 	def get_absolute_url(self):
 		return reverse('exhibition:partner-detail-url', kwargs={'slug': self.slug})
 
@@ -230,7 +234,6 @@ class Categories(models.Model):
 		if not self.slug:
 			self.slug = uuslug(self.title.lower(), instance=self)
 		super().save(*args, **kwargs)
-		update_google_sitemap()
 
 	def __str__(self):
 		return self.title if self.title else '<без категории>'
@@ -257,7 +260,6 @@ class Nominations(models.Model):
 		if not self.slug:
 			self.slug = uuslug(self.title.lower(), instance=self)
 		super().save(*args, **kwargs)
-		update_google_sitemap()
 
 	def __str__(self):
 		return self.title
@@ -441,10 +443,6 @@ class Winners(models.Model):
 		db_table = 'winners'
 		unique_together = ['exhibition', 'exhibitor', 'nomination']
 
-	def save(self, *args, **kwargs):
-		super().save(*args, **kwargs)
-		update_google_sitemap()
-
 	def __str__(self):
 		return '%s | %s, %s' % (self.exhibitor.name, self.nomination.title, self.exhibition.slug)
 
@@ -486,10 +484,6 @@ class Events(models.Model):
 		verbose_name_plural = 'Мероприятия'
 		db_table = 'events'
 
-	def save(self, *args, **kwargs):
-		super().save(*args, **kwargs)
-		update_google_sitemap()
-
 	def __str__(self):
 		return self.title
 
@@ -529,28 +523,21 @@ class PortfolioAttributes(models.Model):
 
 
 class PortfolioManager(models.Manager):
-	def get_visible_projects(self, user=None, exhibition=None):
-		"""Возвращает видимые проекты в зависимости от прав пользователя"""
-
-		today = timezone.now()
-		exh_query = models.Q(exhibition=exhibition) if exhibition else models.Q(exhibition__isnull=False)
-		queryset = self.get_queryset().filter(
-			models.Q(status=True) &
-			models.Q(exh_query)
-		)
+	@staticmethod
+	def get_visibility_filter(user=None, date_end_field='exhibition__date_end', owner_field='owner'):
+		"""Условие видимости проектов в зависимости от прав пользователя"""
 
-		if exhibition:
-			queryset = queryset.select_related('owner').prefetch_related('nominations')
+		ended = models.Q(**{f'{date_end_field}__lt': timezone.now()})
 
 		if not user or not user.is_authenticated:
 			# Неавторизованные пользователи видят только проекты завершенных выставок
-			return queryset.filter(exhibition__date_end__lt=today)
+			return ended
 
 		from .utils import is_jury_member, get_exhibitor_for_user
 
 		# Staff и жюри видят все проекты
 		if user.is_staff or is_jury_member(user):
-			return queryset
+			return models.Q()
 
 		# Пытаемся найти участника (exhibitor) для этого пользователя
 		exhibitor = get_exhibitor_for_user(user)
@@ -559,13 +546,61 @@ class PortfolioManager(models.Manager):
 			# Владелец видит:
 			# 1. Все свои проекты (включая проекты активной выставки)
 			# 2. Все чужие проекты, если выставка завершена
-			return queryset.filter(
-				models.Q(owner=exhibitor) |  # Свои проекты без ограничений
-				models.Q(exhibition__date_end__lt=today)  # Проекты завершенных выставок
-			)
+			return models.Q(**{owner_field: exhibitor}) | ended
 
 		# Обычные авторизованные пользователи (не staff, не жюри, не участник)
-		return queryset.filter(exhibition__date_end__lt=today)
+		return ended
+
+	def allocate_project_id(self, owner_id):
+		"""
+		Атомарная выдача следующего project_id участника через счетчик в строке Exhibitors.
+		UPDATE блокирует строку участника до конца транзакции, поэтому параллельные загрузки
+		получают разные номера. Максимум по индексу (owner, project_id) учитывает проекты,
+		созданные с явным номером или до появления счетчика.
+		PostgreSQL (и SQLite 3.35+) возвращают номер тем же запросом (UPDATE ... RETURNING),
+		на остальных СУБД он читается отдельным SELECT.
+		"""
+		connection = connections[router.db_for_write(Exhibitors)]
+		if connection.vendor in ('postgresql', 'sqlite') and connection.features.can_return_columns_from_insert:
+			quote = connection.ops.quote_name
+			counter = quote(Exhibitors._meta.get_field('last_project_id').column)
+			last_project_id = 'COALESCE((SELECT MAX({}) FROM {} WHERE {} = %s), 0)'.format(
+				quote(self.model._meta.get_field('project_id').column),
+				quote(self.model._meta.db_table),
+				quote(self.model._meta.get_field('owner').column),
+			)
+			with connection.cursor() as cursor:
+				cursor.execute(
+					f'UPDATE {quote(Exhibitors._meta.db_table)} '
+					f'SET {counter} = CASE WHEN {counter} > {last_project_id} THEN {counter} ELSE {last_project_id} END + 1 '
+					f'WHERE {quote(Exhibitors._meta.pk.column)} = %s RETURNING {counter}',
+					[owner_id, owner_id, owner_id]
+				)
+				return cursor.fetchone()[0]
+
+		last_project_id = self.model.objects.filter(owner_id=models.OuterRef('pk')).order_by().values(
+			'owner_id'
+		).annotate(last=models.Max('project_id')).values('last')
+
+		exhibitors = Exhibitors._base_manager.filter(pk=owner_id)
+		exhibitors.update(
+			last_project_id=Greatest(F('last_project_id'), Coalesce(models.Subquery(last_project_id), 0)) + 1
+		)
+		return exhibitors.values_list('last_project_id', flat=True).get()
+
+	def get_visible_projects(self, user=None, exhibition=None):
+		"""Возвращает видимые проекты в зависимости от прав пользователя"""
+
+		exh_query = models.Q(exhibition=exhibition) if exhibition else models.Q(exhibition__isnull=False)
+		queryset = self.get_queryset().filter(
+			models.Q(status=True) &
+			models.Q(exh_query)
+		)
+
+		if exhibition:
+			queryset = queryset.select_related('owner').prefetch_related('nominations')
+
+		return queryset.filter(self.get_visibility_filter(user))
 
 
 class Portfolio(BaseImageModel):
@@ -619,6 +654,9 @@ class Portfolio(BaseImageModel):
 	)
 	status = models.BooleanField('Видимость на сайте', default=True, choices=CHOICES)
 	order = models.IntegerField('Порядок', null=True, blank=True, default=1)
+	updated_at = models.DateTimeField('Дата изменения', auto_now=True)
+	project_cover = models.CharField('Обложка в списках', max_length=255, blank=True, editable=False)
+	cover_thumbs = models.JSONField('Миниатюры обложки', default=dict, blank=True, editable=False)
 
 	objects = PortfolioManager()
 
@@ -632,6 +670,8 @@ class Portfolio(BaseImageModel):
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
 		self.original_cover = self.cover
+		# выставка и видимость до сохранения - от них зависят счетчики панели прогресса жюри
+		self.original_jury_scope = self.get_jury_scope()
 
 	def save(self, *args, **kwargs):
 		# Сохраняем изображения во временный атрибут для сигнала
@@ -642,50 +682,91 @@ class Portfolio(BaseImageModel):
 		if self.original_cover and self.original_cover != self.cover:
 			delete(self.original_cover)
 
-		if not self.project_id:
-			post = Portfolio.objects.filter(owner=self.owner).only('project_id').order_by('project_id').last()
-			self.project_id = post.project_id + 1 if post else 1
-
-		super().save(*args, **kwargs)
+		if self.project_id:
+			super().save(*args, **kwargs)
+		else:
+			# номер выдается в той же транзакции, что и вставка портфолио (фото и фоновые потоки - после фиксации)
+			with transaction.atomic():
+				self.project_id = Portfolio.objects.allocate_project_id(self.owner_id)
+				super().save(*args, **kwargs)
 
 		self.original_cover = self.cover
+		self.original_jury_scope = self.get_jury_scope()
+
+	def get_jury_scope(self):
+		# без обращения к отложенным полям (.only()), чтобы не делать лишних запросов
+		return self.__dict__.get('exhibition_id'), self.__dict__.get('status')
 
 	@property
 	def get_cover(self):
-		"""Возвращает обложку (cover или первое изображение)"""
+		"""Возвращает обложку (cover или первое изображение) как файл поля, без запроса к фото"""
 		if self.cover:
 			return self.cover
 
-		# Получаем первое изображение из портфолио
-		first_image = self.images.first()
-		return first_image.file if first_image else None
+		if not self.project_cover:
+			return None
+
+		field = Image._meta.get_field('file')
+		return field.attr_class(self, field, self.project_cover)
+
+	def get_effective_cover(self):
+		"""Путь к обложке для списков: cover или первое изображение портфолио"""
+		if self.cover:
+			return self.cover.name
+
+		return self.images.values_list('file', flat=True).first() or ''
+
+	def refresh_cover(self):
+		"""Синхронизирует сохраненную обложку для списков проектов и манифест ее миниатюр"""
+		project_cover = self.get_effective_cover()
+
+		updated = Portfolio.objects.filter(pk=self.pk).exclude(project_cover=project_cover).update(
+			project_cover=project_cover,
+			cover_thumbs={},
+			updated_at=timezone.now()
+		)
+
+		self.project_cover = project_cover
+		if updated:
+			self.cover_thumbs = {}
+			if project_cover:
+				update_cover_thumbs_async(self)
+
+		return bool(updated)
+
+	RATING_AGGREGATES = {
+		'total': models.Sum('star'),
+		'average': models.Avg('star'),
+		'count': models.Count('star'),
+	}
 
 	def get_rating_stats(self):
 		"""Получение статистики рейтингов"""
 
-		aggregates = self.ratings.aggregate(
-			total=models.Sum('star'),
-			average=models.Avg('star'),
-			count=models.Count('star')
-		)
+		from rating.buffer import RatingBuffer
 
-		jury_aggregates = self.ratings.filter(is_jury_rating=True).aggregate(
-			jury_total=models.Sum('star'),
-			jury_average=models.Avg('star'),
-			jury_count=models.Count('star')
+		aggregates = self.ratings.aggregate(**self.RATING_AGGREGATES)
+		jury_aggregates = self.ratings.filter(is_jury_rating=True).aggregate(**self.RATING_AGGREGATES)
+		# голоса посетителей, еще не перенесенные из буфера в БД
+		return RatingBuffer.merge_stats(
+			self.build_rating_stats(aggregates, jury_aggregates), *RatingBuffer.get_pending(self.pk)
 		)
 
+	@staticmethod
+	def build_rating_stats(aggregates, jury_aggregates):
 		return {
 			'total': aggregates['total'] or 0,
 			'average': aggregates['average'] or 0.0,
 			'count': aggregates['count'] or 0,
-			'jury_total': jury_aggregates['jury_total'] or 0,
-			'jury_average': jury_aggregates['jury_average'] or 0.0,
-			'jury_count': jury_aggregates['jury_count'] or 0,
+			'jury_total': jury_aggregates['total'] or 0,
+			'jury_average': jury_aggregates['average'] or 0.0,
+			'jury_count': jury_aggregates['count'] or 0,
 		}
 
 	def root_comments(self):
-		return self.comments_portfolio.filter(parent__isnull=True)
+		"""Все ветки комментариев с ответами (replies) одним запросом"""
+		from rating.services import ReviewService
+		return ReviewService.get_threads(self.pk, per_page=0).object_list
 
 	@property
 	def slug(self):
@@ -704,6 +785,79 @@ class Portfolio(BaseImageModel):
 		)
 
 
+class CategoryRanking(models.Model):
+	"""
+	Сводная таблица рейтинга проектов по категориям: ключи сортировки и поля карточки проекта.
+	Обновляется сигналами (см. CategoryRankingService), списки категорий читают только ее.
+	"""
+	pk = models.CompositePrimaryKey('category', 'portfolio')
+	category = models.ForeignKey(
+		Categories, on_delete=models.CASCADE, related_name='rankings', verbose_name='Категория'
+	)
+	portfolio = models.ForeignKey(
+		Portfolio, on_delete=models.CASCADE, related_name='category_rankings', verbose_name='Портфолио'
+	)
+	owner = models.ForeignKey(Exhibitors, on_delete=models.CASCADE, related_name='+', verbose_name='Участник')
+
+	# ключи сортировки (без NULL, чтобы порядок совпадал с индексом на любой СУБД)
+	last_exh_year = models.CharField('Год выставки', max_length=150)
+	win_year = models.CharField('Год победы в категории', max_length=150, blank=True, default='')
+	average = models.FloatField('Средняя оценка', default=0)
+
+	# видимость
+	status = models.BooleanField('Видимость на сайте', default=True)
+	exhibition_end = models.DateTimeField('Окончание выставки', null=True)
+
+	# поля карточки проекта
+	project_id = models.IntegerField(null=True)
+	title = models.CharField('Название', max_length=200, blank=True)
+	project_cover = models.CharField('Обложка', max_length=255, blank=True)
+	cover_thumbs = models.JSONField('Миниатюры обложки', default=dict, blank=True)
+	owner_name = models.CharField('Имя участника', max_length=100)
+	owner_slug = models.CharField('Ярлык участника', max_length=100)
+
+	updated_at = models.DateTimeField('Дата изменения', auto_now=True)
+
+	class Meta:
+		verbose_name = 'Рейтинг проекта в категории'
+		verbose_name_plural = 'Рейтинг проектов в категориях'
+		db_table = 'category_rankings'
+		indexes = [
+			models.Index(
+				fields=['category', '-last_exh_year', '-win_year', '-average', '-portfolio'],
+				name='category_ranking_order_idx',
+			),
+		]
+
+	def __str__(self):
+		return f'{self.category_id} / {self.portfolio_id}'
+
+
+class JuryProgress(models.Model):
+	"""
+	Счетчики голосования жюри выставки: сколько проектов номинации оценил член жюри.
+	Меняются при каждой оценке жюри (см. JuryProgressService), панель прогресса в админке читает только их.
+	"""
+	pk = models.CompositePrimaryKey('exhibition', 'nomination', 'jury')
+	exhibition = models.ForeignKey(
+		Exhibitions, on_delete=models.CASCADE, related_name='jury_progress', verbose_name='Выставка'
+	)
+	nomination = models.ForeignKey(Nominations, on_delete=models.CASCADE, related_name='+', verbose_name='Номинация')
+	jury = models.ForeignKey(Jury, on_delete=models.CASCADE, related_name='+', verbose_name='Член жюри')
+	voted = models.PositiveIntegerField('Оценено проектов', default=0)
+	total = models.PositiveIntegerField('Проектов в номинации', default=0)
+
+	updated_at = models.DateTimeField('Дата изменения', auto_now=True)
+
+	class Meta:
+		verbose_name = 'Прогресс голосования жюри'
+		verbose_name_plural = 'Прогресс голосования жюри'
+		db_table = 'jury_progress'
+
+	def __str__(self):
+		return f'{self.exhibition_id} / {self.nomination_id} / {self.jury_id}: {self.voted}/{self.total}'
+
+
 class Image(BaseImageModel):
 	IMAGE_FIELDS = ('file',)
 
@@ -879,3 +1033,57 @@ class MetaSEO(models.Model):
 	def get_content(cls, model, object_id=None):
 		model_name = model.__name__.lower()
 		return cls.objects.filter(model__model=model_name, post_id=object_id or None).first()
+
+
+class ExportJob(models.Model):
+	"""
+	Фоновая выгрузка (см. exhibition.jobs): файл формируется вне запроса админки
+	и хранится в MEDIA_ROOT/exports/ до истечения срока, повторное скачивание - без пересчета.
+	"""
+	PENDING = 'pending'
+	RUNNING = 'running'
+	DONE = 'done'
+	FAILED = 'failed'
+	STATUS_CHOICES = (
+		(PENDING, 'В очереди'),
+		(RUNNING, 'Формируется'),
+		(DONE, 'Готово'),
+		(FAILED, 'Ошибка'),
+	)
+
+	kind = models.CharField('Тип выгрузки', max_length=50)
+	title = models.CharField('Название', max_length=250)
+	params = models.JSONField('Параметры', default=dict, blank=True)
+	# хэш типа, параметров и версии данных: готовый файл с тем же ключом отдается повторно
+	key = models.CharField('Ключ', max_length=64, db_index=True)
+	status = models.CharField('Статус', max_length=10, choices=STATUS_CHOICES, default=PENDING)
+	progress = models.PositiveSmallIntegerField('Готовность, %', default=0)
+	error = models.TextField('Ошибка', blank=True)
+	filename = models.CharField('Имя файла', max_length=250)
+	file = models.FileField('Файл', max_length=250, blank=True)
+	created_by = models.ForeignKey(
+		User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name='Автор'
+	)
+	created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+	finished_at = models.DateTimeField('Дата завершения', null=True, blank=True)
+	expires_at = models.DateTimeField('Хранится до', null=True, blank=True)
+
+	class Meta:
+		verbose_name = 'Выгрузка'
+		verbose_name_plural = 'Выгрузки'
+		db_table = 'export_jobs'
+		ordering = ['-created_at']
+		indexes = [
+			models.Index(fields=['kind', 'status'], name='export_job_kind_status_idx'),
+		]
+
+	def __str__(self):
+		return self.title
+
+	@property
+	def is_finished(self):
+		return self.status in (self.DONE, self.FAILED)
+
+	@property
+	def is_available(self):
+		return self.status == self.DONE and bool(self.file) and (not self.expires_at or self.expires_at > now())
@@ -0,0 +1,170 @@
+import logging
+import threading
+from collections import defaultdict
+from itertools import islice
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, router, transaction
+from django.db.models.signals import post_save
+from watson.models import SearchEntry, get_str_pk, has_int_pk
+from watson.search import SearchEngine
+
+logger = logging.getLogger(__name__)
+
+SEARCH_INDEX_BATCH_SIZE = getattr(settings, 'SEARCH_INDEX_BATCH_SIZE', 200)
+
+
+def defer_index_updates(engine):
+	"""
+	Переключает зарегистрированные в watson модели на отложенную индексацию:
+	вместо синхронного обновления индекса в сохраняющем запросе ключ объекта
+	ставится в очередь после фиксации транзакции. Удаление остается синхронным.
+	"""
+	for model in engine.get_registered_models():
+		post_save.disconnect(engine._post_save_receiver, model)
+		post_save.connect(_post_save_receiver, model, dispatch_uid='deferred_search_index')
+
+
+def _post_save_receiver(sender, instance, **kwargs):
+	for slug, engine in SearchEngine.get_created_engines():
+		if engine.is_registered(sender):
+			queue_index_update(slug, sender, instance.pk)
+
+
+def queue_index_update(engine_slug, model, pk):
+	"""
+	Ключ объекта попадает в очередь только после фиксации транзакции (при откате
+	отбрасывается). Повторные сохранения одного объекта схлопываются в очереди.
+	"""
+	key = (engine_slug, model._meta.label, pk)
+	transaction.on_commit(lambda: schedule_index_update([key]))
+
+
+def get_index_queryset(engine, model):
+	"""Queryset для индексации: live-queryset из регистрации (с его select/prefetch_related) или все объекты модели"""
+	live_queryset = engine.get_adapter(model).get_live_queryset()
+	if live_queryset is None:
+		return model._base_manager.all()
+
+	return live_queryset
+
+
+def get_engine_slug(engine):
+	return next(slug for slug, created in SearchEngine.get_created_engines() if created is engine)
+
+
+def build_search_entries(engine, model, objects):
+	"""Несохраненные записи индекса для объектов модели - те же поля, что заполняет watson при сохранении объекта"""
+	adapter = engine.get_adapter(model)
+	engine_slug = get_engine_slug(engine)
+	content_type = ContentType.objects.get_for_model(model)
+	connection = connections[router.db_for_write(SearchEntry)]
+	int_pk = has_int_pk(model)
+
+	return [
+		SearchEntry(
+			engine_slug=engine_slug,
+			content_type=content_type,
+			object_id=get_str_pk(obj, connection),
+			object_id_int=int(obj.pk) if int_pk else None,
+			title=adapter.get_title(obj),
+			description=adapter.get_description(obj),
+			content=adapter.get_content(obj),
+			url=adapter.get_url(obj),
+			meta_encoded=adapter.serialize_meta(obj),
+		)
+		for obj in objects
+	]
+
+
+def index_objects(engine, model, pks, batch_size=SEARCH_INDEX_BATCH_SIZE):
+	"""
+	Обновляет записи индекса для объектов модели пачками, возвращает количество проиндексированных объектов.
+	Записи пачки заменяются целиком: один DELETE и один INSERT вместо UPDATE на каждый объект.
+	"""
+	queryset = get_index_queryset(engine, model)
+	pks = iter(pks)
+	indexed = 0
+
+	while True:
+		chunk = list(islice(pks, batch_size))
+		if not chunk:
+			return indexed
+
+		entries = build_search_entries(engine, model, queryset.filter(pk__in=chunk))
+		if not entries:
+			continue
+
+		existing = SearchEntry.objects.filter(engine_slug=entries[0].engine_slug, content_type=entries[0].content_type)
+		if entries[0].object_id_int is not None:
+			existing = existing.filter(object_id_int__in=[entry.object_id_int for entry in entries])
+		else:
+			existing = existing.filter(object_id__in=[entry.object_id for entry in entries])
+
+		with transaction.atomic():
+			existing.delete()
+			SearchEntry.objects.bulk_create(entries, batch_size=batch_size)
+		indexed += len(entries)
+
+
+def apply_index_updates(keys):
+	"""Применяет накопленные обновления индекса, сгруппировав их по поисковому движку и модели"""
+	engines = dict(SearchEngine.get_created_engines())
+	grouped = defaultdict(set)
+	for engine_slug, label, pk in keys:
+		grouped[(engine_slug, label)].add(pk)
+
+	indexed = 0
+	for (engine_slug, label), pks in grouped.items():
+		try:
+			engine = engines.get(engine_slug)
+			model = apps.get_model(label)
+			if engine is None or not engine.is_registered(model):
+				continue
+
+			indexed += index_objects(engine, model, sorted(pks))
+		except Exception as e:
+			logger.error(f"Error updating search index for {label} ({len(pks)} objects): {e}")
+
+	if indexed:
+		from exhibition.services import SiteSearchService
+		SiteSearchService.invalidate()
+
+	return indexed
+
+
+_pending_keys = set()
+_pending_lock = threading.Lock()
+_worker_running = False
+
+
+def schedule_index_update(keys):
+	"""Фоновая индексация: ключи, пришедшие во время прохода, обрабатываются в следующем"""
+	global _worker_running
+
+	with _pending_lock:
+		_pending_keys.update(keys)
+		if _worker_running:
+			return
+		_worker_running = True
+
+	threading.Thread(target=_apply_pending_index_updates, daemon=True).start()
+
+
+def _apply_pending_index_updates():
+	global _worker_running
+
+	try:
+		while True:
+			with _pending_lock:
+				keys = set(_pending_keys)
+				_pending_keys.clear()
+				if not keys:
+					_worker_running = False
+					return
+
+			apply_index_updates(keys)
+	finally:
+		connections.close_all()
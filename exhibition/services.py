@@ -1,35 +1,302 @@
+import asyncio
+import hashlib
+import json
+import logging
 import re
+import threading
+import time
 import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
 from decimal import Decimal
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core.cache import cache
 from django.core.cache.utils import make_template_fragment_key
 from django.core.exceptions import ValidationError
-from django.db import transaction
-from django.db.models import Subquery, OuterRef, Avg, When, Q, CharField, Case
+from django.db import connections, transaction
+from django.db.models import Avg, Max, Count, Q, F, Case, When
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
 
 
 class ProjectsQueryService:
 
 	@staticmethod
-	def get_cover_with_rating(queryset):
-		from exhibition.models import Image
-		cover_subquery = Subquery(
-			Image.objects.filter(portfolio=OuterRef('pk')).values('file')[:1]
+	def get_with_rating(queryset):
+		"""
+		Средняя оценка проектов. Обложка хранится в Portfolio.project_cover
+		и синхронизируется сигналами (см. Portfolio.refresh_cover).
+		"""
+		return queryset.annotate(average=Avg('ratings__star'))
+
+	@staticmethod
+	def get_version_stamp(queryset, count_field='id'):
+		"""
+		Дешевые части ETag для списка проектов: время последнего изменения и количество проектов.
+		Изменения фото, оценок, отзывов и побед обновляют Portfolio.updated_at через сигналы,
+		удаление проекта меняет количество.
+		"""
+		stamp = queryset.order_by().aggregate(
+			last_modified=Max('updated_at'),
+			total=Count(count_field, distinct=True)
 		)
+		return stamp['last_modified'], stamp['total']
+
+
+class CategoryRankingService:
+	"""
+	Инкрементальное обновление сводной таблицы CategoryRanking.
+	Пересчитываются только переданные портфолио, по несколько запросов на пакет.
+	"""
+
+	@staticmethod
+	def refresh(portfolio_ids):
+		from .models import Portfolio, Winners, CategoryRanking
 
-		return queryset.annotate(
-			average=Avg('ratings__star'),
-			project_cover=Case(
-				When(Q(cover__isnull=True) | Q(cover=''), then=cover_subquery),
-				default='cover',
-				output_field=CharField()
+		portfolio_ids = {pk for pk in portfolio_ids if pk}
+		if not portfolio_ids:
+			return
+
+		portfolios = {
+			row['id']: row for row in Portfolio.objects.filter(
+				pk__in=portfolio_ids,
+				project_id__isnull=False,
+				exhibition__isnull=False,
+			).order_by().values(
+				'id', 'owner_id', 'project_id', 'title', 'status', 'project_cover', 'cover_thumbs',
+				'exhibition__slug', 'exhibition__date_end', 'owner__name', 'owner__slug',
+			).annotate(average=Avg('ratings__star'))
+		}
+
+		categories = defaultdict(set)
+		for portfolio_id, category_id in Portfolio.nominations.through.objects.filter(
+			portfolio_id__in=portfolios,
+			nominations__category__isnull=False,
+		).values_list('portfolio_id', 'nominations__category_id').distinct():
+			categories[portfolio_id].add(category_id)
+
+		# год победы в категории, как и раньше - по последней выставке
+		win_years = {}
+		for portfolio_id, category_id, slug in Winners.objects.filter(
+			portfolio_id__in=portfolios,
+			nomination__category__isnull=False,
+		).values_list('portfolio_id', 'nomination__category_id', 'exhibition__slug').order_by('-exhibition'):
+			win_years.setdefault((portfolio_id, category_id), slug)
+
+		rankings = [
+			CategoryRanking(
+				category_id=category_id,
+				portfolio_id=portfolio_id,
+				owner_id=row['owner_id'],
+				last_exh_year=row['exhibition__slug'],
+				win_year=win_years.get((portfolio_id, category_id), ''),
+				average=row['average'] or 0,
+				status=row['status'],
+				exhibition_end=row['exhibition__date_end'],
+				project_id=row['project_id'],
+				title=row['title'],
+				project_cover=row['project_cover'],
+				cover_thumbs=row['cover_thumbs'],
+				owner_name=row['owner__name'],
+				owner_slug=row['owner__slug'],
 			)
-		)
+			for portfolio_id, row in portfolios.items()
+			for category_id in categories[portfolio_id]
+		]
+
+		with transaction.atomic():
+			stale = Q(portfolio_id__in=portfolio_ids)
+			for portfolio_id, category_ids in categories.items():
+				stale &= ~Q(portfolio_id=portfolio_id, category_id__in=category_ids)
+			CategoryRanking.objects.filter(stale).delete()
+
+			CategoryRanking.objects.bulk_create(
+				rankings,
+				update_conflicts=True,
+				unique_fields=['category', 'portfolio'],
+				update_fields=[
+					'owner', 'last_exh_year', 'win_year', 'average', 'status', 'exhibition_end', 'project_id',
+					'title', 'project_cover', 'cover_thumbs', 'owner_name', 'owner_slug', 'updated_at',
+				],
+			)
+
+	@staticmethod
+	def refresh_portfolios(queryset, batch_size=200):
+		"""Пересчет рейтинга для выборки портфолио (изменения выставки, номинации, участника)"""
+		ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+
+		for start in range(0, len(ids), batch_size):
+			CategoryRankingService.refresh(ids[start:start + batch_size])
+
+
+class PortfolioImagesService:
+	"""
+	Пакетная загрузка фото портфолио: индексы сортировки назначаются в памяти, строки вставляются
+	одним bulk_create, а оптимизация, обложка, рейтинг и сброс кэша выполняются один раз на портфолио.
+	"""
+
+	@staticmethod
+	def add_images(portfolio, files):
+		from .cache import invalidate_portfolio_cache
+		from .logic import optimize_images_batch, optimize_images_batch_async
+		from .models import Image
+
+		max_sort = Image.objects.filter(portfolio=portfolio).aggregate(max_sort=Max('sort'))['max_sort'] or 0
+
+		def refresh_portfolio(images=None):
+			portfolio.refresh_cover()
+			CategoryRankingService.refresh([portfolio.pk])
+			invalidate_portfolio_cache(portfolio)
+			touch_portfolio(portfolio.pk)
+
+		images = []
+		for file in files:
+			image = Image(portfolio=portfolio, sort=max_sort + len(images) + 1)
+			try:
+				# файл сохраняется в хранилище без записи в БД
+				image.file.save(file.name, file, save=False)
+			except Exception as e:
+				logger.error(f"Error saving image for portfolio {portfolio.id}: {e}")
+				continue
+			images.append(image)
+
+		if images:
+			# bulk_create не вызывает Image.save и сигналы фото
+			images = Image.objects.bulk_create(images)
+			pks = [image.pk for image in images]
+			if Image.IMAGE_OPTIMIZE_ASYNC:
+				# после оптимизации меняются имена файлов, поэтому обложка и кэш обновляются повторно
+				optimize_images_batch_async(
+					Image, pks, Image.IMAGE_FIELDS, to_webp=Image.IMAGE_TO_WEBP, on_complete=refresh_portfolio
+				)
+			elif optimize_images_batch(
+				Image, pks, Image.IMAGE_FIELDS, to_webp=Image.IMAGE_TO_WEBP, on_complete=refresh_portfolio
+			):
+				# обложка и кэш уже обновлены в on_complete
+				return images
+
+		refresh_portfolio()
+
+		return images
+
+
+class ExhibitionPageService:
+	"""
+	Данные страницы выставки: проекты по номинациям и слайдер победителей.
+	Собираются постоянным числом запросов и кэшируются одной структурой на класс пользователей.
+	"""
+
+	@staticmethod
+	def get_role(user, exhibition_ended, is_jury, exhibitor):
+		"""Класс пользователя, определяющий набор видимых проектов"""
+		if user.is_staff or is_jury:
+			return 'staff'
+
+		# до завершения выставки участник видит свои проекты
+		if exhibitor and not exhibition_ended:
+			return f'exhibitor-{exhibitor.pk}'
+
+		return f'public-{int(exhibition_ended)}'
+
+	@staticmethod
+	def build_payload(exhibition, user, show_projects, exhibition_ended):
+		from .models import Portfolio
+
+		payload = {
+			'projects_by_nomination': {},
+			'win_nominations': [],
+			'banner_slider': [],
+			'banner_height': None,
+		}
+
+		if show_projects:
+			visible = Portfolio.objects.get_visible_projects(user, exhibition=exhibition)
+			rows = (
+				Portfolio.nominations.through.objects
+				.filter(portfolio__in=visible.values('pk'))
+				.values(
+					'nominations_id', 'portfolio_id', 'portfolio__title', 'portfolio__project_cover',
+					'portfolio__project_id', 'portfolio__owner__slug', 'portfolio__owner__name'
+				)
+				.order_by('portfolio__order', 'portfolio__title', 'portfolio_id')
+			)
+
+			for row in rows:
+				payload['projects_by_nomination'].setdefault(row['nominations_id'], []).append({
+					'id': row['portfolio_id'],
+					'title': row['portfolio__title'],
+					'cover': row['portfolio__project_cover'],
+					'project_id': row['portfolio__project_id'],
+					'owner_slug': row['portfolio__owner__slug'],
+					'owner_name': row['portfolio__owner__name'],
+				})
+
+		# Баннер слайдер
+		if exhibition.banner and exhibition.banner.width > 0:
+			payload['banner_slider'].append(exhibition.banner.name)
+			payload['banner_height'] = f"{exhibition.banner.height / exhibition.banner.width * 100}%"
+
+		# Для завершенной выставки добавляем обложки проектов победителей в слайдер
+		if exhibition_ended:
+			payload['win_nominations'] = list(
+				exhibition.nominations.filter(
+					nomination_for_winner__exhibition_id=exhibition.id
+				).annotate(
+					exhibitor_name=F('nomination_for_winner__exhibitor__name'),
+					exhibitor_slug=F('nomination_for_winner__exhibitor__slug'),
+					project_id=F('nomination_for_winner__portfolio__project_id'),
+					cover=F('nomination_for_winner__portfolio__project_cover'),
+				).values('id', 'exhibitor_name', 'exhibitor_slug', 'project_id', 'title', 'slug', 'cover')
+			)
+
+			payload['banner_slider'].extend(nom['cover'] for nom in payload['win_nominations'] if nom['cover'])
+
+		return payload
+
+	@staticmethod
+	def get_payload(exhibition, user, role, show_projects, exhibition_ended):
+		from .cache import get_exhibition_payload_key, EXHIBITION_PAYLOAD_TIMEOUT
+
+		cache_key = get_exhibition_payload_key(exhibition.id, role)
+		payload = cache.get(cache_key)
+
+		if payload is None:
+			payload = ExhibitionPageService.build_payload(exhibition, user, show_projects, exhibition_ended)
+			cache.set(cache_key, payload, EXHIBITION_PAYLOAD_TIMEOUT)
+
+		return payload
 
 
 class WinnersService:
 
+	@staticmethod
+	def get_jury_stats(exhibition):
+		"""
+		Оценки жюри по парам (номинация, портфолио) выставки одним сгруппированным запросом
+		по таблице связи портфолио-номинация.
+		"""
+		from .models import Portfolio
+
+		jury_filter = Q(portfolio__ratings__is_jury_rating=True)
+
+		return (
+			Portfolio.nominations.through.objects
+			.filter(
+				portfolio__exhibition=exhibition,
+				portfolio__status=True,
+				nominations__in=exhibition.nominations.all(),
+			)
+			.values('nominations_id', 'portfolio_id', 'portfolio__owner_id')
+			.annotate(
+				jury_average=Avg('portfolio__ratings__star', filter=jury_filter),
+				jury_count=Count('portfolio__ratings__star', filter=jury_filter),
+			)
+			.order_by('nominations_id', 'portfolio__order', 'portfolio__title', 'portfolio_id')
+		)
+
 	@staticmethod
 	def build_winners_preview(exhibition):
 		from collections import defaultdict
@@ -40,25 +307,18 @@ class WinnersService:
 			'conflicts': [],
 		}
 
-		# Группируем портфолио по номинациям
+		# Группируем портфолио с оценками жюри по номинациям
 		nomination_portfolios = defaultdict(list)
 
-		# Загружаем все портфолио с оценками
-		portfolios_qs = (
-			exhibition.portfolio_set
-			.filter(status=True)
-			.prefetch_related('nominations')
-			.select_related('owner')
-		)
-
-		# Собираем портфолио по номинациям
-		for portfolio in portfolios_qs:
-			portfolio_stats = portfolio.get_rating_stats()
-			for nomination in portfolio.nominations.all():
-				nomination_portfolios[nomination.id].append({
-					'portfolio': portfolio,
-					'stats': portfolio_stats,
-				})
+		for row in WinnersService.get_jury_stats(exhibition):
+			nomination_portfolios[row['nominations_id']].append({
+				'portfolio_id': row['portfolio_id'],
+				'exhibitor_id': row['portfolio__owner_id'],
+				'stats': {
+					'jury_average': row['jury_average'] or 0.0,
+					'jury_count': row['jury_count'] or 0,
+				},
+			})
 
 		# Обрабатываем каждую номинацию
 		for nomination in exhibition.nominations.all():
@@ -89,8 +349,8 @@ class WinnersService:
 			for item in portfolios_in_nomination:
 				if item['stats']['jury_average'] > 0:
 					scored.append({
-						'portfolio_id': item['portfolio'].id,
-						'exhibitor_id': item['portfolio'].owner.id,
+						'portfolio_id': item['portfolio_id'],
+						'exhibitor_id': item['exhibitor_id'],
 						'avg': item['stats']['jury_average'],
 						'votes': item['stats']['jury_count'],
 					})
@@ -287,6 +547,680 @@ class WinnersService:
 				)
 
 
+class JuryReportService:
+	"""
+	Протокол оценок жюри (HTML-страница и Excel-выгрузка в админке выставки).
+	Оценки выставки читаются одним запросом в компактную матрицу проект x член жюри,
+	из которой выводятся средние баллы, количество голосов, пропуски и победители.
+	Матрица кэшируется до изменения выставки или оценок жюри.
+	"""
+
+	@staticmethod
+	def build_matrix(exhibition):
+		from .models import Portfolio
+		from rating.models import Rating
+
+		jury_list = list(exhibition.jury.select_related('user'))
+		nominations = list(exhibition.nominations.all())
+		portfolios = list(Portfolio.objects.filter(exhibition=exhibition, status=True).select_related('owner'))
+
+		portfolio_index = {portfolio.id: i for i, portfolio in enumerate(portfolios)}
+		jury_columns = defaultdict(list)
+		for column, jury in enumerate(jury_list):
+			if jury.user_id:
+				jury_columns[jury.user_id].append(column)
+
+		# проекты номинаций в порядке сортировки портфолио
+		nomination_rows = defaultdict(list)
+		portfolio_nominations = Portfolio.nominations.through.objects.filter(
+			portfolio__exhibition=exhibition, portfolio__status=True
+		).values_list('nominations_id', 'portfolio_id')
+		for nomination_id, portfolio_id in portfolio_nominations:
+			nomination_rows[nomination_id].append(portfolio_index[portfolio_id])
+		for rows in nomination_rows.values():
+			rows.sort()
+
+		scores = [[None] * len(jury_list) for _ in portfolios]
+		star_sum = [0] * len(portfolios)
+		star_count = [0] * len(portfolios)
+		total_ratings = 0
+
+		ratings = Rating.objects.filter(
+			portfolio__exhibition=exhibition,
+			is_jury_rating=True,
+			user_id__in=list(jury_columns),
+		).values_list('portfolio_id', 'user_id', 'star')
+
+		for portfolio_id, user_id, star in ratings:
+			total_ratings += len(jury_columns[user_id])
+			row = portfolio_index.get(portfolio_id)
+			if row is None:
+				continue
+
+			star_sum[row] += star
+			star_count[row] += 1
+			for column in jury_columns[user_id]:
+				scores[row][column] = (scores[row][column] or 0) + star
+
+		return {
+			'jury_list': jury_list,
+			'nominations': nominations,
+			'portfolios': portfolios,
+			'nomination_rows': dict(nomination_rows),
+			'scores': scores,
+			'star_sum': star_sum,
+			'star_count': star_count,
+			'total_ratings': total_ratings,
+		}
+
+	@staticmethod
+	def get_matrix(exhibition):
+		from .cache import get_jury_report_key, EXHIBITION_PAYLOAD_TIMEOUT
+
+		cache_key = get_jury_report_key(exhibition.id)
+		matrix = cache.get(cache_key)
+		if matrix is None:
+			matrix = JuryReportService.build_matrix(exhibition)
+			cache.set(cache_key, matrix, EXHIBITION_PAYLOAD_TIMEOUT)
+
+		return matrix
+
+	@staticmethod
+	def build_report(matrix, title, projects_per_nomination):
+		"""Данные протокола для шаблона и JuryReportWriter из матрицы оценок"""
+		jury_list = matrix['jury_list']
+		portfolios = matrix['portfolios']
+		scores = matrix['scores']
+		star_count = matrix['star_count']
+		totals = [
+			round(total / count, 2) if count else 0
+			for total, count in zip(matrix['star_sum'], star_count)
+		]
+
+		report_data = {
+			'title': title,
+			'jury_list': jury_list,
+			'nominations': [],
+			'jury_stats': {jury.id: {'name': jury.name or jury.user_name} for jury in jury_list},
+			'not_voted_jury': {jury.id: {'jury': jury, 'nominations': [], 'total_missing': 0} for jury in jury_list},
+			'total_stats': {
+				'total_jury': len(jury_list),
+				'total_nominations': len(matrix['nominations']),
+				'total_projects': 0,
+				'total_ratings': matrix['total_ratings'],
+			}
+		}
+
+		for nomination in matrix['nominations']:
+			rows = matrix['nomination_rows'].get(nomination.id, [])
+			# сортировка устойчивая: при равенстве сохраняется порядок портфолио
+			rows = sorted(rows, key=lambda row: (totals[row], star_count[row]), reverse=True)
+
+			jury_counts = {
+				jury.id: sum(scores[row][column] is not None for row in rows)
+				for column, jury in enumerate(jury_list)
+			}
+			projects_data = [
+				{
+					'portfolio': portfolios[row],
+					'jury_scores': {jury.id: scores[row][column] for column, jury in enumerate(jury_list)},
+					'total_score': totals[row],
+					'votes': star_count[row],
+				}
+				for row in rows
+			]
+
+			winners = []
+			if rows:
+				max_score = totals[rows[0]]
+				winners = [
+					{'portfolio': portfolios[row], 'score': totals[row], 'medal': 'gold', 'position': 1}
+					for row in rows if totals[row] == max_score and star_count[row] > 0
+				]
+
+			for jury in jury_list:
+				missing = len(rows) - jury_counts[jury.id]
+				if missing > 0:
+					not_voted = report_data['not_voted_jury'][jury.id]
+					not_voted['nominations'].append({
+						'nomination': nomination,
+						'voted': jury_counts[jury.id],
+						'total': len(rows),
+						'missing': missing,
+					})
+					not_voted['total_missing'] += missing
+
+			report_data['nominations'].append({
+				'title': nomination.title,
+				'all_projects': len(rows),
+				'top_projects': projects_data[:projects_per_nomination],
+				'other_projects': projects_data[projects_per_nomination:],
+				'winners': winners,
+				'jury_counts': jury_counts,
+			})
+			report_data['total_stats']['total_projects'] += len(rows)
+
+		# убрать тех, у кого нет пропусков
+		report_data['not_voted_jury'] = {
+			k: v for k, v in report_data['not_voted_jury'].items() if v['total_missing'] > 0
+		}
+
+		return report_data
+
+	@staticmethod
+	def get_report_data(exhibition, projects_per_nomination):
+		return JuryReportService.build_report(
+			JuryReportService.get_matrix(exhibition),
+			f'Протокол оценок жюри: {exhibition.title}',
+			projects_per_nomination,
+		)
+
+	@staticmethod
+	def get_export_version(exhibition_id):
+		"""
+		Версия данных протокола для повторной выдачи готовых выгрузок (exhibition.jobs).
+		Версии в кэше начинаются заново после его сброса, поэтому к ним добавляется отметка из БД:
+		число и время последнего изменения оценок жюри и проектов выставки
+		"""
+		from .cache import get_jury_report_key
+		from .models import Portfolio
+		from rating.models import Rating
+
+		stamp = {'id': Count('id'), 'updated_at': Max('updated_at')}
+		return [
+			get_jury_report_key(exhibition_id),
+			Rating.objects.filter(portfolio__exhibition_id=exhibition_id, is_jury_rating=True).order_by().aggregate(**stamp),
+			Portfolio.objects.filter(exhibition_id=exhibition_id).order_by().aggregate(**stamp),
+		]
+
+
+class JuryProgressService:
+	"""
+	Панель прогресса голосования жюри в админке выставки.
+	Счетчики JuryProgress (член жюри x номинация) сдвигаются на каждую оценку жюри одним UPDATE
+	и пересчитываются целиком только при изменении состава выставки. Поток Server-Sent Events (ASGI)
+	и опрос снимков (WSGI) сверяют версию счетчиков в кэше и читают таблицу, только когда она изменилась.
+	"""
+	STREAM_POLL_INTERVAL = 1
+	# опрос снимков панелью на WSGI, секунд
+	POLL_INTERVAL = 5
+	STREAM_KEEPALIVE = 15
+	# по истечении браузер переподключается сам (EventSource) и передает Last-Event-ID
+	STREAM_DURATION = 300
+	STREAM_RETRY = 3000
+
+	@staticmethod
+	def refresh(exhibition_id):
+		"""Пересчет счетчиков выставки по таблице оценок: по одному запросу на жюри, номинации, проекты и оценки"""
+		from .cache import invalidate_jury_progress
+		from .models import Exhibitions, JuryProgress, Portfolio
+		from rating.models import Rating
+
+		exhibition = Exhibitions.objects.filter(pk=exhibition_id).first()
+		if exhibition is None:
+			return
+
+		jury_users = dict(exhibition.jury.values_list('id', 'user_id'))
+		nomination_ids = list(exhibition.nominations.values_list('id', flat=True))
+		totals = dict(
+			Portfolio.nominations.through.objects.filter(
+				portfolio__exhibition=exhibition, portfolio__status=True, nominations_id__in=nomination_ids
+			).order_by().values_list('nominations_id').annotate(total=Count('portfolio_id'))
+		)
+		voted = defaultdict(int)
+		for nomination_id, user_id, count in Rating.objects.filter(
+			portfolio__exhibition=exhibition,
+			portfolio__status=True,
+			portfolio__nominations__in=nomination_ids,
+			is_jury_rating=True,
+			user_id__in=[user_id for user_id in jury_users.values() if user_id],
+		).order_by().values_list('portfolio__nominations', 'user_id').annotate(count=Count('id')):
+			voted[nomination_id, user_id] = count
+
+		rows = [
+			JuryProgress(
+				exhibition=exhibition,
+				nomination_id=nomination_id,
+				jury_id=jury_id,
+				voted=voted[nomination_id, user_id] if user_id else 0,
+				total=totals.get(nomination_id, 0),
+			)
+			for nomination_id in nomination_ids
+			for jury_id, user_id in jury_users.items()
+		]
+
+		with transaction.atomic():
+			JuryProgress.objects.filter(exhibition=exhibition).exclude(
+				nomination_id__in=nomination_ids, jury_id__in=list(jury_users)
+			).delete()
+			JuryProgress.objects.bulk_create(
+				rows,
+				update_conflicts=True,
+				unique_fields=['exhibition', 'nomination', 'jury'],
+				update_fields=['voted', 'total', 'updated_at'],
+			)
+			transaction.on_commit(lambda: invalidate_jury_progress(exhibition.pk))
+
+	@classmethod
+	def record(cls, portfolio, user_id, delta):
+		"""
+		Сдвиг счетчиков на оценку жюри: +1 - новая оценка, -1 - удаленная.
+		portfolio - с полями exhibition_id и status (например, из RatingService.get_portfolio)
+		"""
+		from .cache import invalidate_jury_progress
+		from .models import JuryProgress, Portfolio
+
+		if not delta or not portfolio.exhibition_id or not portfolio.status:
+			return
+
+		updated = JuryProgress.objects.filter(
+			exhibition_id=portfolio.exhibition_id,
+			jury__user_id=user_id,
+			nomination_id__in=Portfolio.nominations.through.objects.filter(
+				portfolio_id=portfolio.pk
+			).values('nominations_id'),
+		).update(voted=F('voted') + delta, updated_at=timezone.now())
+
+		if not updated and not JuryProgress.objects.filter(exhibition_id=portfolio.exhibition_id).exists():
+			# счетчиков выставки еще нет - считаем по таблице оценок
+			cls.refresh(portfolio.exhibition_id)
+		else:
+			transaction.on_commit(lambda: invalidate_jury_progress(portfolio.exhibition_id))
+
+	@staticmethod
+	def shift_nominations(portfolio, nomination_ids, delta):
+		"""
+		Сдвиг счетчиков при добавлении (+1) или снятии (-1) номинаций проекта: два UPDATE вместо
+		пересчета выставки. portfolio - с полями exhibition_id и status
+		"""
+		from .cache import invalidate_jury_progress
+		from .models import JuryProgress
+		from rating.models import Rating
+
+		if not nomination_ids or not portfolio.exhibition_id or not portfolio.status:
+			return
+
+		rows = JuryProgress.objects.filter(exhibition_id=portfolio.exhibition_id, nomination_id__in=nomination_ids)
+		now = timezone.now()
+		with transaction.atomic():
+			rows.update(total=F('total') + delta, updated_at=now)
+			rows.filter(
+				jury__user_id__in=Rating.objects.filter(portfolio_id=portfolio.pk, is_jury_rating=True).values('user_id')
+			).update(voted=F('voted') + delta, updated_at=now)
+			transaction.on_commit(lambda: invalidate_jury_progress(portfolio.exhibition_id))
+
+	@classmethod
+	def get_state(cls, exhibition_id):
+		"""Прогресс по членам жюри и номинациям (данные панели и событий потока)"""
+		from .models import JuryProgress
+
+		queryset = JuryProgress.objects.filter(exhibition_id=exhibition_id).select_related(
+			'jury__user', 'nomination'
+		).order_by('nomination__sort', 'nomination__title', 'jury__sort', 'jury_id')
+		rows = list(queryset)
+		if not rows:
+			# выставка из времени до появления счетчиков
+			cls.refresh(exhibition_id)
+			rows = list(queryset.all())
+
+		jury, nominations = {}, {}
+		for row in rows:
+			member = jury.setdefault(row.jury_id, {
+				'id': row.jury_id, 'name': row.jury.name or row.jury.user_name, 'voted': 0, 'total': 0, 'nominations': [],
+			})
+			nomination = nominations.setdefault(row.nomination_id, {
+				'id': row.nomination_id, 'title': row.nomination.title, 'projects': row.total, 'voted': 0, 'total': 0,
+			})
+			# строки - полное произведение жюри x номинации, поэтому списки совпадают по порядку с nominations
+			member['nominations'].append({'voted': row.voted, 'total': row.total})
+			for progress in (member, nomination):
+				progress['voted'] += row.voted
+				progress['total'] += row.total
+
+		voted, total = sum(row.voted for row in rows), sum(row.total for row in rows)
+		return {
+			'jury': list(jury.values()),
+			'nominations': list(nominations.values()),
+			'voted': voted,
+			'total': total,
+			'missing': total - voted,
+			'updated_at': max((row.updated_at for row in rows), default=None),
+		}
+
+	@staticmethod
+	def format_event(version, state):
+		data = json.dumps(state, default=str, ensure_ascii=False)
+		return f'id: {version}\nevent: progress\ndata: {data}\n\n'
+
+	@staticmethod
+	def get_version(exhibition_id):
+		from .cache import get_jury_progress_version
+		return str(get_jury_progress_version(exhibition_id))
+
+	@classmethod
+	async def astream(cls, exhibition_id, last_event_id=None):
+		"""
+		Поток событий для ASGI (settings.ASYNC_VIEWS): ожидание не занимает поток.
+		На WSGI поток занимал бы воркер целиком, поэтому там панель опрашивает снимки (POLL_INTERVAL)
+		"""
+		from .cache import aget_jury_progress_version
+
+		yield f'retry: {cls.STREAM_RETRY}\n\n'
+		started = sent = time.monotonic()
+		while time.monotonic() - started < cls.STREAM_DURATION:
+			version = str(await aget_jury_progress_version(exhibition_id))
+			if version != last_event_id:
+				last_event_id = version
+				yield cls.format_event(version, await sync_to_async(cls.get_state)(exhibition_id))
+				sent = time.monotonic()
+			elif time.monotonic() - sent >= cls.STREAM_KEEPALIVE:
+				yield ': keepalive\n\n'
+				sent = time.monotonic()
+			await asyncio.sleep(cls.STREAM_POLL_INTERVAL)
+
+
+class ExhibitorSearchService:
+	"""
+	Автодополнение участников по нормализованному имени (Exhibitors.search_name).
+	На PostgreSQL с расширением pg_trgm поиск идет по его GIN-индексу, на остальных БД - по префиксам
+	слов из индекса в памяти процесса, который перестраивается при смене версии в кэше.
+	"""
+	MIN_QUERY_LENGTH = 3
+	MAX_RESULTS = 200
+	TRIGRAM_INDEX_NAME = 'exhibitors_search_name_trgm'
+	# наличие pg_trgm по алиасам БД (проверяется один раз на процесс)
+	_trigram_extension = {}
+	VERSION_KEY = 'exhibitor:search:version'
+
+	_prefix_index = None
+	_prefix_lock = threading.Lock()
+
+	@staticmethod
+	def normalize(*parts):
+		"""Имя для поиска: нижний регистр, ё -> е, без знаков препинания и лишних пробелов"""
+		text = unicodedata.normalize('NFKC', ' '.join(part for part in parts if part))
+		return ' '.join(re.findall(r'\w+', text.casefold().replace('ё', 'е')))
+
+	@classmethod
+	def get_search_name(cls, exhibitor):
+		user = exhibitor.user if exhibitor.user_id else None
+		return cls.normalize(exhibitor.name, user and user.first_name, user and user.last_name)
+
+	@classmethod
+	def invalidate(cls):
+		cache.set(cls.VERSION_KEY, time.time_ns(), None)
+
+	@classmethod
+	def refresh_for_user(cls, user):
+		"""Имя и фамилия пользователя входят в search_name связанного участника"""
+		from .models import Exhibitors
+
+		exhibitors = list(Exhibitors._base_manager.filter(user=user).select_related('user'))
+		for exhibitor in exhibitors:
+			search_name = cls.get_search_name(exhibitor)
+			if search_name != exhibitor.search_name:
+				Exhibitors._base_manager.filter(pk=exhibitor.pk).update(search_name=search_name)
+				cls.invalidate()
+
+	@classmethod
+	def backfill(cls, batch_size=500):
+		"""Заполняет search_name участников, созданных до появления поля"""
+		from .models import Exhibitors
+
+		exhibitors = list(Exhibitors._base_manager.filter(search_name='').select_related('user'))
+		for exhibitor in exhibitors:
+			exhibitor.search_name = cls.get_search_name(exhibitor)
+
+		Exhibitors._base_manager.bulk_update(exhibitors, ['search_name'], batch_size=batch_size)
+		if exhibitors:
+			cls.invalidate()
+
+		return len(exhibitors)
+
+	@classmethod
+	def has_trigram_extension(cls, using='default'):
+		"""
+		Установлено ли расширение pg_trgm. Оно создается администратором БД один раз (см. README):
+		CREATE EXTENSION требует прав, которых у пользователя приложения может не быть
+		"""
+		connection = connections[using]
+		if connection.vendor != 'postgresql':
+			return False
+
+		if using not in cls._trigram_extension:
+			with connection.cursor() as cursor:
+				cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+				cls._trigram_extension[using] = cursor.fetchone() is not None
+
+		return cls._trigram_extension[using]
+
+	@classmethod
+	def create_trigram_index(cls, using='default'):
+		"""GIN-индекс pg_trgm для поиска по подстроке (LIKE '%...%') и сортировки по похожести"""
+		from .models import Exhibitors
+
+		connection = connections[using]
+		if connection.vendor != 'postgresql':
+			return False
+
+		# после migrate расширение могли установить - проверяем заново
+		cls._trigram_extension.pop(using, None)
+		if not cls.has_trigram_extension(using):
+			logger.warning("PostgreSQL extension pg_trgm is not installed, exhibitor search index is not created")
+			return False
+
+		with connection.cursor() as cursor:
+			cursor.execute(
+				f'CREATE INDEX IF NOT EXISTS {cls.TRIGRAM_INDEX_NAME} '
+				f'ON {Exhibitors._meta.db_table} USING gin (search_name gin_trgm_ops)'
+			)
+		return True
+
+	@classmethod
+	def search_queryset(cls, queryset, query, index=None):
+		"""Участники из queryset, подходящие под запрос, в порядке релевантности (index - индекс префиксов, если уже получен)"""
+		query = cls.normalize(query)
+		if not query:
+			return queryset.none()
+
+		if cls.has_trigram_extension(queryset.db):
+			from django.contrib.postgres.search import TrigramSimilarity
+
+			return queryset.filter(search_name__contains=query).annotate(
+				search_prefix=Case(When(search_name__startswith=query, then=1), default=0),
+				search_similarity=TrigramSimilarity('search_name', query),
+			).order_by('-search_prefix', '-search_similarity', 'name')
+
+		ids = cls._match_prefix(query, index)[:cls.MAX_RESULTS]
+		return queryset.filter(pk__in=ids).order_by(
+			Case(*(When(pk=pk, then=position) for position, pk in enumerate(ids)), default=len(ids))
+		)
+
+	@staticmethod
+	def get_queryset(exhibition_id=None):
+		from .models import Exhibitors
+
+		exhibitors = Exhibitors.objects.select_related('user')
+		if exhibition_id:
+			exhibitors = exhibitors.filter(exhibitors_for_exh__id=exhibition_id)
+		return exhibitors
+
+	@staticmethod
+	def serialize(exhibitor):
+		return {
+			'id': exhibitor.id,
+			'name': exhibitor.name or f"{exhibitor.user.first_name} {exhibitor.user.last_name}".strip(),
+		}
+
+	@classmethod
+	def search(cls, query='', limit=50, exhibition_id=None):
+		"""Результаты для API автодополнения: список словарей id/name"""
+		exhibitors = cls.get_queryset(exhibition_id)
+
+		if query:
+			if len(cls.normalize(query)) < cls.MIN_QUERY_LENGTH:
+				return []
+			exhibitors = cls.search_queryset(exhibitors, query)
+		else:
+			exhibitors = exhibitors.order_by('name')
+
+		return [cls.serialize(exh) for exh in exhibitors[:limit]]
+
+	@classmethod
+	async def asearch(cls, query='', limit=50, exhibition_id=None):
+		"""Асинхронная версия search() (exhibition.api): кэш и БД читаются без блокировки цикла событий"""
+		exhibitors = cls.get_queryset(exhibition_id)
+
+		if query:
+			if len(cls.normalize(query)) < cls.MIN_QUERY_LENGTH:
+				return []
+
+			index = None
+			# флаг кэшируется, поэтому search_queryset ниже уже не обращается к БД синхронно
+			if not await sync_to_async(cls.has_trigram_extension)(exhibitors.db):
+				version = await cache.aget_or_set(cls.VERSION_KEY, time.time_ns, None)
+				index = cls._prefix_index
+				if not index or index['version'] != version:
+					index = await sync_to_async(cls._get_prefix_index)(version)
+			exhibitors = cls.search_queryset(exhibitors, query, index)
+		else:
+			exhibitors = exhibitors.order_by('name')
+
+		return [cls.serialize(exh) async for exh in exhibitors[:limit]]
+
+	@classmethod
+	def _get_prefix_index(cls, version=None):
+		"""Отсортированные пары (слово, id) и нормализованные имена участников"""
+		from .models import Exhibitors
+
+		if version is None:
+			version = cache.get_or_set(cls.VERSION_KEY, time.time_ns, None)
+		index = cls._prefix_index
+		if index and index['version'] == version:
+			return index
+
+		with cls._prefix_lock:
+			if cls._prefix_index and cls._prefix_index['version'] == version:
+				return cls._prefix_index
+
+			names = dict(Exhibitors._base_manager.exclude(search_name='').values_list('id', 'search_name'))
+			tokens = sorted((token, pk) for pk, name in names.items() for token in set(name.split()))
+			cls._prefix_index = {'version': version, 'tokens': tokens, 'keys': [t for t, _ in tokens], 'names': names}
+
+		return cls._prefix_index
+
+	@classmethod
+	def _match_prefix(cls, query, index=None):
+		"""
+		Id участников, у которых каждое слово запроса является началом одного из слов имени.
+		Выше те, чье имя начинается с запроса, затем по алфавиту.
+		"""
+		index = index or cls._get_prefix_index()
+		words = query.split()
+		first = max(words, key=len)
+
+		keys, tokens, names = index['keys'], index['tokens'], index['names']
+		start = bisect_left(keys, first)
+		candidates = {pk for _, pk in tokens[start:bisect_left(keys, first + '\uffff', lo=start)]}
+
+		matches = [
+			pk for pk in candidates
+			if all(any(token.startswith(word) for token in names[pk].split()) for word in words)
+		]
+		return sorted(matches, key=lambda pk: (not names[pk].startswith(query), names[pk], pk))
+
+
+class SiteSearchService:
+	"""
+	Поиск по сайту (watson) с кэшированием: для нормализованного запроса из индекса получается
+	ранжированный список id записей с их разделами (не длиннее MAX_RESULTS) и количества по разделам,
+	посчитанные группировкой по всем найденным записям. Пагинация и фильтр по разделу работают по списку.
+	"""
+	FACETS = {
+		'projects': ('Проекты', 'exhibition.Portfolio'),
+		'exhibitors': ('Участники', 'exhibition.Exhibitors'),
+		'jury': ('Жюри', 'exhibition.Jury'),
+		'events': ('Мероприятия', 'exhibition.Events'),
+	}
+	OTHER_FACET = 'other'
+	MAX_RESULTS = 1000
+	RESULTS_TIMEOUT = 300
+	VERSION_KEY = 'search:results:version'
+
+	@staticmethod
+	def normalize_query(query):
+		return ' '.join(query.split()).casefold()
+
+	@classmethod
+	def get_cache_key(cls, query):
+		version = cache.get_or_set(cls.VERSION_KEY, 1, None)
+		digest = hashlib.md5(query.encode('utf-8')).hexdigest()
+		return f'search:results:{version}:{digest}'
+
+	@classmethod
+	def invalidate(cls):
+		"""Сброс закэшированных результатов после обновления поискового индекса"""
+		try:
+			cache.incr(cls.VERSION_KEY)
+		except ValueError:
+			pass
+
+	@classmethod
+	def get_facet_map(cls):
+		"""content_type_id -> раздел поиска"""
+		from django.apps import apps
+		from django.contrib.contenttypes.models import ContentType
+
+		models = {apps.get_model(label): facet for facet, (_, label) in cls.FACETS.items()}
+		return {ct.id: models[model] for model, ct in ContentType.objects.get_for_models(*models).items()}
+
+	@classmethod
+	def search(cls, query):
+		"""
+		Результаты запроса: {'results': [[id записи индекса, раздел], ...], 'counts': {раздел: количество}}.
+		Кэшируются на RESULTS_TIMEOUT секунд.
+		"""
+		query = cls.normalize_query(query)
+		if not query:
+			return {'results': [], 'counts': {}}
+
+		cache_key = cls.get_cache_key(query)
+		data = cache.get(cache_key)
+		if data is not None:
+			return data
+
+		from watson import search as watson
+
+		facet_map = cls.get_facet_map()
+		rows = watson.search(query).values_list('id', 'content_type_id')[:cls.MAX_RESULTS]
+		results = [[entry_id, facet_map.get(content_type_id, cls.OTHER_FACET)] for entry_id, content_type_id in rows]
+
+		# количества считаются по всем найденным записям, а не по усеченному списку
+		counts = defaultdict(int)
+		groups = watson.search(query, ranking=False).order_by().values('content_type_id').annotate(count=Count('id'))
+		for group in groups:
+			counts[facet_map.get(group['content_type_id'], cls.OTHER_FACET)] += group['count']
+
+		data = {'results': results, 'counts': dict(counts)}
+		cache.set(cache_key, data, cls.RESULTS_TIMEOUT)
+		return data
+
+	@classmethod
+	def get_facets(cls, counts):
+		"""Разделы для навигации по результатам: (ключ, название, количество)"""
+		facets = [(None, 'Все', sum(counts.values()))]
+		facets += [(facet, title, counts[facet]) for facet, (title, _) in cls.FACETS.items() if counts.get(facet)]
+		return facets
+
+	@staticmethod
+	def get_entries(entry_ids):
+		"""Записи индекса для страницы результатов в порядке ранжирования, вместе с объектами"""
+		from watson.models import SearchEntry
+
+		entries = SearchEntry.objects.filter(id__in=entry_ids).prefetch_related('object').in_bulk()
+		return [entries[entry_id] for entry_id in entry_ids if entry_id in entries]
+
+
 def delete_cached_fragment(fragment_name, *args):
 	""" Reset cache """
 	key = make_template_fragment_key(fragment_name, args or None)
@@ -294,6 +1228,21 @@ def delete_cached_fragment(fragment_name, *args):
 	return key
 
 
+async def adelete_cached_fragment(fragment_name, *args):
+	key = make_template_fragment_key(fragment_name, args or None)
+	await cache.adelete(key)
+	return key
+
+
+def touch_portfolio(portfolio_id):
+	""" Обновляет метку изменения портфолио (валидатор для условных GET-запросов) """
+	if not portfolio_id:
+		return
+
+	from exhibition.models import Portfolio
+	Portfolio.objects.filter(pk=portfolio_id).update(updated_at=timezone.now())
+
+
 def unicode_emoji(data, direction='encode'):
 	""" Encoding/decoding emoji in string data """
 	if data:
@@ -330,5 +1279,10 @@ def is_mobile(request):
 		return False
 
 
-def update_google_sitemap():
-	...
+def update_google_sitemap(*sections):
+	""" Фоновая перегенерация gzip-файлов измененных разделов карты сайта после фиксации транзакции """
+	if not sections or not getattr(settings, 'SITEMAP_AUTO_UPDATE', True):
+		return
+
+	from .sitemap import schedule_sitemaps_update
+	transaction.on_commit(lambda: schedule_sitemaps_update(sections))
@@ -3,14 +3,22 @@ import logging
 from allauth.account.models import EmailAddress
 from allauth.account.signals import user_signed_up
 from django.contrib.auth import get_user_model
-from django.db import models
-from django.db.models.signals import post_save, m2m_changed, post_delete
+from django.db import models, transaction
+from django.db.models.signals import post_save, m2m_changed, post_delete, pre_delete, post_migrate
 from django.dispatch import receiver
 from django.template.loader import render_to_string
 
 from .logic import send_email_async
-from .models import Portfolio, Winners, Image
-from .cache import invalidate_portfolio_cache
+from .jobs import delete_job_file
+from .models import (
+	Portfolio, Winners, Image, Exhibitions, Exhibitors, Jury, Nominations, CategoryRanking, ExportJob
+)
+from .cache import invalidate_portfolio_cache, invalidate_exhibition_payload, invalidate_jury_report
+from .services import (
+	touch_portfolio, update_google_sitemap, CategoryRankingService, PortfolioImagesService, ExhibitorSearchService,
+	JuryProgressService,
+)
+from .sitemap import get_sitemap_sections
 from .utils import set_user_group
 
 logger = logging.getLogger(__name__)
@@ -23,41 +31,191 @@ def portfolio_post_save(sender, instance, created, **kwargs):
 	"""
 	Обработчик для сохранения изображений портфолио и сброса кэша страниц.
 	"""
-	if hasattr(instance, '_images_to_save') and instance._images_to_save:
-		# Получаем максимальный sort для этого портфолио
-		max_sort = Image.objects.filter(portfolio=instance).aggregate(max_sort=models.Max('sort'))['max_sort'] or 0
-
-		for idx, image_file in enumerate(instance._images_to_save, start=1):
-			try:
-				Image.objects.create(
-					portfolio=instance,
-					sort=max_sort + idx,
-					file=image_file
-				)
-
-			except Exception as e:
-				logger.error(f"Error saving image for portfolio {instance.id}: {e}")
-
+	# перенос или скрытие проекта меняет число проектов в номинациях для панели прогресса жюри
+	# (у нового проекта номинаций еще нет)
+	scope = instance.get_jury_scope()
+	if not created and scope != instance.original_jury_scope:
+		for exhibition_id in {instance.original_jury_scope[0], scope[0]} - {None}:
+			JuryProgressService.refresh(exhibition_id)
+
+	images = getattr(instance, '_images_to_save', None)
+	if images:
 		# Очищаем временный атрибут
 		del instance._images_to_save
 
+		# фото вставляются пакетом, обложка, рейтинг и кэш обновляются внутри один раз;
+		# файлы пишутся после фиксации, чтобы не держать транзакцию (и блокировку участника) на время записи
+		transaction.on_commit(lambda: PortfolioImagesService.add_images(instance, images))
+		return
+
+	instance.refresh_cover()
+	CategoryRankingService.refresh([instance.pk])
 	invalidate_portfolio_cache(instance)
 
 
 @receiver([post_save, post_delete], sender=Image)
 def portfolio_image_changed(sender, instance, **kwargs):
-	if instance.portfolio:
-		invalidate_portfolio_cache(instance.portfolio)
+	portfolio = Portfolio.objects.filter(pk=instance.portfolio_id).only(
+		'id', 'project_id', 'cover', 'project_cover', 'owner'
+	).first()
+
+	# портфолио может удаляться каскадом вместе с фото
+	if portfolio:
+		if portfolio.refresh_cover():
+			CategoryRankingService.refresh([portfolio.pk])
+		invalidate_portfolio_cache(portfolio)
+		touch_portfolio(portfolio.pk)
 
 
 @receiver(m2m_changed, sender=Portfolio.nominations.through)
-def portfolio_nominations_changed(sender, instance, **kwargs):
-	invalidate_portfolio_cache(instance)
+def portfolio_nominations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+	jury_progress_nominations_changed(instance, action, reverse, pk_set)
+
+	# со стороны номинации instance - Nominations, а в pk_set - проекты
+	portfolios = Portfolio.objects.filter(pk__in=pk_set or ()) if reverse else [instance]
+	for portfolio in portfolios:
+		invalidate_portfolio_cache(portfolio)
+		if action.startswith('post_'):
+			touch_portfolio(portfolio.pk)
+	if action.startswith('post_'):
+		CategoryRankingService.refresh([portfolio.pk for portfolio in portfolios])
+
+
+def jury_progress_nominations_changed(instance, action, reverse, pk_set):
+	"""
+	Счетчики панели прогресса жюри сдвигаются только по затронутым проектам и номинациям.
+	Снятие учитывается до удаления связей: в pk_set при remove передаются и не связанные id
+	"""
+	if action == 'post_add':
+		delta = 1
+	elif action in ('pre_remove', 'pre_clear'):
+		delta = -1
+	else:
+		return
+
+	if reverse:
+		portfolios = Portfolio.objects.only('id', 'exhibition_id', 'status')
+		if pk_set is not None:
+			portfolios = portfolios.filter(pk__in=pk_set)
+		if delta < 0:
+			portfolios = portfolios.filter(nominations=instance)
+		for portfolio in portfolios:
+			JuryProgressService.shift_nominations(portfolio, [instance.pk], delta)
+		return
+
+	nomination_ids = pk_set
+	if delta < 0:
+		nominations = instance.nominations.all()
+		if pk_set is not None:
+			nominations = nominations.filter(pk__in=pk_set)
+		nomination_ids = list(nominations.values_list('id', flat=True))
+	JuryProgressService.shift_nominations(instance, nomination_ids, delta)
+
+
+@receiver(post_delete, sender=Portfolio)
+def portfolio_jury_progress_changed(sender, instance, **kwargs):
+	if instance.exhibition_id:
+		JuryProgressService.refresh(instance.exhibition_id)
+
+
+@receiver(m2m_changed, sender=Exhibitions.jury.through)
+@receiver(m2m_changed, sender=Exhibitions.nominations.through)
+def exhibition_jury_progress_changed(sender, instance, action, reverse, pk_set, **kwargs):
+	"""Состав жюри и номинаций выставки - строки и столбцы панели прогресса жюри"""
+	if not action.startswith('post_'):
+		return
+
+	exhibition_ids = (pk_set or ()) if reverse else [instance.pk]
+	for exhibition_id in exhibition_ids:
+		JuryProgressService.refresh(exhibition_id)
 
 
 @receiver([post_save, post_delete], sender=Winners)
 def portfolio_victory_changed(sender, instance, **kwargs):
+	invalidate_exhibition_payload(instance.exhibition_id)
 	invalidate_portfolio_cache(instance.portfolio)
+	touch_portfolio(instance.portfolio_id)
+	CategoryRankingService.refresh([instance.portfolio_id])
+
+
+@receiver(post_save, sender=Exhibitions)
+def exhibition_rankings_changed(sender, instance, created, **kwargs):
+	"""Год и дата окончания выставки входят в рейтинг проектов по категориям"""
+	if not created:
+		CategoryRankingService.refresh_portfolios(Portfolio.objects.filter(exhibition=instance))
+
+
+@receiver(post_save, sender=Exhibitors)
+def exhibitor_rankings_changed(sender, instance, **kwargs):
+	CategoryRanking.objects.filter(owner=instance).update(owner_name=instance.name, owner_slug=instance.slug)
+
+
+@receiver(post_save, sender=Jury)
+def jury_report_changed(sender, instance, **kwargs):
+	"""Имена членов жюри входят в протокол оценок их выставок"""
+	for exhibition_id in instance.jury_for_exh.values_list('id', flat=True):
+		invalidate_jury_report(exhibition_id)
+		# привязка к пользователю определяет, чьи оценки считаются
+		JuryProgressService.refresh(exhibition_id)
+
+
+@receiver(post_delete, sender=ExportJob)
+def export_job_deleted(sender, instance, **kwargs):
+	delete_job_file(instance)
+
+
+@receiver([post_save, post_delete], sender=Exhibitors)
+def exhibitor_search_changed(sender, **kwargs):
+	ExhibitorSearchService.invalidate()
+
+
+@receiver(post_save, sender=User)
+def user_search_name_changed(sender, instance, created, raw=False, update_fields=None, **kwargs):
+	# обновление last_login при входе не затрагивает имя
+	if created or raw or (update_fields and not {'first_name', 'last_name'} & set(update_fields)):
+		return
+
+	ExhibitorSearchService.refresh_for_user(instance)
+
+
+@receiver(post_migrate, dispatch_uid='exhibitor_search_index')
+def exhibitor_search_index(sender, using, **kwargs):
+	"""Триграммный индекс не описывается в модели: он нужен только на PostgreSQL с установленным pg_trgm"""
+	if sender.name == 'exhibition':
+		ExhibitorSearchService.create_trigram_index(using)
+		ExhibitorSearchService.backfill()
+
+
+@receiver([post_save, post_delete], sender=Nominations)
+def nomination_rankings_changed(sender, instance, **kwargs):
+	"""Смена категории номинации переносит ее проекты в другую категорию"""
+	CategoryRankingService.refresh_portfolios(
+		Portfolio.objects.filter(
+			models.Q(nominations=instance) | models.Q(category_rankings__category_id=instance.category_id)
+		).distinct()
+	)
+
+
+@receiver([post_save, pre_delete], sender=Nominations)
+def nomination_payload_changed(sender, instance, **kwargs):
+	"""Название и адрес номинации входят в кэш страниц выставок (до удаления, пока связи с выставками целы)"""
+	for exhibition_id in instance.nominations_for_exh.values_list('id', flat=True):
+		invalidate_exhibition_payload(exhibition_id)
+
+
+@receiver([post_save, post_delete], dispatch_uid='sitemap_sections_changed')
+def sitemap_sections_changed(sender, **kwargs):
+	"""Перегенерация только тех разделов карты сайта, которые зависят от сохраненной модели"""
+	if kwargs.get('raw'):
+		return
+
+	update_google_sitemap(*get_sitemap_sections(sender))
+
+
+@receiver(m2m_changed, dispatch_uid='sitemap_relations_changed')
+def sitemap_relations_changed(sender, action, **kwargs):
+	if action.startswith('post_'):
+		update_google_sitemap(*get_sitemap_sections(sender))
 
 
 @receiver(user_signed_up, dispatch_uid="new_user_notification")
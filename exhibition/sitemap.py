@@ -1,12 +1,24 @@
-from itertools import chain
-
+import gzip
+import logging
+import os
+import threading
+from datetime import datetime, timezone as dt_timezone
+from types import SimpleNamespace
+from urllib.parse import urljoin, urlsplit
+
+from django.conf import settings
 from django.contrib.sitemaps import Sitemap
-from django.db.models import Q, Count
+from django.contrib.sitemaps.views import SitemapIndexItem
+from django.template.loader import render_to_string
 
 from designers.models import Designer
 from exhibition.models import *
 from blog.models import Article
 
+logger = logging.getLogger(__name__)
+
+SITEMAP_INDEX_FILE = 'sitemap.xml'
+
 
 class StaticViewSitemap(Sitemap):
 	priority = 0.5  # Приоритет
@@ -15,7 +27,6 @@ class StaticViewSitemap(Sitemap):
 	def items(self):
 		return [
 			'exhibition:index',
-			'exhibition:contacts-url',
 			'exhibition:exhibitions-list-url',
 			'exhibition:category-list-url',
 			'exhibition:winners-list-url',
@@ -43,7 +54,7 @@ class WinnersSitemap(Sitemap):
 	changefreq = 'daily'
 
 	def items(self):
-		return Winners.objects.all()
+		return Winners.objects.select_related('exhibition', 'nomination')
 
 
 class EventsSitemap(Sitemap):
@@ -51,7 +62,7 @@ class EventsSitemap(Sitemap):
 	changefreq = 'weekly'
 
 	def items(self):
-		return Events.objects.all()
+		return Events.objects.select_related('exhibition')
 
 
 class CategoriesSitemap(Sitemap):
@@ -67,7 +78,10 @@ class PortfolioSitemap(Sitemap):
 	changefreq = 'daily'
 
 	def items(self):
-		return Portfolio.objects.all()
+		return Portfolio.objects.filter(status=True, project_id__isnull=False).select_related('owner').order_by('id')
+
+	def lastmod(self, item):
+		return item.updated_at
 
 
 class ExhibitorsSitemap(Sitemap):
@@ -101,6 +115,9 @@ class ArticleSitemap(Sitemap):
 	def items(self):
 		return Article.objects.all()
 
+	def lastmod(self, item):
+		return item.modified_date
+
 
 class DesignersSitemap(Sitemap):
 	priority = 1
@@ -126,24 +143,25 @@ class DesignersPortfolioSitemap(Sitemap):
 	changefreq = 'weekly'
 
 	def items(self):
-		portfolios = (
-			Designer.objects
-			.filter(status=2)
-			.prefetch_related('exh_portfolio', 'add_portfolio')
-			.annotate(
-				exh_portfolio_count=Count('exh_portfolio', filter=Q(exh_portfolio__status=True)),
-				add_portfolio_count=Count('add_portfolio', filter=Q(add_portfolio__status=True)),
-			)
-			.filter(
-				Q(exh_portfolio_count__gt=0) | Q(add_portfolio_count__gt=0)
+		"""Опубликованные проекты всех дизайнеров: по одному запросу на связь exh_portfolio и add_portfolio"""
+		items = set()
+		for through in (Designer.exh_portfolio.through, Designer.add_portfolio.through):
+			items.update(
+				through.objects.filter(
+					designer__status=2, portfolio__status=True, portfolio__project_id__isnull=False
+				).values_list(
+					'designer__slug', 'portfolio__project_id', 'portfolio__updated_at'
+				)
 			)
-		)
 
-		return [(d, p) for d in portfolios for p in (d.exh_portfolio.all() | d.add_portfolio.all())]
+		return sorted(items, key=lambda item: (item[0], item[1]))
 
 	def location(self, item):
-		designer, portfolio = item
-		return reverse('designers:portfolio-detail-page-url', args=[designer.slug, portfolio.project_id])
+		slug, project_id, updated_at = item
+		return reverse('designers:portfolio-detail-page-url', args=[slug, project_id])
+
+	def lastmod(self, item):
+		return item[2]
 
 
 sitemaps = {
@@ -161,3 +179,144 @@ sitemaps = {
 	'designer_portfolio': DesignerPortfolioSitemap,
 	'portfolios': DesignersPortfolioSitemap,
 }
+
+# Разделы карты сайта, которые зависят от модели (или промежуточной таблицы m2m)
+SECTIONS_BY_MODEL = {
+	'exhibition.exhibitions': ('exhibitions',),
+	'exhibition.winners': ('winners',),
+	'exhibition.nominations': ('winners',),
+	'exhibition.events': ('events',),
+	'exhibition.categories': ('categories',),
+	'exhibition.portfolio': ('portfolio', 'portfolios'),
+	'exhibition.exhibitors': ('exhibitors', 'portfolio'),
+	'exhibition.jury': ('jury',),
+	'exhibition.partners': ('partners',),
+	'blog.article': ('article',),
+	'designers.designer': ('designers', 'designer_portfolio', 'portfolios'),
+	'designers.designer_exh_portfolio': ('portfolios',),
+	'designers.designer_add_portfolio': ('portfolios',),
+}
+
+
+def get_sitemap_sections(model):
+	return SECTIONS_BY_MODEL.get(model._meta.label_lower, ())
+
+
+def get_sitemap_path(filename):
+	return os.path.join(settings.SITEMAP_ROOT, filename)
+
+
+def get_sitemap_url(filename):
+	return urljoin(settings.DOMAIN_URL, settings.SITEMAP_URL + filename)
+
+
+def write_sitemap_file(filename, content):
+	"""Атомарная запись файла карты сайта. Неизмененный файл не перезаписывается и сохраняет дату"""
+	file_path = get_sitemap_path(filename)
+
+	try:
+		with open(file_path, 'rb') as fh:
+			if fh.read() == content:
+				return False
+	except FileNotFoundError:
+		pass
+
+	tmp_path = f'{file_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+	with open(tmp_path, 'wb') as fh:
+		fh.write(content)
+	os.replace(tmp_path, file_path)
+
+	return True
+
+
+def get_section_filename(section, page=1):
+	return f'{section}.xml.gz' if page == 1 else f'{section}-{page}.xml.gz'
+
+
+def write_sitemap_section(section):
+	"""Рендер раздела в gzip-файлы по страницам (до 50 000 ссылок на страницу)"""
+	sitemap = sitemaps[section]()
+	domain_url = urlsplit(settings.DOMAIN_URL)
+	site = SimpleNamespace(domain=domain_url.netloc)
+
+	changed = False
+	page_range = sitemap.paginator.page_range
+	for page in page_range:
+		urls = sitemap.get_urls(page=page, site=site, protocol=domain_url.scheme)
+		xml = render_to_string('sitemap.xml', {'urlset': urls})
+		# mtime=0 делает архив детерминированным, чтобы не перезаписывать неизмененные разделы
+		changed |= write_sitemap_file(get_section_filename(section, page), gzip.compress(xml.encode(), mtime=0))
+
+	# лишние страницы после уменьшения раздела
+	page = page_range[-1] + 1
+	while os.path.exists(get_sitemap_path(get_section_filename(section, page))):
+		os.remove(get_sitemap_path(get_section_filename(section, page)))
+		changed = True
+		page += 1
+
+	return changed
+
+
+def write_sitemap_index():
+	"""Индекс карты сайта, lastmod раздела - время последнего изменения его файла"""
+	items = []
+	for section in sitemaps:
+		page = 1
+		while os.path.exists(get_sitemap_path(get_section_filename(section, page))):
+			filename = get_section_filename(section, page)
+			last_mod = datetime.fromtimestamp(os.path.getmtime(get_sitemap_path(filename)), tz=dt_timezone.utc)
+			items.append(SitemapIndexItem(get_sitemap_url(filename), last_mod))
+			page += 1
+
+	xml = render_to_string('sitemap_index.xml', {'sitemaps': items})
+	return write_sitemap_file(SITEMAP_INDEX_FILE, xml.encode())
+
+
+def write_sitemaps(sections=None):
+	"""Перегенерация переданных разделов (по умолчанию всех) и индекса, если что-то изменилось"""
+	os.makedirs(settings.SITEMAP_ROOT, exist_ok=True)
+
+	changed = False
+	for section in sections or sitemaps:
+		if section in sitemaps:
+			changed |= write_sitemap_section(section)
+
+	if changed or not os.path.exists(get_sitemap_path(SITEMAP_INDEX_FILE)):
+		write_sitemap_index()
+
+	return changed
+
+
+_pending_sections = set()
+_pending_lock = threading.Lock()
+_writer_running = False
+
+
+def schedule_sitemaps_update(sections):
+	"""Фоновая перегенерация: изменения, пришедшие во время записи, собираются в следующий проход"""
+	global _writer_running
+
+	with _pending_lock:
+		_pending_sections.update(sections)
+		if _writer_running:
+			return
+		_writer_running = True
+
+	threading.Thread(target=_write_pending_sitemaps, daemon=True).start()
+
+
+def _write_pending_sitemaps():
+	global _writer_running
+
+	while True:
+		with _pending_lock:
+			sections = set(_pending_sections)
+			_pending_sections.clear()
+			if not sections:
+				_writer_running = False
+				return
+
+		try:
+			write_sitemaps(sections)
+		except Exception as e:
+			logger.error(f"Error writing sitemap sections {sorted(sections)}: {e}")
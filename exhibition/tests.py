@@ -1,3 +1,1594 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import tempfile
+import threading
+from collections import defaultdict
+from datetime import timedelta, time
+from io import BytesIO, StringIO
+from unittest import SkipTest, mock
+
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import NoReverseMatch, reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from openpyxl import load_workbook
+from PIL import Image as PILImage
+from watson import search as watson
+from watson.models import SearchEntry
+
+from blog.models import Article
+from crm.testing import QueryBudgetTestMixin
+from rating import api as rating_api, views as rating_views
+from rating.models import Rating, Reviews
+from rating.services import RatingService
+from . import api, views
+from .exports import ExportExhibitionAdmin
+from .templatetags.custom_tags import UrlCache
+from .utils import get_persons_for_users
+from .cache import get_exhibition_payload_key, get_jury_progress_version
+from .jobs import run_export_job, cleanup_export_jobs
+from .logic import build_cover_thumbs, optimize_images_batch_async, update_cover_thumbs, update_cover_thumbs_async
+from .models import (
+	Exhibitions, Exhibitors, Jury, Partners, Events, Categories, Nominations, Portfolio, Winners, ExportJob,
+	CategoryRanking, Image,
+)
+from .search import apply_index_updates
+from .sitemap import (
+	SECTIONS_BY_MODEL, SITEMAP_INDEX_FILE, PortfolioSitemap, get_sitemap_path, sitemaps, write_sitemaps,
+)
+from .services import (
+	WinnersService, ExhibitorSearchService, SiteSearchService, JuryReportService, JuryProgressService,
+)
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+# фоновая запись карты сайта не должна писать в MEDIA_ROOT и занимать тестовую БД из другого потока
+SITEMAP_SETTINGS = override_settings(SITEMAP_AUTO_UPDATE=False)
+
+
+def setUpModule():
+	SITEMAP_SETTINGS.enable()
+
+
+def tearDownModule():
+	SITEMAP_SETTINGS.disable()
+
+
+def get_test_image(name, color='red'):
+	"""Небольшой JPEG для загрузки в поля изображений"""
+	buffer = BytesIO()
+	PILImage.new('RGB', (40, 30), color).save(buffer, 'JPEG')
+	return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+def sync_cover_thumbs():
+	"""Миниатюры обложки строятся сразу, а не в фоновом потоке"""
+	return mock.patch(
+		'exhibition.models.update_cover_thumbs_async',
+		side_effect=lambda portfolio: update_cover_thumbs(portfolio.pk, portfolio.project_cover),
+	)
+
+
+def legacy_winners_preview(exhibition):
+	"""Прежний расчет превью: статистика оценок по каждому портфолио отдельно"""
+	nomination_portfolios = defaultdict(list)
+
+	portfolios = exhibition.portfolio_set.filter(status=True).prefetch_related('nominations').select_related('owner')
+	for portfolio in portfolios:
+		stats = portfolio.get_rating_stats()
+		for nomination in portfolio.nominations.all():
+			nomination_portfolios[nomination.id].append((portfolio, stats))
+
+	items = []
+	for nomination in exhibition.nominations.all():
+		entries = nomination_portfolios.get(nomination.id, [])
+		if not entries:
+			items.append({'nomination_id': nomination.id, 'no_participants': True})
+			continue
+
+		if not all(stats['jury_count'] > 0 for _, stats in entries):
+			items.append({'nomination_id': nomination.id, 'incomplete': True})
+			continue
+
+		scored = [
+			(portfolio.id, portfolio.owner.id, stats['jury_average'], stats['jury_count'])
+			for portfolio, stats in entries if stats['jury_average'] > 0
+		]
+		if not scored:
+			items.append({'nomination_id': nomination.id, 'no_qualified_votes': True})
+			continue
+
+		max_avg = max(avg for _, _, avg, _ in scored)
+		items.append({
+			'nomination_id': nomination.id,
+			'winners': sorted(s for s in scored if s[2] == max_avg),
+		})
+
+	return items
+
+
+def normalize_preview(preview):
+	items = []
+	for item in preview['items']:
+		entry = {'nomination_id': item['nomination_id']}
+		for flag in ('no_participants', 'incomplete', 'no_qualified_votes'):
+			if item.get(flag):
+				entry[flag] = True
+		if item['winners']:
+			entry['winners'] = sorted(
+				(w['portfolio_id'], w['exhibitor_id'], w['avg'], w['votes']) for w in item['winners']
+			)
+		items.append(entry)
+
+	return items
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class WinnersPreviewTests(TestCase):
+	PORTFOLIOS = 400
+	NOMINATIONS = 8
+
+	@classmethod
+	def setUpTestData(cls):
+		now = timezone.now()
+		cls.exhibition = Exhibitions.objects.create(
+			title='Выставка', slug='2030', date_start=now - timedelta(days=30), date_end=now - timedelta(days=20)
+		)
+		category = Categories.objects.create(title='Категория', slug='category')
+
+		nominations = [
+			Nominations.objects.create(title=f'Номинация {i}', slug=f'nomination-{i}', category=category)
+			for i in range(cls.NOMINATIONS + 1)
+		]
+		# последняя номинация не участвует в выставке
+		cls.exhibition.nominations.set(nominations[:-1])
+
+		owners = []
+		for i in range(20):
+			owner = Exhibitors(name=f'Участник {i}', slug=f'exhibitor-{i}', email=f'user{i}@example.com')
+			owner.save()
+			owners.append(owner)
+
+		portfolios = Portfolio.objects.bulk_create([
+			Portfolio(
+				owner=owners[i % len(owners)],
+				exhibition=cls.exhibition,
+				project_id=i // len(owners) + 1,
+				title=f'Проект {i}',
+				order=i % 7,
+				status=i % 50 != 0,
+			)
+			for i in range(cls.PORTFOLIOS)
+		])
+
+		links = []
+		for i, portfolio in enumerate(portfolios):
+			links.append(Portfolio.nominations.through(portfolio=portfolio, nominations=nominations[i % cls.NOMINATIONS]))
+			if i % 9 == 0:
+				links.append(Portfolio.nominations.through(portfolio=portfolio, nominations=nominations[-1]))
+			if i % 11 == 0:
+				links.append(Portfolio.nominations.through(
+					portfolio=portfolio, nominations=nominations[(i + 3) % cls.NOMINATIONS]
+				))
+		Portfolio.nominations.through.objects.bulk_create(links)
+
+		jury = [User.objects.create_user(f'jury{i}') for i in range(5)]
+		public = [User.objects.create_user(f'visitor{i}') for i in range(3)]
+
+		ratings = []
+		for i, portfolio in enumerate(portfolios):
+			nomination = i % cls.NOMINATIONS
+			# номинация 0 - не все проекты оценены жюри, номинация 1 - ничья по средней оценке
+			if nomination == 0 and i % 3 == 0:
+				continue
+			for j, user in enumerate(jury):
+				star = 5 if nomination == 1 and i < 2 * cls.NOMINATIONS else (i * 7 + j * 3) % 5 + 1
+				if nomination == 1 and i >= 2 * cls.NOMINATIONS:
+					star = min(star, 4)
+				ratings.append(Rating(user=user, portfolio=portfolio, star=star, is_jury_rating=True, ip='127.0.0.1'))
+			for j, user in enumerate(public):
+				ratings.append(Rating(user=user, portfolio=portfolio, star=5, ip='127.0.0.1'))
+		Rating.objects.bulk_create(ratings)
+
+		cls.empty_nomination = Nominations.objects.create(title='Пустая', slug='empty', category=category)
+		cls.exhibition.nominations.add(cls.empty_nomination)
+
+	def test_preview_matches_per_portfolio_calculation(self):
+		preview = WinnersService.build_winners_preview(self.exhibition)
+
+		self.assertEqual(normalize_preview(preview), legacy_winners_preview(self.exhibition))
+
+	def test_preview_query_count_does_not_depend_on_portfolios(self):
+		# один сгруппированный запрос оценок и один запрос номинаций
+		with self.assertNumQueries(2):
+			WinnersService.build_winners_preview(self.exhibition)
+
+	def test_preview_outcomes(self):
+		preview = WinnersService.build_winners_preview(self.exhibition)
+		items = {item['nomination_id']: item for item in preview['items']}
+		nominations = list(self.exhibition.nominations.exclude(pk=self.empty_nomination.pk).order_by('slug'))
+
+		self.assertTrue(items[self.empty_nomination.id]['no_participants'])
+		self.assertTrue(items[nominations[0].id]['incomplete'])
+
+		tie = items[nominations[1].id]
+		self.assertEqual(len(tie['winners']), 2)
+		self.assertIn(tie, preview['conflicts'])
+		self.assertTrue(all(w['avg'] == 5 for w in tie['winners']))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+	PERSONS = 6
+
+	@classmethod
+	def setUpTestData(cls):
+		now = timezone.now()
+		exhibitions = [
+			Exhibitions.objects.create(
+				title=f'Выставка {i}', slug=str(2030 + i),
+				date_start=now - timedelta(days=300 - i * 100), date_end=now - timedelta(days=290 - i * 100)
+			)
+			for i in range(2)
+		]
+		categories = [Categories.objects.create(title=f'Категория {i}', slug=f'category-{i}') for i in range(2)]
+		nominations = [
+			Nominations.objects.create(title=f'Номинация {i}', slug=f'nomination-{i}', category=categories[i % 2])
+			for i in range(4)
+		]
+		visitors = [User.objects.create_user(f'visitor{i}') for i in range(3)]
+
+		for exhibition in exhibitions:
+			exhibition.nominations.set(nominations)
+
+		for i in range(cls.PERSONS):
+			owner = Exhibitors(name=f'Участник {i}', slug=f'exhibitor-{i}', email=f'user{i}@example.com')
+			owner.save()
+			jury = Jury(name=f'Жюри {i}', slug=f'jury-{i}')
+			jury.save()
+			partner = Partners(name=f'Партнер {i}', slug=f'partner-{i}')
+			partner.save()
+
+			for exhibition in exhibitions:
+				exhibition.exhibitors.add(owner)
+				exhibition.jury.add(jury)
+				exhibition.partners.add(partner)
+				Events.objects.create(
+					exhibition=exhibition, title=f'Мероприятие {i}', date_event=exhibition.date_start,
+					time_start=time(10), time_end=time(11), hoster='Участник', lector='Ведущий'
+				)
+
+				for k in range(2):
+					portfolio = Portfolio.objects.create(owner=owner, exhibition=exhibition, title=f'Проект {i}-{k}')
+					portfolio.nominations.add(nominations[(i + k) % len(nominations)])
+					Rating.objects.bulk_create([
+						Rating(user=user, portfolio=portfolio, star=(i + k) % 5 + 1, ip='127.0.0.1') for user in visitors
+					])
+					Reviews.objects.create(user=visitors[0], portfolio=portfolio, message='Отзыв')
+
+			Article.objects.create(title=f'Статья {i}', owner=owner.user)
+
+		cls.exhibition = exhibitions[0]
+		cls.portfolio = Portfolio.objects.filter(exhibition=cls.exhibition).select_related('owner').first()
+		Winners.objects.create(
+			exhibition=cls.exhibition, nomination=cls.portfolio.nominations.first(),
+			exhibitor=cls.portfolio.owner, portfolio=cls.portfolio
+		)
+		cls.staff = User.objects.create_user('staff', is_staff=True, is_superuser=True)
+
+	def setUp(self):
+		cache.clear()
+		# контекстный процессор шаблонов ожидает заголовок User-Agent
+		self.client = self.client_class(HTTP_USER_AGENT='Mozilla/5.0')
+		# собранной статики (css/js *.min) в репозитории нет, {% md5url %} не должен читать файлы
+		patcher = mock.patch.object(UrlCache, 'get_md5', side_effect=lambda file: settings.STATIC_URL + file)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def test_public_views_within_budget(self):
+		article = Article.objects.first()
+		views = [
+			('exhibition:index', {}),
+			('exhibition:exhibitions-list-url', {}),
+			('exhibition:exhibition-detail-url', {'exh_year': self.exhibition.slug}),
+			('exhibition:winner-detail-url', {'exh_year': self.exhibition.slug, 'slug': 'nomination-0'}),
+			('exhibition:category-list-url', {}),
+			('exhibition:projects-list-url', {'slug': 'category-0'}),
+			('exhibition:projects-list-by-year-url', {'exh_year': self.exhibition.slug}),
+			('exhibition:project-detail-url', {'owner': self.portfolio.owner.slug, 'project_id': self.portfolio.project_id}),
+			('exhibition:exhibitors-list-all', {}),
+			('exhibition:exhibitor-detail-url', {'slug': 'exhibitor-0'}),
+			('exhibition:jury-list-all', {}),
+			('exhibition:jury-detail-url', {'slug': 'jury-0'}),
+			('exhibition:partners-list-all', {}),
+			('exhibition:partner-detail-url', {'slug': 'partner-0'}),
+			('exhibition:winners-list-all', {}),
+			('exhibition:events-list-all', {}),
+			('blog:article-list-url', {}),
+			('blog:article-detail-url', {'pk': article.pk}),
+		]
+		for view_name, kwargs in views:
+			with self.subTest(view_name):
+				cache.clear()
+				self.get_within_budget(view_name, kwargs=kwargs)
+
+	def test_admin_changelists_within_budget(self):
+		self.client.force_login(self.staff)
+		for model in ('exhibition_portfolio', 'exhibition_exhibitors', 'exhibition_jury', 'exhibition_partners',
+		              'exhibition_winners', 'rating_rating', 'rating_reviews'):
+			with self.subTest(model):
+				self.get_within_budget(f'admin:{model}_changelist')
+
+	def test_budget_violation_fails(self):
+		response = self.client.get(reverse('exhibition:exhibitions-list-url'))
+		with self.assertRaises(AssertionError):
+			self.assertQueryBudget(response, budget=0)
+
+	@override_settings(QUERY_COUNT_HEADER=True)
+	def test_query_count_header_for_staff_only(self):
+		url = reverse('exhibition:exhibitions-list-url')
+
+		response = self.client.get(url)
+		self.assertNotIn('X-Query-Count', response)
+		self.assertNotIn('Server-Timing', response)
+
+		self.client.force_login(self.staff)
+		response = self.client.get(url)
+		self.assertEqual(response['X-Query-Count'], str(response.query_stats.count))
+		self.assertTrue(response['Server-Timing'].startswith('db;dur='))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PersonsLookupTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.users = [User.objects.create_user(f'persons-user{i}') for i in range(4)]
+		# несколько профилей у пользователя: берется первый по порядку моделей
+		cls.exhibitor = Exhibitors(user=cls.users[0], name='Участник', slug='persons-exhibitor')
+		cls.exhibitor.save()
+		Jury(user=cls.users[0], name='Жюри-участник', slug='persons-jury-0').save()
+		cls.partner = Partners(user=cls.users[1], name='Партнер', slug='persons-partner')
+		cls.partner.save()
+		Jury(user=cls.users[1], name='Жюри-партнер', slug='persons-jury-1').save()
+		cls.jury = Jury(user=cls.users[2], name='Жюри', slug='persons-jury-2')
+		cls.jury.save()
+
+	def test_batched_lookup(self):
+		user_ids = [user.pk for user in self.users] + [None]
+		with self.assertNumQueries(3):
+			persons = get_persons_for_users(user_ids)
+
+		self.assertEqual(persons, {
+			self.users[0].pk: self.exhibitor,
+			self.users[1].pk: self.partner,
+			self.users[2].pk: self.jury,
+		})
+
+		# профили найдены в первых моделях - до остальных запросов не доходит
+		with self.assertNumQueries(1):
+			self.assertEqual(get_persons_for_users([self.users[0].pk]), {self.users[0].pk: self.exhibitor})
+		self.assertEqual(get_persons_for_users([self.users[2].pk, self.users[3].pk], (Exhibitors, Partners)), {})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ConditionalGetTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		now = timezone.now()
+		exhibition = Exhibitions.objects.create(
+			title='Выставка', slug='2048', date_start=now - timedelta(days=30), date_end=now - timedelta(days=20)
+		)
+		category = Categories.objects.create(title='Категория', slug='etag-category')
+		cls.nomination = Nominations.objects.create(title='Номинация', slug='etag-nomination', category=category)
+		cls.owner = Exhibitors(name='Участник', slug='etag-owner', email='etag-owner@example.com')
+		cls.owner.save()
+		cls.portfolio = Portfolio(owner=cls.owner, exhibition=exhibition, title='Проект')
+		cls.portfolio.save()
+		cls.portfolio.nominations.add(cls.nomination)
+		cls.visitor = User.objects.create_user('etag-visitor')
+
+	def setUp(self):
+		cache.clear()
+		patcher = mock.patch.object(UrlCache, 'get_md5', side_effect=lambda file: settings.STATIC_URL + file)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.url = reverse('exhibition:project-detail-url', args=[self.owner.slug, self.portfolio.project_id])
+
+	def get(self, **extra):
+		return self.client.get(self.url, HTTP_USER_AGENT='Mozilla/5.0', **extra)
+
+	def assertETagChanged(self, etag):
+		response = self.get(HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 200)
+		self.assertNotEqual(response['ETag'], etag)
+		return response['ETag']
+
+	def test_not_modified_round_trip(self):
+		response = self.get()
+		self.assertEqual(response.status_code, 200)
+		self.assertIn('private', response['Cache-Control'])
+		etag = response['ETag']
+
+		response = self.get(HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 304)
+		self.assertEqual(response['ETag'], etag)
+		self.assertEqual(response.content, b'')
+
+	def test_etag_follows_portfolio_changes(self):
+		etag = self.get()['ETag']
+
+		Rating.objects.create(user=self.visitor, portfolio=self.portfolio, star=4, ip='127.0.0.1')
+		etag = self.assertETagChanged(etag)
+
+		Reviews.objects.create(user=self.visitor, portfolio=self.portfolio, message='Отзыв')
+		etag = self.assertETagChanged(etag)
+
+		with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root), \
+				mock.patch.object(Image, 'IMAGE_OPTIMIZE_ASYNC', False), sync_cover_thumbs():
+			image = Image(portfolio=self.portfolio, file=get_test_image('etag.jpg'))
+			image.save()
+			etag = self.assertETagChanged(etag)
+			image.delete()
+			etag = self.assertETagChanged(etag)
+
+		Winners.objects.create(
+			exhibition=self.portfolio.exhibition, nomination=self.nomination, exhibitor=self.owner, portfolio=self.portfolio
+		)
+		self.assertETagChanged(etag)
+
+	def test_deletions_are_not_hidden_by_if_modified_since(self):
+		response = self.get()
+		self.assertNotIn('Last-Modified', response)
+		self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=http_date((timezone.now() + timedelta(hours=1)).timestamp())).status_code, 200)
+
+		# удаление проекта не двигает вперед время изменения списка, но меняет ETag
+		extra = Portfolio(owner=self.owner, exhibition=self.portfolio.exhibition, title='Удаляемый проект')
+		extra.save()
+		url = reverse('exhibition:exhibitor-detail-url', args=[self.owner.slug])
+		etag = self.client.get(url, {'page': 1}, HTTP_USER_AGENT='Mozilla/5.0')['ETag']
+		extra.delete()
+		response = self.client.get(url, {'page': 1}, HTTP_USER_AGENT='Mozilla/5.0', HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 200)
+		self.assertNotIn('Last-Modified', response)
+
+	def test_etag_depends_on_user(self):
+		anonymous = self.get()['ETag']
+		self.client.force_login(self.visitor)
+		response = self.get(HTTP_IF_NONE_MATCH=anonymous)
+		self.assertEqual(response.status_code, 200)
+		self.assertNotEqual(response['ETag'], anonymous)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PortfolioCoverTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		owner = Exhibitors(name='Участник', slug='cover-owner', email='cover-owner@example.com')
+		owner.save()
+		cls.portfolio = Portfolio(owner=owner, title='Проект')
+		cls.portfolio.save()
+
+	def setUp(self):
+		media_root = tempfile.TemporaryDirectory()
+		self.addCleanup(media_root.cleanup)
+		media_settings = override_settings(MEDIA_ROOT=media_root.name)
+		media_settings.enable()
+		self.addCleanup(media_settings.disable)
+		for patcher in (mock.patch.object(Image, 'IMAGE_OPTIMIZE_ASYNC', False), sync_cover_thumbs()):
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	def add_image(self, name):
+		image = Image(portfolio=self.portfolio, file=get_test_image(name))
+		image.save()
+		return image
+
+	def get_portfolio(self):
+		return Portfolio.objects.get(pk=self.portfolio.pk)
+
+	def test_cover_follows_images(self):
+		first = self.add_image('first.jpg')
+		second = self.add_image('second.jpg')
+
+		portfolio = self.get_portfolio()
+		self.assertEqual(portfolio.project_cover, first.file.name)
+		self.assertEqual(portfolio.cover_thumbs, build_cover_thumbs(first.file.name))
+		# обложка из сохраненного поля - тот же файл поля, что и у фото, без запроса
+		with self.assertNumQueries(0):
+			cover = portfolio.get_cover
+		self.assertEqual((cover.name, cover.url), (first.file.name, first.file.url))
+		self.assertEqual(CategoryRanking.objects.filter(portfolio=portfolio).count(), 0)
+
+		first.delete()
+		portfolio = self.get_portfolio()
+		self.assertEqual(portfolio.project_cover, second.file.name)
+		self.assertEqual(portfolio.cover_thumbs, build_cover_thumbs(second.file.name))
+
+		second.delete()
+		portfolio = self.get_portfolio()
+		self.assertEqual((portfolio.project_cover, portfolio.cover_thumbs), ('', {}))
+		self.assertIsNone(portfolio.get_cover)
+
+	def test_batch_upload(self):
+		files = [get_test_image(f'batch-{i}.jpg', color) for i, color in enumerate(('red', 'green', 'blue'))]
+
+		with mock.patch.object(Portfolio, 'refresh_cover', autospec=True, side_effect=Portfolio.refresh_cover) as refresh, \
+				CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+			self.portfolio.save(images=files)
+			# фото добавляются только после фиксации транзакции
+			self.assertFalse(Image.objects.filter(portfolio=self.portfolio).exists())
+
+		# фото вставляются одним запросом, обложка пересчитывается один раз
+		inserts = [query for query in queries if query['sql'].startswith(f'INSERT INTO "{Image._meta.db_table}"')]
+		self.assertEqual(len(inserts), 1)
+		self.assertEqual(refresh.call_count, 1)
+
+		images = list(Image.objects.filter(portfolio=self.portfolio).order_by('sort'))
+		self.assertEqual([image.sort for image in images], [1, 2, 3])
+		self.assertTrue(all(image.file.name.endswith('.webp') for image in images))
+		portfolio = self.get_portfolio()
+		self.assertEqual(portfolio.project_cover, images[0].file.name)
+		self.assertEqual(portfolio.cover_thumbs, build_cover_thumbs(images[0].file.name))
+
+		# следующий пакет продолжает сортировку и не меняет обложку;
+		# если оптимизация заменила файлы, обложка обновляется только в on_complete
+		with mock.patch.object(Portfolio, 'refresh_cover', autospec=True, side_effect=Portfolio.refresh_cover) as refresh, \
+				mock.patch('exhibition.logic.optimize_image_fields', return_value=True), \
+				self.captureOnCommitCallbacks(execute=True):
+			self.portfolio.save(images=[get_test_image('batch-3.jpg')])
+		self.assertEqual(refresh.call_count, 1)
+		self.assertEqual(list(Image.objects.filter(portfolio=self.portfolio).values_list('sort', flat=True)), [1, 2, 3, 4])
+		self.assertEqual(self.get_portfolio().project_cover, images[0].file.name)
+
+	def test_background_optimization_waits_for_commit(self):
+		image = self.add_image('cover.jpg')
+		with mock.patch('exhibition.logic.Thread') as thread, self.captureOnCommitCallbacks(execute=True) as callbacks:
+			optimize_images_batch_async(Image, [image.pk], Image.IMAGE_FIELDS)
+			thread.assert_not_called()
+
+		self.assertEqual(len(callbacks), 1)
+		thread.return_value.start.assert_called_once_with()
+
+	def test_thumbs_thread_waits_for_commit(self):
+		with mock.patch('exhibition.logic.Thread') as thread, self.captureOnCommitCallbacks(execute=True):
+			update_cover_thumbs_async(self.get_portfolio())
+			thread.return_value.start.assert_not_called()
+
+		thread.return_value.start.assert_called_once_with()
+
+	def test_stale_thumbs_are_not_saved(self):
+		image = self.add_image('cover.jpg')
+		thumbs = self.get_portfolio().cover_thumbs
+		Portfolio.objects.filter(pk=self.portfolio.pk).update(project_cover='uploads/other.jpg', cover_thumbs={})
+
+		# миниатюры сменившейся обложки не записываются
+		self.assertFalse(update_cover_thumbs(self.portfolio.pk, image.file.name))
+		self.assertEqual(self.get_portfolio().cover_thumbs, {})
+		self.assertTrue(thumbs)
+
+	def test_refresh_command(self):
+		image = self.add_image('cover.jpg')
+		Portfolio.objects.filter(pk=self.portfolio.pk).update(project_cover='', cover_thumbs={})
+
+		out = StringIO()
+		call_command('refresh_portfolio_covers', stdout=out)
+		self.assertIn('Covers refreshed: 1, thumbnail manifests built: 1', out.getvalue())
+		portfolio = self.get_portfolio()
+		self.assertEqual(portfolio.project_cover, image.file.name)
+		self.assertTrue(portfolio.cover_thumbs)
+
+		out = StringIO()
+		call_command('refresh_portfolio_covers', stdout=out)
+		self.assertIn('Covers refreshed: 0, thumbnail manifests built: 0', out.getvalue())
+		call_command('refresh_portfolio_covers', '--force', stdout=out)
+		self.assertIn('thumbnail manifests built: 1', out.getvalue())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CategoryRankingTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		now = timezone.now()
+		cls.exhibitions = [
+			Exhibitions.objects.create(
+				title=f'Выставка {i}', slug=str(2045 + i),
+				date_start=now - timedelta(days=300 - i * 100), date_end=now - timedelta(days=290 - i * 100)
+			)
+			for i in range(2)
+		]
+		cls.categories = [Categories.objects.create(title=f'Категория {i}', slug=f'ranking-category-{i}') for i in range(2)]
+		cls.nominations = [
+			Nominations.objects.create(title=f'Номинация {i}', slug=f'ranking-nomination-{i}', category=cls.categories[i % 2])
+			for i in range(3)
+		]
+		owner = Exhibitors(name='Участник', slug='ranking-owner', email='ranking-owner@example.com')
+		owner.save()
+		cls.visitors = [User.objects.create_user(f'ranking-visitor{i}') for i in range(2)]
+
+		cls.portfolios = []
+		for i in range(4):
+			portfolio = Portfolio(owner=owner, exhibition=cls.exhibitions[i % 2], title=f'Проект {i}')
+			portfolio.save()
+			portfolio.nominations.add(cls.nominations[i % 3])
+			for k, visitor in enumerate(cls.visitors):
+				Rating.objects.create(user=visitor, portfolio=portfolio, star=(i + k) % 5 + 1, ip='127.0.0.1')
+			cls.portfolios.append(portfolio)
+
+	@staticmethod
+	def compute_rankings():
+		"""Рейтинг по категориям заново, без CategoryRankingService: проект x категория его номинаций"""
+		rows = set()
+		for portfolio in Portfolio.objects.filter(exhibition__isnull=False, project_id__isnull=False):
+			stars = [rating.star for rating in portfolio.ratings.all()]
+			for nomination in portfolio.nominations.filter(category__isnull=False):
+				wins = Winners.objects.filter(
+					portfolio=portfolio, nomination__category=nomination.category_id
+				).order_by('-exhibition')
+				rows.add((
+					nomination.category_id, portfolio.pk, portfolio.exhibition.slug,
+					wins[0].exhibition.slug if wins else '',
+					round(sum(stars) / len(stars), 6) if stars else 0, portfolio.status,
+				))
+		return rows
+
+	def assertRankingsConsistent(self):
+		rows = {
+			(category_id, portfolio_id, exh_year, win_year, round(average, 6), status)
+			for category_id, portfolio_id, exh_year, win_year, average, status in CategoryRanking.objects.values_list(
+				'category_id', 'portfolio_id', 'last_exh_year', 'win_year', 'average', 'status'
+			)
+		}
+		self.assertEqual(rows, self.compute_rankings())
+
+	def test_rankings_follow_changes(self):
+		self.assertRankingsConsistent()
+		portfolio = self.portfolios[0]
+
+		with self.subTest('visibility'):
+			portfolio.status = False
+			portfolio.save()
+			self.assertRankingsConsistent()
+
+		with self.subTest('win added'):
+			winner = Winners.objects.create(
+				exhibition=portfolio.exhibition, nomination=self.nominations[0],
+				exhibitor=portfolio.owner, portfolio=portfolio
+			)
+			self.assertRankingsConsistent()
+
+		with self.subTest('win removed'):
+			winner.delete()
+			self.assertRankingsConsistent()
+
+		with self.subTest('nomination moved to another category'):
+			nomination = self.nominations[2]
+			nomination.category = self.categories[1]
+			nomination.save()
+			self.assertRankingsConsistent()
+
+		with self.subTest('portfolio nominations changed'):
+			self.portfolios[1].nominations.set([self.nominations[0], self.nominations[1]])
+			self.assertRankingsConsistent()
+
+		with self.subTest('rating deleted'):
+			Rating.objects.filter(portfolio=self.portfolios[1], user=self.visitors[0]).delete()
+			self.assertRankingsConsistent()
+
+		with self.subTest('ratings and exhibition year changed'):
+			self.portfolios[3].ratings.all().delete()
+			exhibition = self.exhibitions[1]
+			exhibition.slug = '2050'
+			exhibition.save()
+			self.assertRankingsConsistent()
+
+		# команда пересчета с нуля дает те же строки
+		CategoryRanking.objects.all().delete()
+		call_command('rebuild_category_rankings', stdout=StringIO())
+		self.assertRankingsConsistent()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CursorPaginationTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		now = timezone.now()
+		exhibitions = [
+			Exhibitions.objects.create(
+				title=f'Выставка {i}', slug=str(2040 + i),
+				date_start=now - timedelta(days=300 - i * 100), date_end=now - timedelta(days=290 - i * 100)
+			)
+			for i in range(2)
+		]
+		category = Categories.objects.create(title='Категория', slug='paging-category')
+		nomination = Nominations.objects.create(title='Номинация', slug='paging-nomination', category=category)
+		cls.owner = Exhibitors(name='Участник', slug='paging-owner', email='paging-owner@example.com')
+		cls.owner.save()
+		visitor = User.objects.create_user('paging-visitor')
+
+		# совпадающие годы выставок, победы и средние оценки: порядок страниц держится на id
+		for i in range(7):
+			portfolio = Portfolio(owner=cls.owner, exhibition=exhibitions[i % 2], title=f'Проект {i}')
+			portfolio.save()
+			portfolio.nominations.add(nomination)
+			if i % 3:
+				Rating.objects.create(user=visitor, portfolio=portfolio, star=4, ip='127.0.0.1')
+			if i in (2, 5):
+				Winners.objects.create(
+					exhibition=portfolio.exhibition, nomination=nomination, exhibitor=cls.owner, portfolio=portfolio
+				)
+
+	def setUp(self):
+		cache.clear()
+
+	def walk(self, url, view_class, expected_ids):
+		with mock.patch.object(view_class, 'PAGE_SIZE', 2):
+			cursor_pages, page_pages = [], []
+			data = self.client.get(url, {'page': 1}).json()
+			while True:
+				cursor_pages.append([project['id'] for project in data['projects_list']])
+				page_pages.append([
+					project['id'] for project in
+					self.client.get(url, {'page': len(cursor_pages)}).json()['projects_list']
+				])
+				if not data['next_page']:
+					break
+				data = self.client.get(url, {'cursor': data['next']}).json()
+
+		self.assertEqual([pk for page in cursor_pages for pk in page], expected_ids)
+		self.assertEqual(cursor_pages, page_pages)
+		return data
+
+	def test_category_pages_with_ties(self):
+		rows = CategoryRanking.objects.filter(category__slug='paging-category')
+		self.assertLess(len(set(rows.values_list('last_exh_year', 'win_year', 'average'))), rows.count())
+		expected = list(
+			rows.order_by('-last_exh_year', '-win_year', '-average', '-portfolio_id').values_list('portfolio_id', flat=True)
+		)
+		self.assertEqual(len(expected), 7)
+		self.walk(reverse('exhibition:projects-list-url', args=['paging-category']), views.ProjectsList, expected)
+
+	def test_exhibitor_pages_with_ties(self):
+		expected = list(
+			Portfolio.objects.filter(owner=self.owner).order_by('-exhibition__slug', '-id').values_list('id', flat=True)
+		)
+		self.walk(reverse('exhibition:exhibitor-detail-url', args=[self.owner.slug]), views.ExhibitorDetail, expected)
+
+	def test_tampered_cursor(self):
+		url = reverse('exhibition:projects-list-url', args=['paging-category'])
+		with mock.patch.object(views.ProjectsList, 'PAGE_SIZE', 2):
+			cursor = self.client.get(url, {'page': 1}).json()['next']
+		self.assertEqual(self.client.get(url, {'cursor': cursor[:-2] + 'xx'}).status_code, 400)
+		self.assertEqual(self.client.get(url, {'cursor': 'garbage'}).status_code, 400)
+		# подписанный курсор чужого списка (другое число ключей) тоже отклоняется
+		foreign = signing.dumps({'p': 2, 'k': [1]}, salt=views.ProjectsList.CURSOR_SALT, compress=True)
+		self.assertEqual(self.client.get(url, {'cursor': foreign}).status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ExhibitionPageTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		now = timezone.now()
+		cls.current = Exhibitions.objects.create(
+			title='Текущая выставка', slug='2036', date_start=now - timedelta(days=5), date_end=now + timedelta(days=5)
+		)
+		cls.ended = Exhibitions.objects.create(
+			title='Прошедшая выставка', slug='2037', date_start=now - timedelta(days=30), date_end=now - timedelta(days=20)
+		)
+		category = Categories.objects.create(title='Категория', slug='page-category')
+		cls.nomination = Nominations.objects.create(title='Номинация', slug='page-nomination', category=category)
+
+		cls.owners = []
+		for i in range(2):
+			owner = Exhibitors(name=f'Участник {i}', slug=f'page-owner-{i}', email=f'page-owner{i}@example.com')
+			owner.save()
+			cls.owners.append(owner)
+
+		for exhibition in (cls.current, cls.ended):
+			exhibition.nominations.add(cls.nomination)
+			for owner in cls.owners:
+				portfolio = Portfolio(owner=owner, exhibition=exhibition, title=f'{owner.name}, {exhibition.slug}')
+				portfolio.save()
+				portfolio.nominations.add(cls.nomination)
+
+		winner = Portfolio.objects.filter(exhibition=cls.ended, owner=cls.owners[0]).get()
+		Winners.objects.create(exhibition=cls.ended, nomination=cls.nomination, exhibitor=cls.owners[0], portfolio=winner)
+		cls.staff = User.objects.create_user('page-staff', is_staff=True)
+		cls.visitor = User.objects.create_user('page-visitor')
+
+	def setUp(self):
+		cache.clear()
+		patcher = mock.patch.object(UrlCache, 'get_md5', side_effect=lambda file: settings.STATIC_URL + file)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def get_context(self, exhibition, user=None):
+		if user:
+			self.client.force_login(user)
+		else:
+			self.client.logout()
+		response = self.client.get(
+			reverse('exhibition:exhibition-detail-url', args=[exhibition.slug]), HTTP_USER_AGENT='Mozilla/5.0'
+		)
+		self.assertEqual(response.status_code, 200)
+		return response.context
+
+	def get_titles(self, context):
+		return sorted(project['title'] for project in context['projects_by_nomination'].get(self.nomination.pk, []))
+
+	def test_payload_per_role(self):
+		all_titles = [f'{owner.name}, {self.current.slug}' for owner in self.owners]
+
+		self.assertEqual(self.get_titles(self.get_context(self.current, self.staff)), all_titles)
+		# участник до завершения выставки видит только свои проекты
+		self.assertEqual(self.get_titles(self.get_context(self.current, self.owners[1].user)), all_titles[1:])
+		self.assertEqual(self.get_titles(self.get_context(self.current, self.owners[0].user)), all_titles[:1])
+		for user in (None, self.visitor):
+			self.assertEqual(self.get_context(self.current, user)['projects_by_nomination'], {})
+
+		# данные закэшированы отдельно для каждого класса пользователей
+		for role in ('staff', f'exhibitor-{self.owners[0].pk}', f'exhibitor-{self.owners[1].pk}', 'public-0'):
+			self.assertIsNotNone(cache.get(get_exhibition_payload_key(self.current.pk, role)), role)
+
+		# после завершения выставки участник получает общие данные
+		context = self.get_context(self.ended, self.owners[1].user)
+		self.assertEqual(self.get_titles(context), [f'{owner.name}, {self.ended.slug}' for owner in self.owners])
+		self.assertEqual(context['projects_by_nomination'], self.get_context(self.ended)['projects_by_nomination'])
+
+	def test_payload_invalidation(self):
+		self.assertEqual([item['title'] for item in self.get_context(self.ended)['win_nominations']], ['Номинация'])
+		self.get_context(self.current, self.staff)
+
+		self.nomination.title = 'Новая номинация'
+		self.nomination.save()
+		self.assertEqual([item['title'] for item in self.get_context(self.ended)['win_nominations']], ['Новая номинация'])
+
+		portfolio = Portfolio.objects.get(exhibition=self.current, owner=self.owners[0])
+		portfolio.title = 'Переименованный проект'
+		portfolio.save()
+		self.assertIn('Переименованный проект', self.get_titles(self.get_context(self.current, self.staff)))
+
+		portfolio.status = False
+		portfolio.save()
+		self.assertNotIn('Переименованный проект', self.get_titles(self.get_context(self.current, self.staff)))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProjectIdAllocationTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		now = timezone.now()
+		cls.exhibition = Exhibitions.objects.create(
+			title='Выставка', slug='2030', date_start=now - timedelta(days=30), date_end=now - timedelta(days=20)
+		)
+		cls.owner = Exhibitors(name='Участник', slug='exhibitor', email='owner@example.com')
+		cls.owner.save()
+
+	def create_portfolio(self, **kwargs):
+		portfolio = Portfolio(owner=self.owner, exhibition=self.exhibition, title='Проект', **kwargs)
+		portfolio.save()
+		return portfolio.project_id
+
+	def test_sequential_numbers(self):
+		self.assertEqual([self.create_portfolio() for _ in range(3)], [1, 2, 3])
+
+		self.owner.refresh_from_db()
+		self.assertEqual(self.owner.last_project_id, 3)
+
+	def test_counter_skips_existing_numbers(self):
+		# проекты с явным номером (или созданные до счетчика) не должны повторяться
+		self.create_portfolio(project_id=7)
+		self.assertEqual(self.create_portfolio(), 8)
+
+	def test_number_is_returned_by_update(self):
+		# UPDATE ... RETURNING: номер выдается одним запросом без повторного чтения счетчика
+		with self.assertNumQueries(1):
+			self.assertEqual(Portfolio.objects.allocate_project_id(self.owner.pk), 1)
+
+		with mock.patch.object(connection.features, 'can_return_columns_from_insert', False), self.assertNumQueries(2):
+			self.assertEqual(Portfolio.objects.allocate_project_id(self.owner.pk), 2)
+
+	def test_numbers_are_per_owner(self):
+		other = Exhibitors(name='Другой участник', slug='other', email='other@example.com')
+		other.save()
+		self.create_portfolio()
+
+		portfolio = Portfolio(owner=other, exhibition=self.exhibition, title='Проект')
+		portfolio.save()
+		self.assertEqual(portfolio.project_id, 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProjectIdConcurrencyTests(TransactionTestCase):
+	THREADS = 8
+
+	@classmethod
+	def setUpClass(cls):
+		# тестовая БД известна только здесь: при импорте connection еще смотрит на рабочую базу
+		if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+			raise SkipTest('Параллельная запись требует файловой или серверной БД')
+		super().setUpClass()
+
+	def setUp(self):
+		now = timezone.now()
+		self.exhibition = Exhibitions.objects.create(
+			title='Выставка', slug='2030', date_start=now - timedelta(days=30), date_end=now - timedelta(days=20)
+		)
+		self.owner = Exhibitors(name='Участник', slug='exhibitor', email='owner@example.com')
+		self.owner.save()
+
+	def test_parallel_creations_get_unique_numbers(self):
+		barrier = threading.Barrier(self.THREADS)
+		errors = []
+
+		def create(i):
+			try:
+				barrier.wait()
+				Portfolio(owner_id=self.owner.pk, exhibition_id=self.exhibition.pk, title=f'Проект {i}').save()
+			except Exception as e:
+				errors.append(e)
+			finally:
+				connection.close()
+
+		threads = [threading.Thread(target=create, args=(i,)) for i in range(self.THREADS)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		self.assertEqual(errors, [])
+		self.assertEqual(
+			sorted(Portfolio.objects.filter(owner=self.owner).values_list('project_id', flat=True)),
+			list(range(1, self.THREADS + 1))
+		)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DeferredSearchIndexTests(TestCase):
+
+	def setUp(self):
+		patcher = mock.patch('exhibition.search.schedule_index_update')
+		self.schedule = patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def queued_keys(self):
+		return {key for call in self.schedule.call_args_list for key in call.args[0]}
+
+	def test_index_is_updated_after_commit(self):
+		with self.captureOnCommitCallbacks(execute=True):
+			jury = Jury(name='Жюри', slug='jury')
+			jury.save()
+			jury.name = 'Председатель жюри'
+			jury.save()
+
+		self.assertFalse(SearchEntry.objects.filter(object_id=str(jury.pk), engine_slug='default').exists())
+		keys = self.queued_keys()
+		self.assertEqual(keys, {('default', 'exhibition.Jury', jury.pk)})
+
+		apply_index_updates(keys)
+		entries = SearchEntry.objects.filter(object_id=str(jury.pk), engine_slug='default')
+		self.assertEqual([entry.title for entry in entries], ['Председатель жюри'])
+
+	def test_rolled_back_changes_are_not_queued(self):
+		with self.captureOnCommitCallbacks(execute=True):
+			try:
+				with transaction.atomic():
+					Jury(name='Жюри', slug='jury').save()
+					raise RuntimeError
+			except RuntimeError:
+				pass
+
+		self.schedule.assert_not_called()
+
+	def test_existing_entries_are_replaced_in_bulk(self):
+		with self.captureOnCommitCallbacks(execute=True):
+			partners = [Partners(name=f'Партнер {i}', slug=f'bulk-partner-{i}') for i in range(3)]
+			for partner in partners:
+				partner.save()
+		keys = self.queued_keys()
+		apply_index_updates(keys)
+
+		Partners.objects.update(name='Новый партнер')
+		table = SearchEntry._meta.db_table
+		with CaptureQueriesContext(connection) as queries:
+			self.assertEqual(apply_index_updates(keys), 3)
+
+		statements = [query['sql'].split(' ', 1)[0] for query in queries if f'"{table}"' in query['sql']]
+		self.assertNotIn('UPDATE', statements)
+		self.assertEqual((statements.count('DELETE'), statements.count('INSERT')), (1, 1))
+
+		entries = SearchEntry.objects.filter(engine_slug='default', object_id__in=[str(partner.pk) for partner in partners])
+		self.assertEqual(list(entries.values_list('title', flat=True)), ['Новый партнер'] * 3)
+
+	def test_rebuild_command(self):
+		with self.captureOnCommitCallbacks(execute=True):
+			for i in range(3):
+				Partners(name=f'Партнер {i}', slug=f'partner-{i}').save()
+
+		out = StringIO()
+		call_command('rebuild_search_index', 'exhibition.Partners', workers=1, batch_size=2, stdout=out)
+		self.assertEqual(SearchEntry.objects.filter(engine_slug='default').count(), 3)
+		self.assertIn('exhibition.Partners: 3 object(s)', out.getvalue())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ExhibitorSearchTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.exhibition = Exhibitions.objects.create(
+			title='Выставка', slug='2030', date_start=timezone.now(), date_end=timezone.now() + timedelta(days=1)
+		)
+		cls.exhibitors = {}
+		for i, name in enumerate(['Студия Ёлка', 'Архитектурное бюро Лес', 'Лесная студия', 'Скрытый Лесник']):
+			exhibitor = Exhibitors(name=name, slug=f'exhibitor-{i}', email=f'user{i}@example.com')
+			exhibitor.save()
+			cls.exhibitors[name] = exhibitor
+
+		hidden = cls.exhibitors['Скрытый Лесник']
+		hidden.status = False
+		hidden.save()
+		cls.exhibition.exhibitors.add(cls.exhibitors['Лесная студия'])
+		cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+	def setUp(self):
+		cache.clear()
+		self.client.force_login(self.admin)
+
+	def search(self, **params):
+		response = self.client.get(reverse('exhibition:search-exhibitors'), params)
+		self.assertEqual(response.status_code, 200)
+		return [item['name'] for item in response.json()['exhibitors']]
+
+	def test_normalize(self):
+		self.assertEqual(ExhibitorSearchService.normalize('  Студия «ЁЛКА»', None, 'Иванов-Петров'), 'студия елка иванов петров')
+
+	def test_prefix_search_is_ranked(self):
+		self.assertEqual(self.search(q='лес'), ['Лесная студия', 'Архитектурное бюро Лес'])
+		self.assertEqual(self.search(q='студ лес'), ['Лесная студия'])
+		self.assertEqual(self.search(q='елк'), ['Студия Ёлка'])
+		self.assertEqual(self.search(q='ле'), [])
+		self.assertEqual(self.search(q='лес', exhibition_id=self.exhibition.id), ['Лесная студия'])
+
+	def test_user_name_is_searchable(self):
+		exhibitor = self.exhibitors['Студия Ёлка']
+		exhibitor.user.last_name = 'Смирнова'
+		exhibitor.user.save()
+
+		self.assertEqual(self.search(q='смирн'), ['Студия Ёлка'])
+
+	def test_admin_autocomplete(self):
+		response = self.client.get('/admin/autocomplete/', {
+			'app_label': 'exhibition', 'model_name': 'portfolio', 'field_name': 'owner', 'term': 'студ',
+		})
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual([item['text'] for item in response.json()['results']], ['Студия Ёлка', 'Лесная студия'])
+
+	def test_trigram_index_requires_extension(self):
+		self.assertFalse(ExhibitorSearchService.create_trigram_index())
+
+		with mock.patch.object(connection, 'vendor', 'postgresql'), \
+				mock.patch.object(ExhibitorSearchService, 'has_trigram_extension', return_value=False), \
+				CaptureQueriesContext(connection) as queries:
+			self.assertFalse(ExhibitorSearchService.create_trigram_index())
+		self.assertEqual(len(queries), 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AsyncApiTests(TestCase):
+	"""Асинхронные эндпоинты (exhibition.api, rating.api) отвечают так же, как синхронные"""
+
+	@classmethod
+	def setUpTestData(cls):
+		now = timezone.now()
+		cls.exhibition = Exhibitions.objects.create(
+			title='Выставка', slug='2031', date_start=now - timedelta(days=30), date_end=now - timedelta(days=20)
+		)
+		category = Categories.objects.create(title='Категория', slug='category')
+		cls.nomination = Nominations.objects.create(title='Номинация', slug='nomination', category=category)
+		cls.exhibition.nominations.add(cls.nomination)
+		cls.owner = Exhibitors(name='Студия Лес', slug='studio', email='studio@example.com')
+		cls.owner.save()
+		cls.exhibition.exhibitors.add(cls.owner)
+		cls.portfolio = Portfolio(owner=cls.owner, exhibition=cls.exhibition, title='Проект')
+		cls.portfolio.save()
+		cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+		cls.voter = User.objects.create_user('voter')
+
+	def setUp(self):
+		cache.clear()
+
+	def compare(self, name, params):
+		request = RequestFactory().get('/', params)
+		request.user = self.admin
+		expected = json.loads(getattr(views, name)(request).content)
+
+		async_request = AsyncRequestFactory().get('/', params)
+		async_request.user = self.admin
+		async_request.auser = self.get_auser(self.admin)
+		response = async_to_sync(getattr(api, name))(async_request)
+		self.assertEqual(json.loads(response.content), expected)
+		return expected
+
+	@staticmethod
+	def get_auser(user):
+		async def auser():
+			return user
+		return auser
+
+	def test_json_endpoints_match_sync_views(self):
+		data = self.compare('get_nominations_for_exhibition', {
+			'exhibition_id': self.exhibition.id, 'selected': str(self.nomination.id)
+		})
+		self.assertEqual(data['nominations'], [{'id': self.nomination.id, 'title': 'Номинация', 'selected': True}])
+
+		data = self.compare('get_exhibitions_by_owner', {'owner_id': self.owner.id})
+		self.assertEqual([exh['slug'] for exh in data['exhibitions']], ['2031'])
+
+		data = self.compare('get_exhibitors_by_exhibition', {'exhibition_id': self.exhibition.id})
+		self.assertEqual(data['exhibitors'], [{'id': self.owner.id, 'name': 'Студия Лес'}])
+
+		data = self.compare('search_exhibitors', {'q': 'лес'})
+		self.assertEqual([item['name'] for item in data['exhibitors']], ['Студия Лес'])
+
+	def test_add_rating(self):
+		request = AsyncRequestFactory().post('/', {'star': 4, 'portfolio': self.portfolio.id})
+		request.auser = self.get_auser(self.voter)
+		response = async_to_sync(rating_api.AddRating.as_view())(request)
+
+		self.assertEqual(response.status_code, 200)
+		data = json.loads(response.content)
+		self.assertEqual((data['score'], data['score_avg'], data['is_new']), (4, 4.0, True))
+		self.assertTrue(Rating.objects.filter(user=self.voter, portfolio=self.portfolio, star=4).exists())
+
+		# повторная оценка обычного пользователя запрещена - как в синхронной версии
+		request = RequestFactory().post('/', {'star': 5, 'portfolio': self.portfolio.id})
+		request.user = self.voter
+		expected = rating_views.AddRating.as_view()(request)
+
+		request = AsyncRequestFactory().post('/', {'star': 5, 'portfolio': self.portfolio.id})
+		request.auser = self.get_auser(self.voter)
+		response = async_to_sync(rating_api.AddRating.as_view())(request)
+		self.assertEqual((response.status_code, response.content), (expected.status_code, expected.content))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SiteSearchTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		now = timezone.now()
+		exhibition = Exhibitions.objects.create(
+			title='Выставка', slug='2030', date_start=now - timedelta(days=30), date_end=now - timedelta(days=20)
+		)
+		owner = Exhibitors(name='Мебельная мастерская', slug='exhibitor', email='owner@example.com')
+		owner.save()
+		Jury(name='Мебельный эксперт', slug='jury').save()
+		for i in range(3):
+			Portfolio(owner=owner, exhibition=exhibition, title=f'Мебельный проект {i}').save()
+
+		call_command('rebuild_search_index', workers=1, stdout=StringIO())
+
+	def setUp(self):
+		cache.clear()
+		self.client = self.client_class(HTTP_USER_AGENT='Mozilla/5.0')
+
+	def test_facet_counts(self):
+		data = SiteSearchService.search('  МЕБЕЛЬН ')
+		self.assertEqual(data['counts'], {'projects': 3, 'exhibitors': 1, 'jury': 1})
+
+		# список id ограничен, количества - нет
+		cache.clear()
+		with mock.patch.object(SiteSearchService, 'MAX_RESULTS', 2):
+			data = SiteSearchService.search('мебельн')
+		self.assertEqual(len(data['results']), 2)
+		self.assertEqual(data['counts'], {'projects': 3, 'exhibitors': 1, 'jury': 1})
+
+	def test_pagination_reuses_cached_results(self):
+		url = reverse('exhibition:search-results')
+		with mock.patch.object(watson, 'search', wraps=watson.search) as search:
+			response = self.client.get(url, {'q': 'мебельн', 'type': 'projects'})
+			self.assertEqual(response.status_code, 200)
+			self.assertEqual(len(response.context['object_list']), 3)
+			self.assertEqual(response.context['facets'][0], (None, 'Все', 5))
+
+			with mock.patch.object(views.SearchSite, 'paginate_by', 2):
+				response = self.client.get(url, {'q': 'Мебельн', 'page': 2})
+			self.assertEqual(response.status_code, 200)
+			self.assertEqual(len(response.context['object_list']), 2)
+
+		# список и количества по разделам запрашиваются только при первом обращении
+		self.assertEqual(search.call_count, 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class JuryExportTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		now = timezone.now()
+		cls.exhibition = Exhibitions.objects.create(
+			title='Выставка', slug='2030', date_start=now - timedelta(days=30), date_end=now - timedelta(days=20)
+		)
+		category = Categories.objects.create(title='Категория', slug='category')
+		nomination = Nominations.objects.create(title='Номинация', slug='nomination', category=category)
+		cls.exhibition.nominations.add(nomination)
+		owner = Exhibitors(name='Участник', slug='exhibitor', email='owner@example.com')
+		owner.save()
+
+		jurors = []
+		for i in range(2):
+			jury = Jury(name=f'Жюри {i}', slug=f'jury-{i}', user=User.objects.create_user(f'juror{i}'))
+			jury.save()
+			jurors.append(jury)
+		cls.exhibition.jury.set(jurors)
+
+		for i in range(3):
+			portfolio = Portfolio(owner=owner, exhibition=cls.exhibition, title=f'Проект {i}')
+			portfolio.save()
+			portfolio.nominations.add(nomination)
+			Rating.objects.create(user=jurors[0].user, portfolio=portfolio, star=i + 2, is_jury_rating=True, ip='1')
+
+		cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+		cls.jurors = jurors
+
+	def setUp(self):
+		cache.clear()
+
+	def export(self):
+		self.client.force_login(self.admin)
+		url = reverse('admin:exhibition_exhibitions_export_jury_ratings', args=[self.exhibition.pk])
+		return self.client.post(url, {'filename': 'протокол'})
+
+	def read_workbook(self, content):
+		workbook = load_workbook(BytesIO(content))
+		return {ws.title: [[cell.value for cell in row] for row in ws.iter_rows()] for ws in workbook}
+
+	@mock.patch.object(ExportExhibitionAdmin, 'BACKGROUND_EXPORT', False)
+	def test_streaming_export_matches_in_memory_export(self):
+		response = self.export()
+		self.assertEqual(response.status_code, 200)
+		self.assertTrue(response.streaming)
+		self.assertIn("filename*=utf-8''%D0%BF%D1%80%D0%BE%D1%82%D0%BE%D0%BA%D0%BE%D0%BB.xlsx", response['Content-Disposition'])
+		streamed = self.read_workbook(b''.join(response.streaming_content))
+
+		with mock.patch.object(ExportExhibitionAdmin, 'STREAMING_EXPORT', False):
+			response = self.export()
+		self.assertFalse(response.streaming)
+
+		self.assertEqual(streamed, self.read_workbook(response.content))
+		self.assertEqual(streamed['Итоги'][3][:4], ['Проект', 'Жюри 0', 'Жюри 1', 'Ср.балл'])
+
+	def test_report_data_from_rating_matrix(self):
+		with self.assertNumQueries(5):
+			report = JuryReportService.get_report_data(self.exhibition, 2)
+
+		nomination = report['nominations'][0]
+		self.assertEqual([p['portfolio'].title for p in nomination['top_projects']], ['Проект 2', 'Проект 1'])
+		self.assertEqual([p['portfolio'].title for p in nomination['other_projects']], ['Проект 0'])
+		top = nomination['top_projects'][0]
+		self.assertEqual(top['jury_scores'], {self.jurors[0].id: 4, self.jurors[1].id: None})
+		self.assertEqual((top['total_score'], top['votes']), (4, 1))
+		self.assertEqual([w['portfolio'].title for w in nomination['winners']], ['Проект 2'])
+		self.assertEqual(nomination['jury_counts'], {self.jurors[0].id: 3, self.jurors[1].id: 0})
+		self.assertEqual(list(report['not_voted_jury']), [self.jurors[1].id])
+		self.assertEqual(report['not_voted_jury'][self.jurors[1].id]['total_missing'], 3)
+		self.assertEqual(report['total_stats'], {
+			'total_jury': 2, 'total_nominations': 1, 'total_projects': 3, 'total_ratings': 3,
+		})
+
+	def test_rating_matrix_is_cached_until_jury_vote(self):
+		JuryReportService.get_report_data(self.exhibition, 2)
+		with self.assertNumQueries(0):
+			JuryReportService.get_report_data(self.exhibition, 2)
+
+		portfolio = Portfolio.objects.get(title='Проект 0')
+		Rating.objects.create(user=self.jurors[1].user, portfolio=portfolio, star=5, is_jury_rating=True, ip='1')
+
+		report = JuryReportService.get_report_data(self.exhibition, 2)
+		second = report['nominations'][0]['top_projects'][1]
+		self.assertEqual(second['portfolio'], portfolio)
+		self.assertEqual((second['total_score'], second['votes']), (3.5, 2))
+		self.assertEqual(report['total_stats']['total_ratings'], 4)
+
+
+	@mock.patch('exhibition.jobs.schedule_export_job')
+	def test_background_export_job(self, schedule_export_job):
+		with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+			with self.captureOnCommitCallbacks(execute=True):
+				response = self.export()
+			job = ExportJob.objects.get()
+			self.assertRedirects(
+				response, reverse('admin:exhibition_exportjob_change', args=[job.pk]), fetch_redirect_response=False
+			)
+			response = self.client.get(response.url, HTTP_USER_AGENT='x')
+			self.assertContains(response, reverse('admin:exhibition_exportjob_status', args=[job.pk]))
+			schedule_export_job.assert_called_once_with(job.pk)
+			self.assertEqual((job.status, job.filename), (ExportJob.PENDING, 'протокол.xlsx'))
+
+			self.assertTrue(run_export_job(job.pk))
+			self.assertFalse(run_export_job(job.pk))
+			job.refresh_from_db()
+			self.assertEqual((job.status, job.progress), (ExportJob.DONE, 100))
+			self.assertTrue(job.file.name.startswith('exports/'))
+
+			status = self.client.get(reverse('admin:exhibition_exportjob_status', args=[job.pk])).json()
+			self.assertEqual(status['download_url'], reverse('admin:exhibition_exportjob_download', args=[job.pk]))
+			response = self.client.get(status['download_url'])
+			self.assertEqual(self.read_workbook(b''.join(response.streaming_content))['Итоги'][0][0], 'Протокол оценок жюри: Выставка')
+
+			# повторная выгрузка без изменений отдает готовый файл, новая оценка жюри - пересчитывает
+			self.export()
+			self.assertEqual(ExportJob.objects.count(), 1)
+			portfolio = Portfolio.objects.get(title='Проект 0')
+			Rating.objects.create(user=self.jurors[1].user, portfolio=portfolio, star=5, is_jury_rating=True, ip='1')
+			self.export()
+			self.assertEqual(ExportJob.objects.filter(status=ExportJob.PENDING).count(), 1)
+
+			# после сброса кэша его версии начинаются заново, но файл со старыми оценками не выдается
+			cache.clear()
+			self.export()
+			self.assertEqual(ExportJob.objects.filter(status=ExportJob.PENDING).count(), 2)
+
+			path = job.file.path
+			ExportJob.objects.filter(pk=job.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+			self.assertEqual(cleanup_export_jobs(), 1)
+			self.assertFalse(os.path.exists(path))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class JuryProgressTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		now = timezone.now()
+		cls.exhibition = Exhibitions.objects.create(
+			title='Выставка', slug='2033', date_start=now + timedelta(days=10), date_end=now + timedelta(days=20)
+		)
+		category = Categories.objects.create(title='Категория', slug='progress-category')
+		nominations = [
+			Nominations.objects.create(title=f'Номинация {i}', slug=f'progress-nomination-{i}', category=category, sort=i)
+			for i in range(2)
+		]
+		cls.exhibition.nominations.set(nominations)
+		owner = Exhibitors(name='Участник', slug='progress-owner', email='progress-owner@example.com')
+		owner.save()
+
+		cls.jurors = []
+		for i in range(2):
+			jury = Jury(name=f'Жюри {i}', slug=f'progress-jury-{i}', user=User.objects.create_user(f'progress-juror{i}'))
+			jury.save()
+			cls.jurors.append(jury)
+		cls.exhibition.jury.set(cls.jurors)
+
+		cls.portfolios = []
+		for i in range(3):
+			portfolio = Portfolio(owner=owner, exhibition=cls.exhibition, title=f'Проект {i}')
+			portfolio.save()
+			portfolio.nominations.add(nominations[0] if i else nominations[1])
+			cls.portfolios.append(portfolio)
+
+		cls.admin = User.objects.create_superuser('progress-admin', 'progress-admin@example.com', 'password')
+
+	def setUp(self):
+		cache.clear()
+
+	def rate(self, jury, portfolio, score):
+		return RatingService.rate(jury.user, portfolio.pk, score, '127.0.0.1')
+
+	def get_progress(self):
+		state = JuryProgressService.get_state(self.exhibition.pk)
+		return [[cell['voted'] for cell in member['nominations']] for member in state['jury']], state
+
+	def test_counters_follow_jury_votes(self):
+		progress, state = self.get_progress()
+		self.assertEqual(progress, [[0, 0], [0, 0]])
+		self.assertEqual([nomination['projects'] for nomination in state['nominations']], [2, 1])
+
+		self.rate(self.jurors[1], self.portfolios[1], 4)
+		version = get_jury_progress_version(self.exhibition.pk)
+		# к записи оценки (см. RatingServiceTests) добавляется один UPDATE счетчиков
+		with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(8):
+			self.rate(self.jurors[0], self.portfolios[1], 4)
+		self.assertNotEqual(get_jury_progress_version(self.exhibition.pk), version)
+		with self.assertNumQueries(7):
+			self.rate(self.jurors[0], self.portfolios[1], 5)
+
+		self.rate(self.jurors[0], self.portfolios[0], 3)
+		Rating.objects.create(
+			user=self.jurors[1].user, portfolio=self.portfolios[2], star=5, is_jury_rating=True, ip='1'
+		)
+		progress, state = self.get_progress()
+		self.assertEqual(progress, [[1, 1], [2, 0]])
+		self.assertEqual((state['voted'], state['missing']), (4, 2))
+
+		report = JuryReportService.get_report_data(self.exhibition, 3)
+		self.assertEqual(
+			[list(nomination['jury_counts'].values()) for nomination in report['nominations']],
+			[list(column) for column in zip(*progress)],
+		)
+
+		Rating.objects.filter(user=self.jurors[0].user, portfolio=self.portfolios[0]).delete()
+		self.portfolios[1].nominations.clear()
+		self.assertEqual(self.get_progress()[0], [[0, 0], [1, 0]])
+
+	def test_deltas_match_refresh(self):
+		def assert_consistent():
+			progress = self.get_progress()[0]
+			JuryProgressService.refresh(self.exhibition.pk)
+			self.assertEqual(progress, self.get_progress()[0])
+			return progress
+
+		for jury in self.jurors:
+			for portfolio in self.portfolios:
+				self.rate(jury, portfolio, 4)
+		nominations = list(self.exhibition.nominations.all())
+
+		with mock.patch.object(JuryProgressService, 'refresh', wraps=JuryProgressService.refresh) as refresh:
+			portfolio = Portfolio.objects.get(pk=self.portfolios[0].pk)
+			portfolio.title = 'Новое название'
+			portfolio.save()
+			# правка оценки жюри и оценки зрителей счетчики не трогают
+			rating = Rating.objects.get(user=self.jurors[0].user, portfolio=portfolio)
+			rating.star = 2
+			with CaptureQueriesContext(connection) as queries:
+				rating.save()
+				Rating.objects.create(user=self.admin, portfolio=portfolio, star=5, ip='1')
+			self.assertFalse([query for query in queries if 'jury_progress' in query['sql']])
+
+			portfolio.nominations.add(nominations[0])
+			self.assertEqual(assert_consistent(), [[3, 1], [3, 1]])
+			refresh.reset_mock()
+			# в pk_set при remove попадает и не связанная номинация
+			self.portfolios[1].nominations.remove(*nominations)
+			nominations[1].nominations_for_portfolio.add(self.portfolios[2])
+			self.assertEqual(assert_consistent(), [[2, 2], [2, 2]])
+			refresh.reset_mock()
+			nominations[1].nominations_for_portfolio.clear()
+			self.portfolios[2].nominations.clear()
+			rating.is_jury_rating = False
+			rating.save()
+			self.assertEqual(assert_consistent(), [[0, 0], [1, 0]])
+			refresh.reset_mock()
+			self.assertEqual(refresh.call_count, 0)
+
+			# скрытый проект выпадает из счетчиков
+			portfolio.nominations.add(*nominations)
+			portfolio.status = False
+			portfolio.save()
+			self.assertEqual(refresh.call_count, 1)
+			self.assertEqual(assert_consistent(), [[0, 0], [0, 0]])
+
+	def test_dashboard_polls_snapshots(self):
+		self.rate(self.jurors[1], self.portfolios[0], 4)
+		self.client.force_login(self.admin)
+		url = reverse('admin:exhibition_exhibitions_jury_progress', args=[self.exhibition.pk])
+		response = self.client.get(url, HTTP_USER_AGENT='x')
+		self.assertContains(response, 'Жюри 1')
+		state_url = reverse('admin:exhibition_exhibitions_jury_progress_state', args=[self.exhibition.pk])
+		self.assertContains(response, 'data-stream-url=""')
+		self.assertContains(response, f'data-state-url="{state_url}"')
+
+		# на WSGI долгого потока нет: он занимал бы синхронный воркер
+		with self.assertRaises(NoReverseMatch):
+			reverse('admin:exhibition_exhibitions_jury_progress_stream', args=[self.exhibition.pk])
+
+		version = str(get_jury_progress_version(self.exhibition.pk))
+		data = self.client.get(state_url).json()
+		self.assertEqual((data['version'], data['state']['voted']), (version, 1))
+
+		# пока счетчики не менялись, снимок не читается из БД
+		with self.assertNumQueries(0):
+			request = RequestFactory().get(state_url, {'version': version})
+			request.user = self.admin
+			response = ExportExhibitionAdmin(Exhibitions, admin.site).jury_progress_state(request, self.exhibition.pk)
+		self.assertEqual(response.status_code, 204)
+
+		with self.captureOnCommitCallbacks(execute=True):
+			self.rate(self.jurors[0], self.portfolios[0], 5)
+		data = self.client.get(state_url, {'version': version}).json()
+		self.assertNotEqual(data['version'], version)
+		self.assertEqual(data['state']['voted'], 2)
+
+	def test_async_stream(self):
+		self.rate(self.jurors[1], self.portfolios[0], 4)
+		version = str(get_jury_progress_version(self.exhibition.pk))
+
+		async def read_stream(last_event_id):
+			return [event async for event in JuryProgressService.astream(self.exhibition.pk, last_event_id)]
+
+		with mock.patch.multiple(JuryProgressService, STREAM_DURATION=0.05, STREAM_POLL_INTERVAL=0.01):
+			events = async_to_sync(read_stream)(None)
+			self.assertEqual(events[0], 'retry: 3000\n\n')
+			event = events[1].split('\n')
+			self.assertEqual(event[:2], [f'id: {version}', 'event: progress'])
+			self.assertEqual(json.loads(event[2].removeprefix('data: '))['voted'], 1)
+
+			# переподключение с последней версией: пока счетчики не менялись, данные не запрашиваются
+			with self.assertNumQueries(0):
+				self.assertEqual(async_to_sync(read_stream)(version), ['retry: 3000\n\n'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, DOMAIN_URL='https://example.com')
+class SitemapTests(TestCase):
+
+	def setUp(self):
+		root = tempfile.TemporaryDirectory()
+		self.addCleanup(root.cleanup)
+		sitemap_settings = override_settings(SITEMAP_ROOT=root.name)
+		sitemap_settings.enable()
+		self.addCleanup(sitemap_settings.disable)
+
+	def read_section(self, filename):
+		with gzip.open(get_sitemap_path(filename), 'rt') as fh:
+			return fh.read()
+
+	def test_sections_and_index(self):
+		now = timezone.now()
+		Exhibitions.objects.create(
+			title='Выставка', slug='2035', date_start=now - timedelta(days=30), date_end=now - timedelta(days=20)
+		)
+		owner = Exhibitors(name='Участник', slug='sitemap-owner', email='sitemap-owner@example.com')
+		owner.save()
+		portfolio = Portfolio(owner=owner, title='Проект')
+		portfolio.save()
+
+		self.assertTrue(write_sitemaps(['exhibitions', 'portfolio', 'unknown']))
+		self.assertIn('https://example.com/exhibition/2035/', self.read_section('exhibitions.xml.gz'))
+		self.assertIn(f'/{owner.slug}/project-{portfolio.project_id}/', self.read_section('portfolio.xml.gz'))
+
+		with open(get_sitemap_path(SITEMAP_INDEX_FILE)) as fh:
+			index = fh.read()
+		self.assertIn('https://example.com/media/sitemaps/exhibitions.xml.gz', index)
+		self.assertIn('portfolio.xml.gz', index)
+		self.assertNotIn('jury.xml.gz', index)
+
+		# неизмененный раздел не перезаписывается, индекс тоже
+		mtime = os.path.getmtime(get_sitemap_path('portfolio.xml.gz'))
+		self.assertFalse(write_sitemaps(['portfolio']))
+		self.assertEqual(os.path.getmtime(get_sitemap_path('portfolio.xml.gz')), mtime)
+
+		# разбиение на страницы и удаление лишних страниц после уменьшения раздела
+		with mock.patch.object(PortfolioSitemap, 'limit', 1, create=True):
+			Portfolio(owner=owner, title='Проект 2').save()
+			write_sitemaps(['portfolio'])
+			self.assertTrue(os.path.exists(get_sitemap_path('portfolio-2.xml.gz')))
+			Portfolio.objects.filter(owner=owner).last().delete()
+			write_sitemaps(['portfolio'])
+		self.assertFalse(os.path.exists(get_sitemap_path('portfolio-2.xml.gz')))
+
+	def test_sections_by_model(self):
+		labels = {model._meta.label_lower for model in apps.get_models(include_auto_created=True)}
+		self.assertLessEqual(set(SECTIONS_BY_MODEL), labels)
+		for sections in SECTIONS_BY_MODEL.values():
+			self.assertLessEqual(set(sections), set(sitemaps))
+
+	def test_changes_schedule_affected_sections(self):
+		with mock.patch('exhibition.sitemap.schedule_sitemaps_update') as schedule:
+			with self.captureOnCommitCallbacks(execute=True):
+				Jury(name='Жюри', slug='sitemap-jury').save()
+			schedule.assert_not_called()
+
+			with override_settings(SITEMAP_AUTO_UPDATE=True), self.captureOnCommitCallbacks(execute=True):
+				Jury(name='Жюри', slug='sitemap-jury-2').save()
+				Partners(name='Партнер', slug='sitemap-partner').save()
+		self.assertEqual({section for call in schedule.call_args_list for section in call.args[0]}, {'jury', 'partners'})
 
-# Create your tests here.
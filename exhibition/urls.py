@@ -1,5 +1,9 @@
+from django.conf import settings
 from django.urls import path, re_path
-from . import views
+from . import api, views
+
+# на ASGI JSON-эндпоинты и подгрузка проектов обслуживаются асинхронными версиями (exhibition.api)
+json_views = api if settings.ASYNC_VIEWS else views
 
 app_name = 'exhibition'
 urlpatterns = [
@@ -10,7 +14,10 @@ urlpatterns = [
 	path('exhibition/<exh_year>/<slug>/', views.WinnerProjectDetail.as_view(), name='winner-detail-url'),
 
 	path('category/', views.CategoryList.as_view(), kwargs={'slug': None}, name='category-list-url'),
-	path('category/<slug>/', views.ProjectsList.as_view(), name='projects-list-url'),
+	path(
+		'category/<slug>/', api.projects_list if settings.ASYNC_VIEWS else views.ProjectsList.as_view(),
+		name='projects-list-url'
+	),
 	path('projects/<owner>/project-<project_id>/', views.ProjectDetail.as_view(), name='project-detail-url'),
 	path('projects/<exh_year>/', views.ProjectsListByYear.as_view(), name='projects-list-by-year-url'),
 
@@ -27,7 +34,10 @@ urlpatterns = [
 	path('exhibitors/', views.ExhibitorsList.as_view(), kwargs={'exh_year': None}, name='exhibitors-list-url'),
 	path('exhibitors/all/', views.ExhibitorsList.as_view(), name='exhibitors-list-all'),
 	path('exhibitors/<exh_year>/', views.ExhibitorsList.as_view(), name='exhibitors-list-year'),
-	path('exhibitor/<slug>/detail/', views.ExhibitorDetail.as_view(), name='exhibitor-detail-url'),
+	path(
+		'exhibitor/<slug>/detail/', api.exhibitor_detail if settings.ASYNC_VIEWS else views.ExhibitorDetail.as_view(),
+		name='exhibitor-detail-url'
+	),
 
 	path('winners/', views.WinnersList.as_view(), kwargs={'exh_year': None}, name='winners-list-url'),
 	path('winners/all/', views.WinnersList.as_view(), name='winners-list-all'),
@@ -49,11 +59,11 @@ urlpatterns = [
 	path('account/deactivate/', views.deactivate_user, name="deactivate-user"),
 	path('reset_password/', views.send_reset_password_email),
 
-	path('api/get-exhibitions-by-owner/', views.get_exhibitions_by_owner, name='get_exhibitions_by_owner'),
-	path('api/get-exhibitors-by-exhibition/', views.get_exhibitors_by_exhibition, name='get_exhibitors_by_exhibition'),
+	path('api/get-exhibitions-by-owner/', json_views.get_exhibitions_by_owner, name='get_exhibitions_by_owner'),
+	path('api/get-exhibitors-by-exhibition/', json_views.get_exhibitors_by_exhibition, name='get_exhibitors_by_exhibition'),
 	path('api/nominations-categories-mapping/', views.get_nominations_categories, name='nominations-mapping-url'),
-	path('api/get-nominations/', views.get_nominations_for_exhibition, name='get-nominations-for-exhibition-url'),
-	path('api/search-exhibitors/', views.search_exhibitors, name='search-exhibitors'),
+	path('api/get-nominations/', json_views.get_nominations_for_exhibition, name='get-nominations-for-exhibition-url'),
+	path('api/search-exhibitors/', json_views.search_exhibitors, name='search-exhibitors'),
 
 	path('portfolio/add/', views.portfolio_upload, kwargs={'pk': None}, name='portfolio-upload-url'),
 	path('portfolio/edit/<pk>', views.portfolio_upload, name='portfolio-upload-url'),
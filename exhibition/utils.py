@@ -2,7 +2,7 @@ from django.contrib.auth.models import Group
 
 from typing import TYPE_CHECKING
 
-from exhibition.models import Jury, Exhibitors
+from exhibition.models import Jury, Exhibitors, Partners
 
 if TYPE_CHECKING:
 	from exhibition.models import Portfolio
@@ -28,6 +28,26 @@ def is_jury_member(user):
 		return False
 
 
+def get_persons_for_users(user_ids, person_models=(Exhibitors, Partners, Jury)):
+	"""
+	Профили пользователей (участник, партнер, жюри) пакетно - не более одного запроса на модель.
+	Если у пользователя несколько профилей, берется первый по порядку person_models.
+	"""
+	pending = {pk for pk in user_ids if pk}
+	persons = {}
+
+	for model in person_models:
+		if not pending:
+			break
+
+		for person in model.objects.filter(user_id__in=pending):
+			persons.setdefault(person.user_id, person)
+
+		pending.difference_update(persons)
+
+	return persons
+
+
 def get_exhibitor_for_user(user):
 	"""Возвращает объект Exhibitors для пользователя или None"""
 	if not user or not user.is_authenticated:
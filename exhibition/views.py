@@ -1,7 +1,7 @@
 import logging
 import math
 from collections import defaultdict
-from os import SEEK_END
+from os import SEEK_END, path
 
 from allauth.account.models import EmailAddress
 from allauth.account.views import PasswordResetView
@@ -11,11 +11,12 @@ from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.core.cache import cache
+from django.core.exceptions import BadRequest
 from django.core.files.uploadhandler import FileUploadHandler
 from django.db import connection, OperationalError
-from django.db.models import Q, OuterRef, Subquery, Avg, CharField, Case, When, Count, Max
+from django.db.models import Q, OuterRef, Subquery, Avg, Count, Max
 from django.forms import inlineformset_factory
-from django.http import HttpResponse, JsonResponse, Http404
+from django.http import HttpResponse, JsonResponse, Http404, FileResponse
 from django.shortcuts import render, redirect, HttpResponseRedirect
 from django.template.loader import render_to_string
 from django.urls import reverse_lazy
@@ -27,14 +28,19 @@ from django.views.generic.list import ListView
 from watson.views import SearchMixin
 
 from blog.models import Article
+from crm.ratelimit import rate_limit
 from designers.models import Designer
+from rating.buffer import RatingBuffer
 from rating.forms import RatingForm
 from rating.models import Rating, Reviews
+from rating.services import ReviewService
 from .forms import PortfolioForm, ImageForm, ImageFormHelper, FeedbackForm, UsersListForm, DeactivateUserForm
 from .logic import send_email
-from .mixins import BannersMixin, MetaSeoMixin, ExhibitionsYearsMixin, ProjectsLazyLoadMixin
+from .mixins import (
+	BannersMixin, MetaSeoMixin, ExhibitionsYearsMixin, ProjectsLazyLoadMixin, ConditionalGetMixin
+)
 from .models import *
-from .services import ProjectsQueryService
+from .services import ProjectsQueryService, ExhibitionPageService, ExhibitorSearchService, SiteSearchService
 from .utils import is_exhibitor_of_exhibition, is_jury_member, get_exhibitor_for_user, can_rate_portfolio
 
 logger = logging.getLogger(__name__)
@@ -130,11 +136,13 @@ class EventsList(MetaSeoMixin, ExhibitionsYearsMixin, ListView):
 		else:
 			posts = self.model.objects.none()
 
-		return posts
+		# ссылка на мероприятие строится по slug выставки
+		return posts.select_related('exhibition')
 
 	def get_context_data(self, **kwargs):
 		context = super().get_context_data(**kwargs)
 		context['html_classes'] = ['events', ]
+		context['cache_timeout'] = 2592000
 		return context
 
 
@@ -202,10 +210,12 @@ class CategoryList(MetaSeoMixin, BannersMixin, ListView):
 		return context
 
 
-class ProjectsList(ProjectsLazyLoadMixin, MetaSeoMixin, BannersMixin, ListView):
+class ProjectsList(ConditionalGetMixin, ProjectsLazyLoadMixin, MetaSeoMixin, BannersMixin, ListView):
 	""" Projects view """
 	model = Categories
 	template_name = 'exhibition/projects_list.html'
+	CURSOR_ORDERING = ('last_exh_year', 'win_year', 'average', 'id')
+	CURSOR_NULLS_LAST = False
 
 	def __init__(self, **kwargs):
 		super().__init__(**kwargs)
@@ -220,6 +230,7 @@ class ProjectsList(ProjectsLazyLoadMixin, MetaSeoMixin, BannersMixin, ListView):
 		super().setup(request, *args, **kwargs)
 		self.slug = self.kwargs.get('slug')
 		self.object = self.model.objects.filter(slug=self.slug).first()
+		self.filters_group = request.GET.getlist('filter-group')
 
 	@staticmethod
 	def build_filter_attributes(attributes):
@@ -264,39 +275,40 @@ class ProjectsList(ProjectsLazyLoadMixin, MetaSeoMixin, BannersMixin, ListView):
 			Q(project_id__isnull=False) & query
 		).distinct()
 
-	def get_queryset(self):
-		qs = Portfolio.objects.get_visible_projects(self.request.user)
-
-		qs = qs.filter(
-			project_id__isnull=False,
-			nominations__category__slug=self.slug
-		).distinct()
+	def get_projects_queryset(self):
+		"""Проекты категории из сводной таблицы рейтинга (CategoryRanking)"""
+		visibility = Portfolio.objects.get_visibility_filter(self.request.user, date_end_field='exhibition_end')
+		qs = CategoryRanking.objects.filter(visibility, category=self.object, status=True)
 
 		if self.filters_group and self.filters_group[0] != '0':
-			qs = qs.filter(attributes__in=self.filters_group)
+			qs = qs.filter(portfolio__attributes__in=self.filters_group).distinct()
 
-		qs = ProjectsQueryService.get_cover_with_rating(qs).annotate(
-			last_exh_year=F('exhibition__slug'),
-			win_year=Subquery(
-				Winners.objects.filter(
-					portfolio_id=OuterRef('pk'),
-					nomination__category__slug=self.slug
-				).values('exhibition__slug')[:1]
-			),
-		)
+		return qs
 
-		return qs.values(
-			'id', 'project_id', 'project_cover', 'title',
+	def get_queryset(self):
+		return self.get_projects_queryset().values(
+			'project_id', 'project_cover', 'cover_thumbs', 'title',
 			'last_exh_year', 'win_year', 'average',
-			'owner__name', 'owner__slug'
-		).order_by('-last_exh_year', '-win_year', '-average')
+			id=F('portfolio_id'), owner__name=F('owner_name'), owner__slug=F('owner_slug'),
+		).order_by(*self.get_cursor_ordering())
+
+	def get_validators(self, request):
+		if not self.is_lazy_load_request(request):
+			return None
+
+		return ProjectsQueryService.get_version_stamp(self.get_projects_queryset(), count_field='portfolio')
+
+	def is_lazy_load_request(self, request):
+		return bool(self.filters_group) or super().is_lazy_load_request(request)
+
+	def get_lazy_load_queryset(self):
+		return self.get_queryset()
 
 	def get(self, request, *args, **kwargs):
 		self.init_pagination(request)
-		self.filters_group = request.GET.getlist('filter-group')
 
-		if self.filters_group or 'page' in request.GET:
-			qs = self.paginate_queryset(self.get_queryset())
+		if self.is_lazy_load_request(request):
+			qs = self.paginate_queryset(self.get_lazy_load_queryset())
 			return self.build_projects_response(qs)
 
 		return super().get(request, **kwargs)
@@ -324,18 +336,9 @@ class ProjectsListByYear(ListView):
 	template_name = 'exhibition/projects_by_year.html'
 
 	def get_queryset(self):
-		# Подзапрос для получения первого фото в портфолио
-		subquery = Subquery(Image.objects.filter(portfolio=OuterRef('pk')).values('file')[:1])
-
 		return self.model.objects.filter(
 			Q(exhibition__slug=self.kwargs['exh_year']) & Q(project_id__isnull=False)
-		).distinct().prefetch_related('ratings').annotate(
-			project_cover=Case(
-				When(Q(cover__exact='') | Q(cover__isnull=True), then=subquery),
-				default='cover',
-				output_field=CharField()
-			)
-		).values('id', 'title', 'owner__name', 'owner__slug', 'project_id', 'project_cover').order_by('owner__slug')
+		).distinct().values('id', 'title', 'owner__name', 'owner__slug', 'project_id', 'project_cover').order_by('owner__slug')
 
 	def get_context_data(self, **kwargs):
 		context = super().get_context_data(**kwargs)
@@ -343,18 +346,20 @@ class ProjectsListByYear(ListView):
 		return context
 
 
-class ExhibitorDetail(ProjectsLazyLoadMixin, MetaSeoMixin, DetailView):
+class ExhibitorDetail(ConditionalGetMixin, ProjectsLazyLoadMixin, MetaSeoMixin, DetailView):
 	""" Exhibitor detail """
 	model = Exhibitors
 	template_name = 'exhibition/participant_detail.html'
+	CURSOR_ORDERING = ('exh_year', 'id')
+
+	def get_visible_projects(self):
+		return Portfolio.objects.get_visible_projects(self.request.user).filter(
+			owner__slug=self.kwargs['slug'],
+			exhibition__isnull=False
+		)
 
 	def get_projects_queryset(self):
-		return ProjectsQueryService.get_cover_with_rating(
-			Portfolio.objects.get_visible_projects(self.request.user).filter(
-				owner__slug=self.kwargs['slug'],
-				exhibition__isnull=False
-			)
-		).annotate(
+		return ProjectsQueryService.get_with_rating(self.get_visible_projects()).annotate(
 			exh_year=F('exhibition__slug'),
 			win_year=Subquery(
 				Winners.objects.filter(
@@ -362,16 +367,25 @@ class ExhibitorDetail(ProjectsLazyLoadMixin, MetaSeoMixin, DetailView):
 				).values('exhibition__slug')[:1]
 			)
 		).values(
-			'id', 'project_id', 'project_cover', 'title',
+			'id', 'project_id', 'project_cover', 'cover_thumbs', 'title',
 			'exh_year', 'win_year', 'average',
 			'owner__name', 'owner__slug'
-		).order_by('-exh_year')
+		).order_by(*self.get_cursor_ordering())
+
+	def get_validators(self, request):
+		if not self.is_lazy_load_request(request):
+			return None
+
+		return ProjectsQueryService.get_version_stamp(self.get_visible_projects())
+
+	def get_lazy_load_queryset(self):
+		return self.get_projects_queryset()
 
 	def get(self, request, *args, **kwargs):
 		self.init_pagination(request)
 
-		if 'page' in request.GET:
-			qs = self.paginate_queryset(self.get_projects_queryset())
+		if self.is_lazy_load_request(request):
+			qs = self.paginate_queryset(self.get_lazy_load_queryset())
 			return self.build_projects_response(qs)
 
 		return super().get(request, **kwargs)
@@ -384,6 +398,7 @@ class ExhibitorDetail(ProjectsLazyLoadMixin, MetaSeoMixin, DetailView):
 		context.update({
 			'object_list': projects,
 			'next_page': self.is_next_page,
+			'next_cursor': self.next_cursor,
 			'action_url': reverse(
 				'exhibition:exhibitor-detail-url',
 				kwargs={'slug': self.kwargs['slug']}
@@ -468,55 +483,22 @@ class ExhibitionDetail(MetaSeoMixin, BannersMixin, DetailView):
 				context['exhibition_ended']
 		)
 
-		# Загружаем проекты для показа
-		if context['show_projects']:
-			portfolios = Portfolio.objects.get_visible_projects(user, exhibition=exhibition)
-
-			# Группируем проекты по номинациям вручную
-			projects_by_nomination = {}
-			for portfolio in portfolios:
-				for nomination in portfolio.nominations.all():
-					if nomination.id not in projects_by_nomination:
-						projects_by_nomination[nomination.id] = []
-
-					projects_by_nomination[nomination.id].append({
-						'id': portfolio.id,
-						'title': portfolio.title,
-						'cover': portfolio.get_cover,
-						'project_id': portfolio.project_id,
-						'owner_slug': portfolio.owner.slug,
-						'owner_name': portfolio.owner.name
-					})
-
-			context['projects_by_nomination'] = projects_by_nomination
+		role = ExhibitionPageService.get_role(user, context['exhibition_ended'], is_jury, is_exhibitor)
+		payload = ExhibitionPageService.get_payload(
+			exhibition, user, role, context['show_projects'], context['exhibition_ended']
+		)
 
-		# Баннер слайдер
-		banner_slider = []
-		if exhibition.banner and exhibition.banner.width > 0:
-			banner_slider.append(exhibition.banner)
-			context['banner_height'] = f"{exhibition.banner.height / exhibition.banner.width * 100}%"
+		# без доступа к проектам словарь пуст (шаблон обращается к нему для каждой номинации)
+		context['projects_by_nomination'] = payload['projects_by_nomination']
 
-		# Для завершенной выставки добавляем фото победителей в слайдер
 		if context['exhibition_ended']:
-			context['win_nominations'] = exhibition.nominations.filter(
-				nomination_for_winner__exhibition_id=exhibition.id
-			).annotate(
-				exhibitor_name=F('nomination_for_winner__exhibitor__name'),
-				exhibitor_slug=F('nomination_for_winner__exhibitor__slug'),
-				project_id=F('nomination_for_winner__portfolio__project_id'),
-			).values('id', 'exhibitor_name', 'exhibitor_slug', 'project_id', 'title', 'slug')
-
-			for nom in context['win_nominations']:
-				cover = Image.objects.filter(
-					portfolio__exhibition=exhibition.id,
-					portfolio__nominations=nom['id'],
-					portfolio__owner__slug=nom['exhibitor_slug'],
-				).values('file').first()
-				if cover:
-					banner_slider.append(cover['file'])
+			context['win_nominations'] = payload['win_nominations']
+
+		if payload['banner_height']:
+			context['banner_height'] = payload['banner_height']
 
 		context['html_classes'] = ['exhibition']
-		context['banner_slider'] = banner_slider
+		context['banner_slider'] = payload['banner_slider']
 		context['events_title'] = Events._meta.verbose_name_plural
 		context['gallery_title'] = Gallery._meta.verbose_name_plural
 		context['last_exh'] = self.model.objects.only('slug').first().slug
@@ -581,10 +563,15 @@ class WinnerProjectDetail(MetaSeoMixin, BannersMixin, DetailView):
 				portfolio=portfolio,
 				user=self.request.user
 			).values_list('star', flat=True).first()
+			if context['user_score'] is None and portfolio:
+				context['user_score'] = RatingBuffer.get_user_score(portfolio.pk, self.request.user.pk)
 
 		else:
 			context['user_score'] = None
 
+		if portfolio:
+			context['comments'] = ReviewService.get_threads(portfolio.pk, self.request.GET.get('comments'))
+
 		context['average_rate'] = round(total_rate, 1)
 		context['round_rate'] = math.ceil(total_rate)
 		context['extra_rate_percent'] = int((total_rate - int(total_rate)) * 100)
@@ -598,13 +585,33 @@ class WinnerProjectDetail(MetaSeoMixin, BannersMixin, DetailView):
 		return context
 
 
-class ProjectDetail(MetaSeoMixin, DetailView):
+class ProjectDetail(ConditionalGetMixin, MetaSeoMixin, DetailView):
 	""" Project detail """
 
 	model = Portfolio
 	context_object_name = 'portfolio'
 	template_name = 'exhibition/portfolio_detail.html'
 
+	def get_validators(self, request):
+		portfolio = Portfolio.objects.get_visible_projects(request.user).filter(
+			project_id=self.kwargs.get('project_id'),
+			owner__slug=self.kwargs.get('owner')
+		).select_related('exhibition').only(
+			'id', 'updated_at', 'exhibition__date_start', 'exhibition__date_end'
+		).first()
+
+		if not portfolio:
+			return None
+
+		# Фазы голосования меняются по времени без изменений в БД
+		exhibition = portfolio.exhibition
+		phase = (
+			exhibition.is_jury_voting_active,
+			exhibition.is_users_voting_active,
+		) if exhibition else ()
+
+		return portfolio.id, portfolio.updated_at, *phase, timezone.localdate()
+
 	def get_object(self, queryset=None):
 		if self.kwargs.get('owner') and self.kwargs.get('project_id'):
 			try:
@@ -662,6 +669,8 @@ class ProjectDetail(MetaSeoMixin, DetailView):
 			context['jury_deadline'] = self.object.exhibition.jury_deadline
 
 		context['is_jury'] = is_jury_member(user)
+		if not context['is_jury']:
+			context['comments'] = ReviewService.get_threads(self.object.pk, self.request.GET.get('comments'))
 		context['jury_avg'] = round(jury_avg, 2)
 		context['jury_count'] = jury_count
 
@@ -723,57 +732,51 @@ def contacts(request):
 
 
 class SearchSite(SearchMixin, ListView):
-	""" Watson model's search """
+	""" Watson model's search (результаты кэшируются в SiteSearchService) """
 	template_name = 'search_results.html'
 	paginate_by = 15
+	facet_param = 'type'
+
+	def get_queryset(self):
+		"""Ранжированный список id записей индекса из кэша: пагинация не повторяет поиск"""
+		self.search_data = SiteSearchService.search(self.query)
+		self.facet = self.request.GET.get(self.facet_param)
+		if self.facet not in SiteSearchService.FACETS:
+			self.facet = None
+
+		return [
+			entry_id for entry_id, facet in self.search_data['results']
+			if self.facet is None or facet == self.facet
+		]
+
+	def paginate_queryset(self, queryset, page_size):
+		paginator, page, entry_ids, is_paginated = super().paginate_queryset(queryset, page_size)
+		page.object_list = SiteSearchService.get_entries(entry_ids)
+
+		return paginator, page, page.object_list, is_paginated
 
 	def get_context_data(self, **kwargs):
 		context = super().get_context_data(**kwargs)
 		context['html_classes'] = ['search-result']
-		# for result in self.object_list:
-		# 	print(result)
+		context['facet'] = self.facet
+		context['facets'] = SiteSearchService.get_facets(self.search_data['counts'])
 
 		return context
 
 
 @login_required
 def search_exhibitors(request):
-	query = request.GET.get('q', '')
-	exhibition_id = request.GET.get('exhibition_id')
-	limit = int(request.GET.get('limit', 50))
-
-	# Базовый queryset
-	if exhibition_id:
-		exhibitors = Exhibitors.objects.filter(
-			exhibitors_for_exh__id=exhibition_id
-		).select_related('user')
-	else:
-		exhibitors = Exhibitors.objects.all().select_related('user')
-
-	# Применяем поиск если есть запрос
-	if query:
-		if len(query) < 3:
-			# Для коротких запросов возвращаем пустой результат
-			exhibitors = exhibitors.none()
-		else:
-			# Поиск при 3+ символах
-			exhibitors = exhibitors.filter(
-				Q(name__icontains=query) |
-				Q(user__first_name__icontains=query) |
-				Q(user__last_name__icontains=query)
-			)
-
-	# Применяем limit
-	exhibitors = exhibitors[:limit]
-
-	# Преобразуем в JSON
-	results = [
-		{
-			'id': exh.id,
-			'name': exh.name or f"{exh.user.first_name} {exh.user.last_name}".strip(),
-		}
-		for exh in exhibitors
-	]
+	""" Автодополнение участников (ExhibitorSearchService) """
+	try:
+		limit = min(int(request.GET.get('limit', 50)), ExhibitorSearchService.MAX_RESULTS)
+	except ValueError:
+		raise BadRequest('Invalid limit')
+
+	results = ExhibitorSearchService.search(
+		request.GET.get('q', ''),
+		limit=limit,
+		exhibition_id=request.GET.get('exhibition_id'),
+	)
 
 	return JsonResponse({'exhibitors': results})
 
@@ -792,30 +795,13 @@ def account(request):
 	customers = None
 	if exhibitor:
 		exh_portfolio = Portfolio.objects.filter(owner=exhibitor, exhibition__isnull=False).annotate(
-			exh_year=F('exhibition__slug'),
-			project_cover=Case(
-				When(
-					Q(cover__exact='') | Q(cover__isnull=True),
-					then=Subquery(Image.objects.filter(portfolio_id=OuterRef('pk')).values('file')[:1])
-				),
-				default='cover',
-				output_field=CharField()
-			)
+			exh_year=F('exhibition__slug')
 		).order_by('-exh_year')
 
 		try:
 			designer = Designer.objects.get(owner=exhibitor)
 
-			add_portfolio = designer.add_portfolio.all().annotate(
-				project_cover=Case(
-					When(
-						Q(cover__exact='') | Q(cover__isnull=True),
-						then=Subquery(Image.objects.filter(portfolio_id=OuterRef('pk')).values('file')[:1])
-					),
-					default='cover',
-					output_field=CharField()
-				)
-			).order_by('title')
+			add_portfolio = designer.add_portfolio.all().order_by('title')
 
 			victories = Nominations.objects.prefetch_related('nomination_for_winner').filter(
 				nomination_for_winner__exhibitor=exhibitor).annotate(
@@ -992,6 +978,7 @@ def get_exhibitors_by_exhibition(request):
 
 @csrf_exempt
 @login_required
+@rate_limit('upload')
 def portfolio_upload(request, **kwargs):
 	""" Загрузка нового портфолио или редактирование существующего """
 
@@ -1170,6 +1157,20 @@ class HealthCheckView(View):
 		}, status=200 if db_status == "connected" else 503)
 
 
+def sitemap_index(request):
+	"""
+	Индекс карты сайта из заранее сгенерированного файла (в продакшене отдается nginx напрямую).
+	Разделы в gzip лежат рядом в SITEMAP_ROOT и обновляются сигналами при сохранении моделей.
+	"""
+	from .sitemap import SITEMAP_INDEX_FILE, get_sitemap_path, write_sitemaps
+
+	index_path = get_sitemap_path(SITEMAP_INDEX_FILE)
+	if not path.exists(index_path):
+		write_sitemaps()
+
+	return FileResponse(open(index_path, 'rb'), content_type='application/xml')
+
+
 def __404__(request, exception):
 	"""Кастомный обработчик 404"""
 	from django.http import HttpResponseNotFound
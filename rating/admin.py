@@ -1,6 +1,11 @@
 from django.contrib import admin
+from django.db import DEFAULT_DB_ALIAS
+from django.http import Http404, StreamingHttpResponse
+from django.urls import path
 
+from crm.routers import get_replica_alias
 from exhibition.services import delete_cached_fragment
+from .exports import EXPORT_FORMATS, RatingsExport, ReviewsExport
 from .models import Rating, Reviews
 
 admin.site.site_title = 'Рейтинг портфолио'
@@ -26,13 +31,43 @@ class ReviewInline(admin.StackedInline):
 	extra = 0
 
 
+class StreamingExportAdminMixin:
+	"""Потоковая выгрузка в CSV/JSONL всех записей списка с учетом текущих фильтров"""
+	export_class = None
+	change_list_template = 'admin/rating/change_list.html'
+
+	def get_urls(self):
+		info = self.model._meta.app_label, self.model._meta.model_name
+		custom = [
+			path(
+				'export/<str:export_format>/',
+				self.admin_site.admin_view(self.export_view),
+				name='%s_%s_export' % info
+			),
+		]
+		return custom + super().get_urls()
+
+	def export_view(self, request, export_format):
+		if export_format not in EXPORT_FORMATS or not self.has_view_permission(request):
+			raise Http404
+
+		queryset = self.get_changelist_instance(request).get_queryset(request)
+		# выгрузка для анализа допускает задержку репликации
+		export = self.export_class(queryset, using=get_replica_alias() or DEFAULT_DB_ALIAS)
+		response = StreamingHttpResponse(export.iter_lines(export_format), content_type=EXPORT_FORMATS[export_format])
+		response['Content-Disposition'] = f'attachment; filename="{self.model._meta.model_name}.{export_format}"'
+		return response
+
+
 @admin.register(Rating)
-class RatingAdmin(admin.ModelAdmin):
+class RatingAdmin(StreamingExportAdminMixin, admin.ModelAdmin):
 	list_display = ('star', 'portfolio', 'get_exhibition', 'get_fullname', 'created_at', 'is_jury_rating')
+	list_select_related = ('portfolio__exhibition', 'user')
 	list_filter = ('star', 'is_jury_rating', 'portfolio__exhibition')
 	search_fields = ('user__username', 'user__first_name', 'user__last_name')
 	date_hierarchy = 'portfolio__exhibition__date_start'
 	readonly_fields = ('ip',)
+	export_class = RatingsExport
 
 	@admin.display(
 		description='Выставка',
@@ -53,8 +88,10 @@ class RatingAdmin(admin.ModelAdmin):
 
 
 @admin.register(Reviews)
-class ReviewAdmin(admin.ModelAdmin):
-	list_display = ('id', 'group', 'portfolio', 'fullname', 'parent', 'message', 'posted_date',)
+class ReviewAdmin(StreamingExportAdminMixin, admin.ModelAdmin):
+	list_display = ('id', 'group', 'portfolio', 'fullname', 'parent', 'message', 'reply_count', 'posted_date',)
+	list_select_related = ('group__user', 'portfolio', 'user', 'parent__user')
+	export_class = ReviewsExport
 
 	# def save_model(self, request, obj, form, change):
 	# 	super().save_model(request, obj, form, change)
@@ -0,0 +1,54 @@
+"""Асинхронная версия добавления оценки для развертывания на ASGI (см. exhibition.api)"""
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views.generic.base import View
+
+from crm.ratelimit import rate_limit
+from exhibition.models import Portfolio
+from exhibition.services import adelete_cached_fragment
+from exhibition.utils import get_client_ip
+from . import views
+from .services import RatingService, RatingError
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+@method_decorator(rate_limit('rating'), name='post')
+class AddRating(View):
+	"""Добавление рейтинга проекту (те же проверки и ответы, что у rating.views.AddRating)"""
+
+	async def post(self, request):
+		user = await request.auser()
+		try:
+			score = int(request.POST.get("star"))
+			portfolio_id = int(request.POST.get("portfolio"))
+
+			if request.POST.get("test") == "true":
+				await sync_to_async(RatingService.can_rate)(user, portfolio_id)
+				return JsonResponse(views.AddRating.TEST_RESPONSE)
+
+			# транзакция записи целиком выполняется в одном потоке
+			result = await sync_to_async(RatingService.submit)(user, portfolio_id, score, get_client_ip(request))
+			await adelete_cached_fragment('portfolio', portfolio_id)
+			await adelete_cached_fragment('project', portfolio_id)
+
+			return JsonResponse(views.AddRating.get_success_data(result, score), safe=False)
+
+		except RatingError as e:
+			return JsonResponse({'status': 'error', 'message': e.message}, status=e.status)
+		except (ValueError, TypeError) as e:
+			return JsonResponse({
+				'status': 'error',
+				'message': f'Неверные данные: {str(e)}'
+			}, status=400)
+		except Portfolio.DoesNotExist:
+			return JsonResponse({
+				'status': 'error',
+				'message': 'Работа не найдена'
+			}, status=404)
+		except Exception as e:
+			return JsonResponse({
+				'status': 'error',
+				'message': f'Ошибка сервера: {str(e)}'
+			}, status=500)
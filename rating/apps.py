@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class RatingConfig(AppConfig):
 	name = 'rating'
 	verbose_name = "Рейтинг работ"
+
+	def ready(self):
+		import rating.signals
@@ -0,0 +1,234 @@
+"""
+Буфер оценок посетителей в Redis (settings.RATING_BUFFER) для пиковой нагрузки после окончания выставки.
+
+Оценка посетителя записывается в хэш портфолио (поле - id пользователя, повторная оценка отклоняется)
+и сразу учитывается в показываемой статистике. Периодический сброс (flush) переносит накопленные
+оценки в Rating одной пакетной вставкой и пересчитывает счетчики. Оценки жюри пишутся в БД сразу (RatingService).
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'rating:buffer'
+DIRTY_KEY = f'{KEY_PREFIX}:dirty'
+LOCK_KEY = f'{KEY_PREFIX}:lock'
+FLUSH_BATCH_SIZE = 500
+
+# KEYS: голоса, итоги, множество портфолио с голосами; ARGV: пользователь, значение, оценка, портфолио
+ADD_SCRIPT = """
+if redis.call('HSETNX', KEYS[1], ARGV[1], ARGV[2]) == 0 then
+	return {0, 0, 0}
+end
+local count = redis.call('HINCRBY', KEYS[2], 'count', 1)
+local total = redis.call('HINCRBY', KEYS[2], 'total', ARGV[3])
+redis.call('SADD', KEYS[3], ARGV[4])
+return {1, count, total}
+"""
+
+# Удаляет перенесенные в БД голоса, если они не изменились; ARGV: портфолио, затем пары пользователь/значение
+ACK_SCRIPT = """
+local removed = 0
+for i = 2, #ARGV, 2 do
+	if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+		redis.call('HDEL', KEYS[1], ARGV[i])
+		redis.call('HINCRBY', KEYS[2], 'count', -1)
+		redis.call('HINCRBY', KEYS[2], 'total', -tonumber(string.match(ARGV[i + 1], '^(%d+)')))
+		removed = removed + 1
+	end
+end
+if redis.call('HLEN', KEYS[1]) == 0 then
+	redis.call('DEL', KEYS[1], KEYS[2])
+	redis.call('SREM', KEYS[3], ARGV[1])
+end
+return removed
+"""
+
+
+def votes_key(portfolio_id):
+	return f'{KEY_PREFIX}:{portfolio_id}:votes'
+
+
+def totals_key(portfolio_id):
+	return f'{KEY_PREFIX}:{portfolio_id}:totals'
+
+
+class RatingBuffer:
+
+	@staticmethod
+	def is_enabled():
+		return getattr(settings, 'RATING_BUFFER', False)
+
+	@staticmethod
+	def get_connection():
+		from django_redis import get_redis_connection
+		return get_redis_connection('default')
+
+	@staticmethod
+	def merge_stats(stats, count, total):
+		"""Добавляет к статистике Portfolio.get_rating_stats еще не перенесенные в БД голоса"""
+		if not count:
+			return stats
+
+		stats = dict(stats, count=stats['count'] + count, total=stats['total'] + total)
+		stats['average'] = stats['total'] / stats['count']
+		return stats
+
+	@classmethod
+	def add(cls, portfolio_id, user_id, score, ip):
+		"""
+		Записывает голос в буфер. Возвращает (принят ли голос, число и сумма голосов в буфере);
+		голос не принимается, если пользователь уже голосовал за портфолио и он еще в буфере.
+		"""
+		value = f'{score}|{ip}'
+		added, count, total = cls.get_connection().eval(
+			ADD_SCRIPT, 3, votes_key(portfolio_id), totals_key(portfolio_id), DIRTY_KEY,
+			user_id, value, score, portfolio_id,
+		)
+		if added:
+			schedule_flush()
+
+		return bool(added), count, total
+
+	@classmethod
+	def get_pending(cls, portfolio_id):
+		"""Число и сумма голосов в буфере (0, 0 - если буфер выключен или Redis недоступен)"""
+		if not cls.is_enabled():
+			return 0, 0
+
+		from redis.exceptions import RedisError
+		try:
+			count, total = cls.get_connection().hmget(totals_key(portfolio_id), 'count', 'total')
+		except RedisError as e:
+			logger.warning(f"Rating buffer is unavailable: {e}")
+			return 0, 0
+
+		return int(count or 0), int(total or 0)
+
+	@classmethod
+	def get_user_score(cls, portfolio_id, user_id):
+		"""Оценка пользователя из буфера (None, если ее там нет)"""
+		if not cls.is_enabled():
+			return None
+
+		from redis.exceptions import RedisError
+		try:
+			value = cls.get_connection().hget(votes_key(portfolio_id), user_id)
+		except RedisError:
+			return None
+
+		return int(value.split(b'|', 1)[0]) if value else None
+
+	@classmethod
+	def flush(cls):
+		"""
+		Переносит голоса из буфера в Rating. Голоса удаляются из буфера только после фиксации
+		транзакции, поэтому повторный сброс после сбоя безопасен: уже записанные в БД оценки
+		(в том числе сохраненные напрямую при недоступном Redis) не перезаписываются.
+		Возвращает число перенесенных голосов.
+		"""
+		redis = cls.get_connection()
+		lock_timeout = max(getattr(settings, 'RATING_BUFFER_FLUSH_INTERVAL', 10) * 6, 60)
+		if not redis.set(LOCK_KEY, 1, nx=True, ex=lock_timeout):
+			return 0
+
+		try:
+			portfolio_ids = sorted(int(pk) for pk in redis.smembers(DIRTY_KEY))
+			flushed = 0
+			for start in range(0, len(portfolio_ids), FLUSH_BATCH_SIZE):
+				flushed += cls.flush_portfolios(redis, portfolio_ids[start:start + FLUSH_BATCH_SIZE])
+			return flushed
+		finally:
+			redis.delete(LOCK_KEY)
+
+	@classmethod
+	def flush_portfolios(cls, redis, portfolio_ids):
+		from exhibition.models import Portfolio
+		from exhibition.services import CategoryRankingService, delete_cached_fragment
+		from .models import Rating, PortfolioRating
+
+		pipeline = redis.pipeline(transaction=False)
+		for portfolio_id in portfolio_ids:
+			pipeline.hgetall(votes_key(portfolio_id))
+		votes = {
+			portfolio_id: {int(user_id): value for user_id, value in portfolio_votes.items()}
+			for portfolio_id, portfolio_votes in zip(portfolio_ids, pipeline.execute())
+		}
+
+		# портфолио и пользователи могли быть удалены, пока голоса лежали в буфере
+		existing_portfolios = set(Portfolio.objects.filter(pk__in=portfolio_ids).values_list('pk', flat=True))
+		user_ids = {user_id for portfolio_votes in votes.values() for user_id in portfolio_votes}
+		existing_users = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+
+		ratings = []
+		for portfolio_id, portfolio_votes in votes.items():
+			if portfolio_id not in existing_portfolios:
+				continue
+			for user_id, value in portfolio_votes.items():
+				if user_id in existing_users:
+					star, ip = value.decode().split('|', 1)
+					ratings.append(Rating(user_id=user_id, portfolio_id=portfolio_id, star=int(star), ip=ip))
+
+		flushed_ids = {rating.portfolio_id for rating in ratings}
+		try:
+			with transaction.atomic():
+				# те же блокировки и в том же порядке, что у RatingService.rate: пересчет счетчиков
+				# не пересекается с оценкой, записываемой в это время напрямую
+				list(Portfolio.objects.select_for_update().filter(pk__in=flushed_ids).order_by('pk').values_list('pk'))
+				Rating.objects.bulk_create(ratings, batch_size=FLUSH_BATCH_SIZE, ignore_conflicts=True)
+				PortfolioRating.refresh(flushed_ids)
+				Portfolio.objects.filter(pk__in=flushed_ids).update(updated_at=timezone.now())
+		except IntegrityError as e:
+			logger.error(f"Rating buffer flush failed for {len(portfolio_ids)} portfolios: {e}")
+			return 0
+
+		pipeline = redis.pipeline(transaction=False)
+		for portfolio_id, portfolio_votes in votes.items():
+			args = [portfolio_id]
+			for user_id, value in portfolio_votes.items():
+				args += [user_id, value]
+			pipeline.eval(ACK_SCRIPT, 3, votes_key(portfolio_id), totals_key(portfolio_id), DIRTY_KEY, *args)
+		pipeline.execute()
+
+		CategoryRankingService.refresh(flushed_ids)
+		for portfolio_id in flushed_ids:
+			delete_cached_fragment('portfolio', portfolio_id)
+			delete_cached_fragment('project', portfolio_id)
+
+		return len(ratings)
+
+
+_flush_lock = threading.Lock()
+_flush_scheduled = False
+
+
+def schedule_flush():
+	"""Сброс буфера в фоне не чаще раза в RATING_BUFFER_FLUSH_INTERVAL секунд (см. также команду flush_rating_buffer)"""
+	global _flush_scheduled
+
+	with _flush_lock:
+		if _flush_scheduled:
+			return
+		_flush_scheduled = True
+
+	threading.Thread(target=_flush_later, daemon=True).start()
+
+
+def _flush_later():
+	global _flush_scheduled
+
+	try:
+		time.sleep(getattr(settings, 'RATING_BUFFER_FLUSH_INTERVAL', 10))
+		with _flush_lock:
+			_flush_scheduled = False
+		RatingBuffer.flush()
+	except Exception as e:
+		logger.error(f"Rating buffer flush failed: {e}")
+	finally:
+		connections.close_all()
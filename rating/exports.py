@@ -0,0 +1,149 @@
+import csv
+import json
+from collections import defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS
+
+from exhibition.models import Exhibitions, Portfolio
+from .models import Rating, Reviews
+
+# строк за одно чтение серверного курсора (PostgreSQL) / пачки fetchmany (остальные СУБД)
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_FORMATS = {
+	'csv': 'text/csv; charset=utf-8',
+	'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+# символы, с которых табличные редакторы начинают формулу
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def escape_csv_value(value):
+	"""Защита от формул в ячейках (CSV injection): такой текст экранируется апострофом"""
+	if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+		return "'" + value
+	return value
+
+
+class _Echo:
+	"""Буфер для csv.writer: строка возвращается, а не записывается"""
+
+	def write(self, value):
+		return value
+
+
+class StreamingExport:
+	"""
+	Потоковая выгрузка оценок/отзывов для анализа: строки читаются через .iterator(chunk_size),
+	поэтому память не зависит от числа записей. В памяти держатся только справочники
+	номинаций проектов и жюри выставок - их размер ограничен числом проектов, а не оценок.
+	"""
+	model = None
+	# (колонка, поле для values_list)
+	fields = ()
+	extra_columns = ('nominations', 'exhibition_juror')
+
+	def __init__(self, queryset=None, using=DEFAULT_DB_ALIAS, chunk_size=EXPORT_CHUNK_SIZE):
+		self.queryset = self.model._default_manager.all() if queryset is None else queryset
+		self.using = using
+		self.chunk_size = chunk_size
+
+	@property
+	def columns(self):
+		return [column for column, _ in self.fields] + list(self.extra_columns)
+
+	def get_queryset(self):
+		return self.queryset.using(self.using).order_by('pk').values_list(*(field for _, field in self.fields))
+
+	def get_nominations_map(self):
+		nominations = defaultdict(list)
+		rows = Portfolio.nominations.through.objects.using(self.using).values_list(
+			'portfolio_id', 'nominations__title'
+		).order_by('portfolio_id', 'nominations__title')
+		for portfolio_id, title in rows.iterator(chunk_size=self.chunk_size):
+			nominations[portfolio_id].append(title)
+
+		return {portfolio_id: '; '.join(titles) for portfolio_id, titles in nominations.items()}
+
+	def get_jurors(self):
+		"""Пары (выставка, пользователь) членов жюри"""
+		return set(
+			Exhibitions.jury.through.objects.using(self.using)
+			.filter(jury__user__isnull=False)
+			.values_list('exhibitions_id', 'jury__user_id')
+		)
+
+	def iter_rows(self):
+		nominations = self.get_nominations_map()
+		jurors = self.get_jurors()
+		columns = [column for column, _ in self.fields]
+
+		for values in self.get_queryset().iterator(chunk_size=self.chunk_size):
+			row = dict(zip(columns, values))
+			row['nominations'] = nominations.get(row['portfolio_id'], '')
+			row['exhibition_juror'] = (row['exhibition_id'], row['user_id']) in jurors
+			yield row
+
+	def iter_csv(self):
+		# BOM, чтобы Excel открывал кириллицу без импорта
+		writer = csv.writer(_Echo())
+		yield '\ufeff' + writer.writerow(self.columns)
+		for row in self.iter_rows():
+			# тексты пользователей (отзывы, названия проектов, имена) не должны исполняться как формулы
+			yield writer.writerow(escape_csv_value(value) for value in row.values())
+
+	def iter_jsonl(self):
+		for row in self.iter_rows():
+			yield json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+	def iter_lines(self, export_format):
+		if export_format not in EXPORT_FORMATS:
+			raise ValueError(f"Unknown export format: {export_format}")
+
+		return self.iter_csv() if export_format == 'csv' else self.iter_jsonl()
+
+
+class RatingsExport(StreamingExport):
+	model = Rating
+	fields = (
+		('id', 'id'),
+		('star', 'star'),
+		('is_jury_rating', 'is_jury_rating'),
+		('user_id', 'user_id'),
+		('username', 'user__username'),
+		('portfolio_id', 'portfolio_id'),
+		('portfolio', 'portfolio__title'),
+		('owner', 'portfolio__owner__name'),
+		('exhibition_id', 'portfolio__exhibition_id'),
+		('exhibition', 'portfolio__exhibition__slug'),
+		('created_at', 'created_at'),
+		('updated_at', 'updated_at'),
+	)
+
+
+class ReviewsExport(StreamingExport):
+	model = Reviews
+	fields = (
+		('id', 'id'),
+		('parent_id', 'parent_id'),
+		('group_id', 'group_id'),
+		('path', 'path'),
+		('reply_count', 'reply_count'),
+		('user_id', 'user_id'),
+		('username', 'user__username'),
+		('portfolio_id', 'portfolio_id'),
+		('portfolio', 'portfolio__title'),
+		('owner', 'portfolio__owner__name'),
+		('exhibition_id', 'portfolio__exhibition_id'),
+		('exhibition', 'portfolio__exhibition__slug'),
+		('message', 'message'),
+		('posted_date', 'posted_date'),
+	)
+
+
+EXPORTS = {
+	'ratings': RatingsExport,
+	'reviews': ReviewsExport,
+}
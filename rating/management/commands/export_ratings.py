@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from crm.routers import get_replica_alias
+from rating.exports import EXPORTS, EXPORT_FORMATS, EXPORT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+	help = 'Stream all ratings or reviews with portfolio, nomination, exhibition and juror flags to CSV or JSONL'
+
+	def add_arguments(self, parser):
+		parser.add_argument('kind', choices=sorted(EXPORTS))
+		parser.add_argument('--format', dest='export_format', choices=sorted(EXPORT_FORMATS), default='csv')
+		parser.add_argument('--output', '-o', help='Output file (stdout by default)')
+		parser.add_argument('--exhibition', action='append', default=[], help='Exhibition slug (repeatable)')
+		parser.add_argument('--jury-only', action='store_true', help='Only jury ratings')
+		parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+		parser.add_argument(
+			'--database', help='Database alias to read from (the read replica by default, if configured)'
+		)
+
+	def handle(self, *args, **options):
+		export_class = EXPORTS[options['kind']]
+		queryset = export_class.model._default_manager.all()
+		if options['exhibition']:
+			queryset = queryset.filter(portfolio__exhibition__slug__in=options['exhibition'])
+		if options['jury_only']:
+			if options['kind'] != 'ratings':
+				raise CommandError('--jury-only applies to ratings only')
+			queryset = queryset.filter(is_jury_rating=True)
+
+		export = export_class(
+			queryset,
+			using=options['database'] or get_replica_alias() or DEFAULT_DB_ALIAS,
+			chunk_size=options['chunk_size'],
+		)
+		lines = export.iter_lines(options['export_format'])
+
+		count = -1 if options['export_format'] == 'csv' else 0
+		if options['output']:
+			with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+				for line in lines:
+					output.write(line)
+					count += 1
+			self.stdout.write(f"Exported {count} {options['kind']} to {options['output']}")
+		else:
+			for line in lines:
+				self.stdout.write(line, ending='')
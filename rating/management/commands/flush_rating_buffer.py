@@ -0,0 +1,26 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rating.buffer import RatingBuffer
+
+
+class Command(BaseCommand):
+	help = 'Move buffered visitor votes from Redis into the ratings table (see RATING_BUFFER)'
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			'--loop', action='store_true',
+			help='Keep flushing every RATING_BUFFER_FLUSH_INTERVAL seconds instead of a single pass'
+		)
+
+	def handle(self, *args, **options):
+		while True:
+			flushed = RatingBuffer.flush()
+			if flushed or not options['loop']:
+				self.stdout.write(f"Flushed {flushed} vote(s)")
+			if not options['loop']:
+				return
+
+			time.sleep(settings.RATING_BUFFER_FLUSH_INTERVAL)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from exhibition.models import Portfolio
+from rating.models import PortfolioRating
+
+
+class Command(BaseCommand):
+	help = 'Rebuild portfolio rating counters (PortfolioRating) from the ratings table'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=500, help='Portfolios per refresh batch')
+
+	def handle(self, *args, **options):
+		ids = list(Portfolio.objects.order_by('pk').values_list('pk', flat=True))
+		batch_size = max(options['batch_size'], 1)
+		for start in range(0, len(ids), batch_size):
+			PortfolioRating.refresh(ids[start:start + batch_size])
+
+		self.stdout.write(self.style.SUCCESS(f"Rating counters: {PortfolioRating.objects.count()} row(s)"))
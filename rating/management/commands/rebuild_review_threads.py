@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from exhibition.models import Portfolio
+from rating.models import Reviews
+
+
+class Command(BaseCommand):
+	help = 'Rebuild comment thread paths and reply counters (Reviews.path, Reviews.reply_count) from parent links'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=500, help='Portfolios per rebuild batch')
+
+	def handle(self, *args, **options):
+		ids = list(
+			Portfolio.objects.filter(comments_portfolio__isnull=False).distinct().order_by('pk').values_list('pk', flat=True)
+		)
+		batch_size = max(options['batch_size'], 1)
+		changed = 0
+		for start in range(0, len(ids), batch_size):
+			changed += Reviews.rebuild_threads(ids[start:start + batch_size])
+
+		self.stdout.write(self.style.SUCCESS(f"Comment threads: {changed} comment(s) updated in {len(ids)} portfolio(s)"))
@@ -34,6 +34,21 @@ class Rating(models.Model):
 		unique_together = ('user', 'portfolio')
 		ordering = ['-updated_at']
 
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		# состояние до сохранения - для счетчиков панели прогресса жюри
+		self.original_jury_key = self.get_jury_key()
+
+	def save(self, *args, **kwargs):
+		super().save(*args, **kwargs)
+		self.original_jury_key = self.get_jury_key()
+
+	def get_jury_key(self):
+		"""(пользователь, проект) для оценки жюри, иначе None"""
+		if self.__dict__.get('is_jury_rating'):
+			return self.__dict__.get('user_id'), self.__dict__.get('portfolio_id')
+		return None
+
 	@property
 	def fullname(self):
 		if self.user:
@@ -81,8 +96,75 @@ class Rating(models.Model):
 		return self
 
 
+class PortfolioRating(models.Model):
+	"""
+	Счетчики оценок портфолио. Обновляются вместе с записью оценки (RatingService),
+	при других изменениях оценок и при отсутствии строки - пересчитываются по таблице оценок.
+	"""
+	portfolio = models.OneToOneField(
+		Portfolio, primary_key=True, related_name='rating_summary', on_delete=models.CASCADE, verbose_name='Портфолио'
+	)
+	count = models.PositiveIntegerField('Количество оценок', default=0)
+	total = models.PositiveIntegerField('Сумма оценок', default=0)
+	jury_count = models.PositiveIntegerField('Количество оценок жюри', default=0)
+	jury_total = models.PositiveIntegerField('Сумма оценок жюри', default=0)
+	updated_at = models.DateTimeField('Дата изменения', auto_now=True)
+
+	class Meta:
+		verbose_name = "Счетчики оценок"
+		verbose_name_plural = "Счетчики оценок проектов"
+		db_table = 'portfolio_ratings'
+
+	def __str__(self):
+		return f"{self.portfolio_id}: {self.count}"
+
+	@staticmethod
+	def _aggregates(count, total):
+		return {'count': count, 'total': total, 'average': total / count if count else None}
+
+	def get_stats(self):
+		"""Статистика в формате Portfolio.get_rating_stats"""
+		return Portfolio.build_rating_stats(
+			self._aggregates(self.count, self.total),
+			self._aggregates(self.jury_count, self.jury_total),
+		)
+
+	@classmethod
+	def refresh(cls, portfolio_ids):
+		"""Пересчет счетчиков по таблице оценок: один агрегирующий запрос и один upsert на пакет"""
+		portfolio_ids = {pk for pk in portfolio_ids if pk}
+		if not portfolio_ids:
+			return {}
+
+		jury = models.Q(is_jury_rating=True)
+		counters = {
+			pk: cls(portfolio_id=pk) for pk in Portfolio.objects.filter(pk__in=portfolio_ids).values_list('pk', flat=True)
+		}
+		for row in Rating.objects.filter(portfolio_id__in=counters).order_by().values('portfolio_id').annotate(
+			count=models.Count('id'),
+			total=models.Sum('star'),
+			jury_count=models.Count('id', filter=jury),
+			jury_total=models.Sum('star', filter=jury),
+		):
+			summary = counters[row['portfolio_id']]
+			summary.count, summary.total = row['count'], row['total'] or 0
+			summary.jury_count, summary.jury_total = row['jury_count'], row['jury_total'] or 0
+
+		cls.objects.bulk_create(
+			counters.values(),
+			update_conflicts=True,
+			unique_fields=['portfolio'],
+			update_fields=['count', 'total', 'jury_count', 'jury_total', 'updated_at'],
+		)
+		return counters
+
+
 class Reviews(models.Model):
 	""" Отзывы посетителй на проекты """
+	# ширина сегмента пути: id с ведущими нулями, чтобы строковая сортировка совпадала с числовой
+	PATH_WIDTH = 10
+	PATH_SEPARATOR = '.'
+
 	user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, verbose_name='Пользователь')
 	parent = models.ForeignKey(
 		'self',
@@ -104,20 +186,72 @@ class Reviews(models.Model):
 		Portfolio, related_name='comments_portfolio', on_delete=models.CASCADE, verbose_name='Портфолио')
 	message = models.TextField("Сообщение", max_length=3000)
 	posted_date = models.DateTimeField("Опубликовано", auto_now_add=True, blank=True)
+	# материализованный путь от корня ветки: сортировка по нему дает ветку в порядке обхода дерева
+	path = models.CharField('Путь в ветке', max_length=255, blank=True, editable=False)
+	reply_count = models.PositiveIntegerField('Ответов', default=0, editable=False)
 
 	class Meta:
 		verbose_name = "Отзыв"
 		verbose_name_plural = "Отзывы"
 		ordering = ['-posted_date', 'group_id', 'parent_id']
 		unique_together = (('id', 'parent'), ('id', 'group'),)
+		indexes = [models.Index(fields=['portfolio', 'path'], name='reviews_portfolio_path_idx')]
+
+	def save(self, *args, **kwargs):
+		super().save(*args, **kwargs)
+		if not self.path:
+			# путь включает собственный id, поэтому известен только после вставки
+			parent_path = ''
+			if self.parent_id:
+				parent_path = Reviews.objects.filter(pk=self.parent_id).values_list('path', flat=True).first() or ''
+			self.path = self.build_path(parent_path, self.pk)
+			Reviews.objects.filter(pk=self.pk).update(path=self.path)
+
+	@classmethod
+	def build_path(cls, parent_path, pk):
+		segment = str(pk).zfill(cls.PATH_WIDTH)
+		path = f'{parent_path}{cls.PATH_SEPARATOR}{segment}' if parent_path else segment
+		# слишком глубокий ответ остается на уровне родителя
+		return path if len(path) <= cls._meta.get_field('path').max_length else parent_path
+
+	@property
+	def thread_key(self):
+		"""Id корня ветки (первый сегмент пути)"""
+		return int(self.path[:self.PATH_WIDTH]) if self.path else self.pk
+
+	@classmethod
+	def rebuild_threads(cls, portfolio_ids=None):
+		"""
+		Пересчет путей и числа ответов по ссылкам на родителей (после удаления комментариев с ответами
+		или для данных до появления путей). Возвращает число измененных комментариев
+		"""
+		queryset = cls.objects.order_by('pk')
+		if portfolio_ids is not None:
+			queryset = queryset.filter(portfolio_id__in=portfolio_ids)
+
+		reviews = {review.pk: review for review in queryset.only('id', 'parent_id', 'path', 'reply_count')}
+		paths, counts = {}, dict.fromkeys(reviews, 0)
+
+		def get_path(review):
+			if review.pk not in paths:
+				paths[review.pk] = ''  # защита от циклов в ссылках на родителей
+				parent = reviews.get(review.parent_id)
+				paths[review.pk] = cls.build_path(get_path(parent) if parent else '', review.pk)
+			return paths[review.pk]
+
+		for review in reviews.values():
+			if review.parent_id in counts:
+				counts[review.parent_id] += 1
 
-	def count(self):
-		aggregates = self.comments_portfolio.aggregate(count=models.Count('portfolio'))
-		return aggregates.get('count') or 0
+		changed = []
+		for review in reviews.values():
+			path, reply_count = get_path(review), counts[review.pk]
+			if (review.path, review.reply_count) != (path, reply_count):
+				review.path, review.reply_count = path, reply_count
+				changed.append(review)
 
-	def reply_count(self):
-		aggregates = self.parent_comments.aggregate(count=models.Count('parent'))
-		return aggregates.get('count') or 0
+		cls.objects.bulk_update(changed, ['path', 'reply_count'], batch_size=500)
+		return len(changed)
 
 	@property
 	def fullname(self):
@@ -0,0 +1,264 @@
+import logging
+
+from django.conf import settings
+from django.core.paginator import Page, Paginator
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery, Window
+from django.db.models.functions import DenseRank, Substr
+from django.utils import timezone
+
+from exhibition.cache import invalidate_jury_report
+from exhibition.models import CategoryRanking, Jury, Portfolio
+from exhibition.services import JuryProgressService
+from .buffer import RatingBuffer
+from .models import Rating, PortfolioRating, Reviews
+
+logger = logging.getLogger(__name__)
+
+
+class RatingError(Exception):
+	"""Оценка не принята: сообщение для пользователя и HTTP-статус ответа"""
+
+	def __init__(self, message, status=403):
+		super().__init__(message)
+		self.message = message
+		self.status = status
+
+
+class RatingService:
+	"""
+	Запись оценки за фиксированное число запросов в одной транзакции:
+	портфолио со всем нужным для проверок читается одним запросом с блокировкой строки,
+	оценка пишется через INSERT ... ON CONFLICT, счетчики (PortfolioRating, для жюри - JuryProgress)
+	и средняя оценка в рейтинге категорий обновляются по одному UPDATE, статистика для ответа берется из счетчиков.
+	"""
+
+	@staticmethod
+	def get_portfolio(user, portfolio_id, lock=False):
+		"""Портфолио с участником, выставкой, счетчиками, прежней оценкой пользователя и признаком жюри"""
+		queryset = Portfolio.objects.select_related('owner', 'exhibition', 'rating_summary')
+		if user.is_authenticated:
+			user_rating = Rating.objects.filter(user=user, portfolio=OuterRef('pk'))
+			queryset = queryset.annotate(
+				user_star=Subquery(user_rating.values('star')[:1]),
+				user_jury_rating=Subquery(user_rating.values('is_jury_rating')[:1]),
+				user_is_jury=Exists(Jury.objects.filter(user=user, user__is_active=True)),
+			)
+		if lock:
+			# оценки одного проекта записываются по очереди - счетчики не расходятся
+			queryset = queryset.select_for_update(of=('self',))
+
+		return queryset.get(pk=portfolio_id)
+
+	@staticmethod
+	def check(user, portfolio):
+		"""Правила Rating.can_user_rate и сроков голосования выставки. Возвращает признак жюри"""
+		if not user.is_authenticated:
+			raise RatingError("Требуется авторизация")
+
+		# Участник не может оценивать свои работы
+		if portfolio.owner.user_id and portfolio.owner.user_id == user.id:
+			raise RatingError("Вы не можете оценивать свои работы")
+
+		is_jury = portfolio.user_is_jury
+		if portfolio.user_star is not None and not is_jury:
+			raise RatingError("Вы уже оценивали эту работу")
+
+		if portfolio.exhibition:
+			# Жюри могут оценивать только в период голосования жюри
+			if is_jury and not portfolio.exhibition.is_jury_voting_active:
+				raise RatingError('Срок выставления оценок жюри завершен')
+			# Обычные пользователи могут оценивать только после выставки
+			if not is_jury and not portfolio.exhibition.is_exhibition_ended:
+				raise RatingError('Оценивать можно только после завершения выставки')
+
+		return is_jury
+
+	@classmethod
+	def can_rate(cls, user, portfolio_id):
+		"""Проверка без записи (тестовый запрос формы оценки)"""
+		is_jury = cls.check(user, cls.get_portfolio(user, portfolio_id))
+		if not is_jury and RatingBuffer.get_user_score(portfolio_id, user.pk) is not None:
+			raise RatingError("Вы уже оценивали эту работу")
+
+		return is_jury
+
+	@classmethod
+	def submit(cls, user, portfolio_id, score, ip):
+		"""
+		Оценка из формы на сайте. При включенном буфере (settings.RATING_BUFFER) голос посетителя
+		копится в Redis (RatingBuffer), оценка жюри и оценки при недоступном Redis пишутся в БД сразу.
+		Возвращает то же, что rate
+		"""
+		if not RatingBuffer.is_enabled():
+			return cls.rate(user, portfolio_id, score, ip)
+
+		cls.validate_score(score)
+		portfolio = cls.get_portfolio(user, portfolio_id)
+		if cls.check(user, portfolio):
+			return cls.rate(user, portfolio_id, score, ip)
+
+		from redis.exceptions import RedisError
+		try:
+			added, count, total = RatingBuffer.add(portfolio.pk, user.pk, score, ip)
+		except RedisError as e:
+			logger.warning(f"Rating buffer is unavailable, saving the vote directly: {e}")
+			return cls.rate(user, portfolio_id, score, ip)
+
+		if not added:
+			raise RatingError("Вы уже оценивали эту работу")
+
+		try:
+			stats = portfolio.rating_summary.get_stats()
+		except PortfolioRating.DoesNotExist:
+			stats = PortfolioRating.refresh([portfolio.pk])[portfolio.pk].get_stats()
+
+		return {
+			'portfolio': portfolio,
+			'is_jury': False,
+			'created': True,
+			'stats': RatingBuffer.merge_stats(stats, count, total),
+		}
+
+	@staticmethod
+	def validate_score(score):
+		if score not in dict(Rating.STARS):
+			raise ValueError(f"оценка {score} вне диапазона")
+
+	@classmethod
+	def rate(cls, user, portfolio_id, score, ip):
+		"""
+		Создает или изменяет оценку пользователя.
+		Возвращает словарь: portfolio, is_jury, created и stats (формат Portfolio.get_rating_stats)
+		"""
+		cls.validate_score(score)
+
+		with transaction.atomic():
+			portfolio = cls.get_portfolio(user, portfolio_id, lock=True)
+			is_jury = cls.check(user, portfolio)
+			created = portfolio.user_star is None
+
+			Rating.objects.bulk_create(
+				[Rating(user=user, portfolio=portfolio, star=score, is_jury_rating=is_jury, ip=ip)],
+				update_conflicts=True,
+				unique_fields=['user', 'portfolio'],
+				update_fields=['star', 'is_jury_rating', 'ip', 'updated_at'],
+			)
+			summary = cls.update_counters(portfolio, score, is_jury)
+			stats = summary.get_stats()
+			JuryProgressService.record(portfolio, user.id, int(is_jury) - int(bool(portfolio.user_jury_rating)))
+
+			now = timezone.now()
+			# то, что для остальных изменений оценок делают сигналы rating.signals
+			Portfolio.objects.filter(pk=portfolio.pk).update(updated_at=now)
+			CategoryRanking.objects.filter(portfolio=portfolio).update(average=stats['average'], updated_at=now)
+			if is_jury or portfolio.user_jury_rating:
+				transaction.on_commit(lambda: invalidate_jury_report(portfolio.exhibition_id))
+
+		return {'portfolio': portfolio, 'is_jury': is_jury, 'created': created, 'stats': stats}
+
+	@staticmethod
+	def update_counters(portfolio, score, is_jury):
+		"""Сдвигает счетчики на разницу между прежней и новой оценкой (строка портфолио заблокирована)"""
+		old_star = portfolio.user_star or 0
+		old_jury_star = old_star if portfolio.user_jury_rating else 0
+		jury_star = score if is_jury else 0
+		delta = {
+			'count': 0 if portfolio.user_star is not None else 1,
+			'total': score - old_star,
+			'jury_count': int(is_jury) - int(bool(portfolio.user_jury_rating)),
+			'jury_total': jury_star - old_jury_star,
+		}
+
+		try:
+			summary = portfolio.rating_summary
+		except PortfolioRating.DoesNotExist:
+			# счетчиков еще нет (первая оценка или данные до их появления) - считаем по таблице оценок
+			return PortfolioRating.refresh([portfolio.pk])[portfolio.pk]
+
+		PortfolioRating.objects.filter(pk=portfolio.pk).update(
+			updated_at=timezone.now(), **{field: F(field) + value for field, value in delta.items()}
+		)
+		for field, value in delta.items():
+			setattr(summary, field, getattr(summary, field) + value)
+
+		return summary
+
+
+class ReviewService:
+	"""
+	Обсуждение проекта одним упорядоченным запросом: ветки нумеруются оконной функцией по ключу ветки
+	(первый сегмент Reviews.path, новые ветки сверху), внутри ветки комментарии идут по пути.
+	В том же запросе считаются число веток и комментариев, дерево собирается в памяти.
+	"""
+
+	@staticmethod
+	def get_page_number(value):
+		try:
+			return max(int(value), 1)
+		except (TypeError, ValueError):
+			return 1
+
+	@classmethod
+	def get_threads(cls, portfolio_id, page=1, per_page=None):
+		"""
+		Страница веток комментариев (django Page): корневые комментарии с ответами в replies
+		и общим числом комментариев в comment_count. per_page=0 - все ветки на одной странице
+		"""
+		if per_page is None:
+			per_page = settings.COMMENTS_COUNT_PER_PAGE
+		number = cls.get_page_number(page)
+
+		root = ~Q(path__contains=Reviews.PATH_SEPARATOR)
+		queryset = Reviews.objects.filter(portfolio_id=portfolio_id).select_related('user').annotate(
+			thread=Substr('path', 1, Reviews.PATH_WIDTH),
+		).annotate(
+			thread_number=Window(DenseRank(), order_by=F('thread').desc()),
+			thread_count=Window(Count('pk', filter=root)),
+			comment_count=Window(Count('pk')),
+			# комментарии до появления путей (rebuild_review_threads еще не запускалась)
+			unindexed_count=Window(Count('pk', filter=Q(path=''))),
+		).order_by('thread_number', 'path')
+		if per_page:
+			queryset = queryset.filter(
+				thread_number__gt=(number - 1) * per_page, thread_number__lte=number * per_page
+			)
+
+		reviews = list(queryset)
+		if reviews and reviews[0].unindexed_count:
+			# без путей все комментарии попадают в одну ветку - строим пути портфолио и читаем страницу заново
+			Reviews.rebuild_threads([portfolio_id])
+			return cls.get_threads(portfolio_id, page, per_page)
+
+		if not reviews and number > 1:
+			# страницы больше нет (комментарии удалили) - показываем первую
+			return cls.get_threads(portfolio_id, 1, per_page)
+
+		threads = cls.build_threads(reviews)
+		thread_count = reviews[0].thread_count if reviews else 0
+		paginator = Paginator(range(thread_count), per_page or max(thread_count, 1))
+		result = Page(threads, number, paginator)
+		result.comment_count = reviews[0].comment_count if reviews else 0
+		return result
+
+	@staticmethod
+	def build_threads(reviews):
+		"""
+		Корни веток со списком ответов replies в порядке обхода дерева.
+		Родитель ответа берется из загруженных комментариев (без запроса на каждый ответ)
+		"""
+		threads, loaded = {}, {}
+		for review in reviews:
+			loaded[review.pk] = review
+			review.replies = []
+			thread = threads.get(review.thread_key)
+			if thread is None:
+				# корень ветки или ответ, корень которого удален до пересчета путей
+				threads[review.thread_key] = review
+				continue
+
+			if review.parent_id in loaded:
+				review.parent = loaded[review.parent_id]
+			thread.replies.append(review)
+
+		return list(threads.values())
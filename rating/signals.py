@@ -0,0 +1,89 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from exhibition.cache import invalidate_jury_report
+from exhibition.models import Portfolio
+from exhibition.services import touch_portfolio, CategoryRankingService, JuryProgressService
+from .models import Rating, Reviews, PortfolioRating
+
+
+@receiver([post_save, post_delete], sender=Rating)
+@receiver([post_save, post_delete], sender=Reviews)
+def portfolio_feedback_changed(sender, instance, **kwargs):
+	"""Оценки и отзывы меняют страницу проекта, поэтому обновляем метку изменения портфолио"""
+	touch_portfolio(instance.portfolio_id)
+
+
+@receiver(post_save, sender=Reviews)
+def review_created(sender, instance, created, **kwargs):
+	"""Число ответов хранится в комментарии (Reviews.reply_count)"""
+	if created and instance.parent_id:
+		Reviews.objects.filter(pk=instance.parent_id).update(reply_count=F('reply_count') + 1)
+
+
+@receiver(post_delete, sender=Reviews)
+def review_deleted(sender, instance, origin=None, **kwargs):
+	if isinstance(origin, Portfolio) and origin.pk == instance.portfolio_id:
+		# вместе с портфолио удаляются все его комментарии
+		return
+
+	if origin is not None and origin is not instance:
+		# каскадное или пакетное удаление (пользователя, queryset): ветки портфолио строятся заново
+		# один раз после фиксации, а не на каждый удаленный комментарий
+		if instance.reply_count or instance.parent_id:
+			rebuild_threads_on_commit(origin, instance.portfolio_id)
+	elif instance.reply_count:
+		# ответы остались без родителя (SET_NULL) - пути веток портфолио строим заново
+		Reviews.rebuild_threads([instance.portfolio_id])
+	elif instance.parent_id:
+		Reviews.objects.filter(pk=instance.parent_id, reply_count__gt=0).update(reply_count=F('reply_count') - 1)
+
+
+def rebuild_threads_on_commit(origin, portfolio_id):
+	"""Портфолио копятся на объекте, с которого началось удаление (origin), перестройка - одна на все"""
+	pending = getattr(origin, '_review_threads_pending', None)
+	if pending is None:
+		pending = origin._review_threads_pending = set()
+		transaction.on_commit(lambda: Reviews.rebuild_threads(sorted(pending)))
+	pending.add(portfolio_id)
+
+
+@receiver([post_save, post_delete], sender=Rating)
+def portfolio_rating_changed(sender, instance, **kwargs):
+	"""Средняя оценка входит в рейтинг проектов по категориям и в счетчики оценок портфолио"""
+	CategoryRankingService.refresh([instance.portfolio_id])
+	PortfolioRating.refresh([instance.portfolio_id])
+
+
+@receiver([post_save, post_delete], sender=Rating)
+def jury_rating_changed(sender, instance, **kwargs):
+	"""Оценки жюри входят в протокол оценок выставки"""
+	if instance.is_jury_rating:
+		# при каскадном удалении портфолио его уже может не быть в базе
+		exhibition_id = Portfolio.objects.filter(pk=instance.portfolio_id).values_list('exhibition_id', flat=True).first()
+		invalidate_jury_report(exhibition_id)
+
+
+@receiver([post_save, post_delete], sender=Rating)
+def jury_progress_changed(sender, instance, created=False, **kwargs):
+	"""
+	Счетчики панели прогресса жюри. Оценки с сайта (RatingService) пишутся без сигналов и сдвигают
+	счетчики сами; здесь - изменения из админки и прочие сохранения моделей
+	"""
+	if kwargs['signal'] is post_delete:
+		old_key, new_key = instance.get_jury_key(), None
+	else:
+		old_key, new_key = None if created else instance.original_jury_key, instance.get_jury_key()
+
+	# оценки зрителей и правка самой оценки жюри счетчики не меняют
+	if old_key == new_key:
+		return
+
+	for key, delta in ((old_key, -1), (new_key, 1)):
+		if key:
+			user_id, portfolio_id = key
+			portfolio = Portfolio.objects.filter(pk=portfolio_id).only('id', 'exhibition_id', 'status').first()
+			if portfolio:
+				JuryProgressService.record(portfolio, user_id, delta)
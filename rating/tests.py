@@ -0,0 +1,334 @@
+import csv
+import json
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipIf
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from redis.exceptions import RedisError
+
+from crm.testing import REDIS_TEST_URL, redis_available
+from exhibition.models import Exhibitions, Exhibitors, Jury, Categories, Nominations, Portfolio, CategoryRanking
+from .buffer import RatingBuffer
+from .exports import ReviewsExport, escape_csv_value
+from .models import Rating, Reviews, PortfolioRating
+from .services import RatingService, RatingError, ReviewService
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+# фоновая запись карты сайта не должна писать в MEDIA_ROOT и занимать тестовую БД из другого потока
+SITEMAP_SETTINGS = override_settings(SITEMAP_AUTO_UPDATE=False)
+
+
+def setUpModule():
+	SITEMAP_SETTINGS.enable()
+
+
+def tearDownModule():
+	SITEMAP_SETTINGS.disable()
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RatingServiceTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		category = Categories.objects.create(title='Категория', slug='category')
+		owner = Exhibitors(name='Участник', slug='owner', email='owner@example.com')
+		owner.save()
+		cls.owner = owner
+		cls.portfolio = Portfolio(owner=owner, title='Проект')
+		cls.portfolio.save()
+		CategoryRanking.objects.create(
+			category=category, portfolio=cls.portfolio, owner=owner, last_exh_year='', owner_name='', owner_slug=''
+		)
+		cls.jury = Jury(name='Жюри', slug='jury', user=User.objects.create_user('rating-juror'))
+		cls.jury.save()
+		cls.voters = [User.objects.create_user(f'rating-voter{i}') for i in range(2)]
+
+	def rate(self, user, score):
+		return RatingService.rate(user, self.portfolio.pk, score, '127.0.0.1')
+
+	def test_rate_updates_counters_in_fixed_queries(self):
+		result = self.rate(self.voters[0], 4)
+		self.assertTrue(result['created'])
+		self.assertEqual(result['stats'], self.portfolio.get_rating_stats())
+
+		# savepoint, выборка с блокировкой, upsert, три UPDATE, release savepoint
+		with self.assertNumQueries(7):
+			result = self.rate(self.jury.user, 2)
+		self.assertEqual((result['is_jury'], result['created']), (True, True))
+		self.assertEqual(result['stats']['average'], 3.0)
+
+		with self.assertNumQueries(7):
+			result = self.rate(self.jury.user, 5)
+		self.assertFalse(result['created'])
+		self.assertEqual(result['stats'], self.portfolio.get_rating_stats())
+		self.assertEqual((result['stats']['jury_count'], result['stats']['jury_average']), (1, 5.0))
+		self.assertEqual(CategoryRanking.objects.get(portfolio=self.portfolio).average, 4.5)
+		self.assertEqual(Rating.objects.get(user=self.jury.user).star, 5)
+
+	def test_rating_rules(self):
+		self.rate(self.voters[0], 3)
+		with self.assertRaisesMessage(RatingError, 'Вы уже оценивали эту работу'):
+			self.rate(self.voters[0], 5)
+		with self.assertRaisesMessage(RatingError, 'Вы не можете оценивать свои работы'):
+			self.rate(self.owner.user, 5)
+		with self.assertRaises(ValueError):
+			self.rate(self.voters[1], 6)
+
+	def test_counters_follow_other_rating_changes(self):
+		self.rate(self.voters[0], 3)
+		Rating.objects.create(user=self.voters[1], portfolio=self.portfolio, star=5, ip='1')
+		Rating.objects.filter(user=self.voters[0]).delete()
+
+		summary = PortfolioRating.objects.get(portfolio=self.portfolio)
+		self.assertEqual((summary.count, summary.total), (1, 5))
+		self.assertEqual(self.rate(self.jury.user, 1)['stats'], self.portfolio.get_rating_stats())
+
+
+@override_settings(CACHES=LOCMEM_CACHES, RATING_BUFFER=True)
+@mock.patch('rating.buffer.schedule_flush')
+class RatingBufferTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		now = timezone.now()
+		exhibition = Exhibitions.objects.create(
+			title='Выставка', slug='2032', date_start=now - timedelta(days=30), date_end=now - timedelta(days=20)
+		)
+		owner = Exhibitors(name='Участник', slug='buffer-owner', email='buffer-owner@example.com')
+		owner.save()
+		cls.portfolio = Portfolio(owner=owner, exhibition=exhibition, title='Проект')
+		cls.portfolio.save()
+		cls.jury_portfolio = Portfolio(owner=owner, title='Проект без выставки')
+		cls.jury_portfolio.save()
+		cls.voters = [User.objects.create_user(f'buffer-voter{i}') for i in range(2)]
+		cls.jury = Jury(name='Жюри', slug='buffer-jury', user=User.objects.create_user('buffer-juror'))
+		cls.jury.save()
+
+	def submit(self, user, score):
+		return RatingService.submit(user, self.portfolio.pk, score, '127.0.0.1')
+
+	def test_redis_failure_saves_vote_directly(self, schedule_flush):
+		with mock.patch.object(RatingBuffer, 'add', side_effect=RedisError('down')), \
+				mock.patch.object(RatingBuffer, 'get_pending', return_value=(0, 0)):
+			result = self.submit(self.voters[0], 4)
+
+		self.assertEqual(result['stats']['average'], 4.0)
+		self.assertTrue(Rating.objects.filter(user=self.voters[0]).exists())
+
+	@skipIf(not redis_available(), 'Нужен Redis (REDIS_TEST_URL)')
+	def test_votes_are_buffered_until_flush(self, schedule_flush):
+		redis_caches = {'default': {'BACKEND': 'django_redis.cache.RedisCache', 'LOCATION': REDIS_TEST_URL}}
+		with override_settings(CACHES=redis_caches):
+			connection = RatingBuffer.get_connection()
+			connection.delete(*connection.keys('rating:buffer*') or ['rating:buffer:dirty'])
+
+			result = self.submit(self.voters[0], 4)
+			self.submit(self.voters[1], 2)
+			schedule_flush.assert_called()
+			self.assertEqual(result['stats']['average'], 4.0)
+			self.assertFalse(Rating.objects.exists())
+			self.assertEqual(self.portfolio.get_rating_stats()['count'], 2)
+			with self.assertRaisesMessage(RatingError, 'Вы уже оценивали эту работу'):
+				self.submit(self.voters[0], 5)
+
+			# оценка жюри пишется сразу
+			result = RatingService.submit(self.jury.user, self.jury_portfolio.pk, 5, '127.0.0.1')
+			self.assertTrue(result['is_jury'])
+			self.assertEqual(list(Rating.objects.values_list('portfolio_id', flat=True)), [self.jury_portfolio.pk])
+
+			# голос, записанный напрямую при сбое Redis, сброс буфера не перезаписывает
+			Rating.objects.create(user=self.voters[1], portfolio=self.portfolio, star=5, ip='127.0.0.2')
+
+			self.assertEqual(RatingBuffer.flush(), 2)
+			self.assertEqual(RatingBuffer.get_pending(self.portfolio.pk), (0, 0))
+			self.assertEqual(Rating.objects.filter(portfolio=self.portfolio).count(), 2)
+			self.assertEqual(Rating.objects.get(user=self.voters[1]).star, 5)
+			stats = self.portfolio.get_rating_stats()
+			self.assertEqual((stats['count'], stats['total']), (2, 9))
+			self.assertEqual(PortfolioRating.objects.get(portfolio=self.portfolio).count, 2)
+			self.assertEqual(RatingBuffer.flush(), 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ReviewThreadsTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		owner = Exhibitors(name='Участник', slug='threads-owner', email='threads-owner@example.com')
+		owner.save()
+		cls.portfolio = Portfolio(owner=owner, title='Проект')
+		cls.portfolio.save()
+		cls.other = Portfolio(owner=owner, title='Другой проект')
+		cls.other.save()
+		cls.users = [User.objects.create_user(f'threads-user{i}') for i in range(2)]
+
+	def comment(self, parent=None, user=0, portfolio=None):
+		return Reviews.objects.create(
+			user=self.users[user], portfolio=portfolio or self.portfolio, parent=parent, message='Отзыв'
+		)
+
+	def test_paths_and_reply_counts(self):
+		root = self.comment()
+		reply = self.comment(root, 1)
+		nested = self.comment(reply)
+		self.comment(root)
+
+		self.assertEqual(nested.path, f'{root.pk:010d}.{reply.pk:010d}.{nested.pk:010d}')
+		self.assertEqual(Reviews.objects.get(pk=root.pk).reply_count, 2)
+		self.assertEqual(Reviews.objects.get(pk=reply.pk).reply_count, 1)
+
+		nested.delete()
+		self.assertEqual(Reviews.objects.get(pk=reply.pk).reply_count, 0)
+
+		# удаление комментария с ответами: ответы становятся корнями своих веток
+		second = self.comment(reply)
+		Reviews.objects.get(pk=root.pk).delete()
+		reply.refresh_from_db()
+		self.assertEqual((reply.path, reply.reply_count), (f'{reply.pk:010d}', 1))
+		self.assertEqual(Reviews.objects.get(pk=second.pk).path, f'{reply.pk:010d}.{second.pk:010d}')
+
+	def test_cascade_rebuilds_once_per_portfolio(self):
+		replies = []
+		for portfolio in (self.portfolio, self.other):
+			root = self.comment(portfolio=portfolio)
+			reply = self.comment(root, 1, portfolio)
+			self.comment(reply, portfolio=portfolio)
+			replies.append(reply)
+
+		# удаление пользователя уносит его комментарии обоих портфолио
+		with mock.patch.object(Reviews, 'rebuild_threads', wraps=Reviews.rebuild_threads) as rebuild, \
+				self.captureOnCommitCallbacks(execute=True):
+			self.users[0].delete()
+		rebuild.assert_called_once_with(sorted([self.portfolio.pk, self.other.pk]))
+
+		for reply in replies:
+			reply.refresh_from_db()
+			self.assertEqual((reply.parent_id, reply.path, reply.reply_count), (None, f'{reply.pk:010d}', 0))
+
+		# комментарии удаляемого портфолио не перестраиваются
+		root = self.comment(user=1)
+		self.comment(root, 1)
+		with mock.patch.object(Reviews, 'rebuild_threads') as rebuild, self.captureOnCommitCallbacks(execute=True):
+			self.portfolio.delete()
+		rebuild.assert_not_called()
+
+	def test_threads_load_in_one_query(self):
+		roots = [self.comment() for _ in range(3)]
+		reply = self.comment(roots[0], 1)
+		nested = self.comment(reply)
+		self.comment(roots[2])
+
+		with self.assertNumQueries(1):
+			page = ReviewService.get_threads(self.portfolio.pk, page=2, per_page=2)
+			replies = [(review.pk, review.parent.fullname) for review in page[0].replies]
+
+		# новые ветки сверху: на второй странице самая старая ветка с ответами в порядке дерева
+		self.assertEqual([review.pk for review in page], [roots[0].pk])
+		self.assertEqual(replies, [(reply.pk, 'threads-user0'), (nested.pk, 'threads-user1')])
+		self.assertEqual((page.comment_count, page.paginator.num_pages, page.has_previous()), (6, 2, True))
+
+		page = ReviewService.get_threads(self.portfolio.pk, page='x', per_page=2)
+		self.assertEqual([review.pk for review in page], [roots[2].pk, roots[1].pk])
+		self.assertEqual([review.pk for review in self.portfolio.root_comments()], [root.pk for root in roots[::-1]])
+
+	def test_threads_without_paths_are_rebuilt(self):
+		roots = [self.comment() for _ in range(2)]
+		reply = self.comment(roots[0], 1)
+		# комментарии, созданные до появления путей
+		Reviews.objects.update(path='', reply_count=0)
+
+		page = ReviewService.get_threads(self.portfolio.pk, per_page=1)
+		self.assertEqual([review.pk for review in page], [roots[1].pk])
+		self.assertEqual((page.comment_count, page.paginator.num_pages), (3, 2))
+
+		page = ReviewService.get_threads(self.portfolio.pk, page=2, per_page=1)
+		self.assertEqual([(review.pk, [item.pk for item in review.replies]) for review in page], [(roots[0].pk, [reply.pk])])
+		self.assertFalse(Reviews.objects.filter(path='').exists())
+
+	def test_rebuild_command(self):
+		root = self.comment()
+		reply = self.comment(root)
+		Reviews.objects.update(path='', reply_count=0)
+
+		call_command('rebuild_review_threads', stdout=StringIO())
+		root.refresh_from_db()
+		reply.refresh_from_db()
+		self.assertEqual((root.reply_count, reply.path), (1, f'{root.pk:010d}.{reply.pk:010d}'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RatingsExportTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		now = timezone.now()
+		cls.exhibition = Exhibitions.objects.create(
+			title='Выставка', slug='2031', date_start=now - timedelta(days=30), date_end=now - timedelta(days=20)
+		)
+		category = Categories.objects.create(title='Категория', slug='category')
+		nominations = [
+			Nominations.objects.create(title=f'Номинация {i}', slug=f'nomination-{i}', category=category)
+			for i in range(2)
+		]
+		owner = Exhibitors(name='Участник', slug='exhibitor', email='owner@example.com')
+		owner.save()
+		cls.portfolio = Portfolio(owner=owner, exhibition=cls.exhibition, title='Проект')
+		cls.portfolio.save()
+		cls.portfolio.nominations.set(nominations)
+
+		jury = Jury(name='Жюри', slug='jury', user=User.objects.create_user('juror'))
+		jury.save()
+		cls.exhibition.jury.add(jury)
+		visitor = User.objects.create_user('visitor')
+		Rating.objects.create(user=jury.user, portfolio=cls.portfolio, star=5, is_jury_rating=True, ip='1')
+		Rating.objects.create(user=visitor, portfolio=cls.portfolio, star=3, ip='1')
+		Reviews.objects.create(user=visitor, portfolio=cls.portfolio, message='Отзыв')
+
+		cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+	def test_command_streams_jsonl(self):
+		out = StringIO()
+		call_command('export_ratings', 'ratings', '--format', 'jsonl', '--chunk-size', '1', stdout=out)
+		rows = [json.loads(line) for line in out.getvalue().splitlines()]
+
+		self.assertEqual([(row['username'], row['star'], row['exhibition_juror']) for row in rows], [
+			('juror', 5, True), ('visitor', 3, False),
+		])
+		self.assertEqual(rows[0]['nominations'], 'Номинация 0; Номинация 1')
+		self.assertEqual(rows[0]['exhibition'], '2031')
+
+		out = StringIO()
+		call_command('export_ratings', 'reviews', '--format', 'jsonl', stdout=out)
+		self.assertEqual(json.loads(out.getvalue())['message'], 'Отзыв')
+
+	def test_admin_csv_export_uses_changelist_filters(self):
+		self.client.force_login(self.admin)
+		response = self.client.get(
+			reverse('admin:rating_rating_export', args=['csv']), {'is_jury_rating__exact': '1'}
+		)
+		self.assertTrue(response.streaming)
+		rows = list(csv.reader(b''.join(response.streaming_content).decode('utf-8-sig').splitlines()))
+
+		self.assertEqual(rows[0][:3], ['id', 'star', 'is_jury_rating'])
+		self.assertEqual(len(rows), 2)
+		self.assertEqual(rows[1][1], '5')
+
+	def test_csv_escapes_formulas(self):
+		Portfolio.objects.filter(pk=self.portfolio.pk).update(title='+SUM(A1:A2)')
+		Reviews.objects.update(message='=HYPERLINK("http://example.com")')
+
+		rows = list(csv.DictReader(''.join(ReviewsExport().iter_csv()).lstrip('\ufeff').splitlines()))
+		self.assertEqual(
+			(rows[0]['message'], rows[0]['portfolio'], rows[0]['owner']),
+			('\'=HYPERLINK("http://example.com")', "'+SUM(A1:A2)", 'Участник')
+		)
+		self.assertEqual(escape_csv_value(-1), -1)
+
+		# JSONL отдает данные без изменений
+		self.assertEqual(json.loads(''.join(ReviewsExport().iter_jsonl()))['portfolio'], '+SUM(A1:A2)')
@@ -6,13 +6,16 @@ from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic.base import View
 
+from crm.ratelimit import rate_limit
 from exhibition.models import Portfolio
 from exhibition.services import delete_cached_fragment
-from exhibition.utils import is_jury_member, get_client_ip
-from .models import Rating, Reviews
+from exhibition.utils import get_client_ip
+from .models import Reviews
+from .services import RatingService, RatingError
 
 
 @method_decorator(csrf_exempt, name='dispatch')
+@method_decorator(rate_limit('rating'), name='post')
 class AddRating(View):
 	"""Добавление рейтинга проекту"""
 
@@ -20,57 +23,20 @@ class AddRating(View):
 		try:
 			score = int(request.POST.get("star"))
 			portfolio_id = int(request.POST.get("portfolio"))
-			portfolio = Portfolio.objects.get(id=portfolio_id)
-
-			# Проверяем, это тестовый запрос или реальный
-			is_test = request.POST.get("test") == "true"
-
-			# Проверяем базовые возможности оценки
-			can_rate, message = Rating.can_user_rate(request.user, portfolio)
-			if not can_rate:
-				return JsonResponse({'status': 'error', 'message': message}, status=403)
-
-			# Дополнительные проверки для выставки
-			if portfolio.exhibition:
-				is_jury = is_jury_member(request.user)
-
-				if is_jury:
-					# Жюри могут оценивать только в период голосования жюри
-					if not portfolio.exhibition.is_jury_voting_active:
-						return JsonResponse({
-							'status': 'error',
-							'message': 'Срок выставления оценок жюри завершен'
-						}, status=403)
-				else:
-					# Обычные пользователи могут оценивать только после выставки
-					if not portfolio.exhibition.is_exhibition_ended:
-						return JsonResponse({
-							'status': 'error',
-							'message': 'Оценивать можно только после завершения выставки'
-						}, status=403)
 
 			# Если это тестовый запрос - только проверяем права, не сохраняем
-			if is_test:
-				return JsonResponse({
-					'status': 'success',
-					'message': 'Можно оценивать',
-					'test': True
-				})
-
-			# Создаем или обновляем оценку
-			is_jury = is_jury_member(request.user)
-			rating, created = Rating.objects.update_or_create(
-				user=request.user,
-				portfolio=portfolio,
-				defaults={
-					'star': score,
-					'is_jury_rating': is_jury,
-					'ip': get_client_ip(request)
-				}
-			)
+			if request.POST.get("test") == "true":
+				RatingService.can_rate(request.user, portfolio_id)
+				return JsonResponse(self.TEST_RESPONSE)
 
-			return self._build_success_response(portfolio, score, is_jury, created)
+			result = RatingService.submit(request.user, portfolio_id, score, get_client_ip(request))
+			delete_cached_fragment('portfolio', portfolio_id)
+			delete_cached_fragment('project', portfolio_id)
 
+			return JsonResponse(self.get_success_data(result, score), safe=False)
+
+		except RatingError as e:
+			return JsonResponse({'status': 'error', 'message': e.message}, status=e.status)
 		except (ValueError, TypeError) as e:
 			return JsonResponse({
 				'status': 'error',
@@ -87,31 +53,29 @@ class AddRating(View):
 				'message': f'Ошибка сервера: {str(e)}'
 			}, status=500)
 
-	def _build_success_response(self, portfolio, score, is_jury, created):
-		"""Формирует успешный ответ"""
-		delete_cached_fragment('portfolio', portfolio.id)
-		delete_cached_fragment('project', portfolio.id)
-
-		rating = Rating.objects.filter(portfolio=portfolio).first()
-		if rating:
-			rating.calculate()  # Обновляет атрибуты rating
-
-		stats = portfolio.get_rating_stats()  # Получаем словарь
-
-		response_data = {
+	TEST_RESPONSE = {
+		'status': 'success',
+		'message': 'Можно оценивать',
+		'test': True
+	}
+
+	@staticmethod
+	def get_success_data(result, score):
+		"""Данные успешного ответа (статистика из RatingService.submit)"""
+		stats = result['stats']
+		return {
 			'score': score,
 			'score_avg': stats['average'],
-			'author': portfolio.owner.name,
-			'is_jury': is_jury,
-			'is_new': created,
+			'author': result['portfolio'].owner.name,
+			'is_jury': result['is_jury'],
+			'is_new': result['created'],
 			'jury_count': stats['jury_count'],
 			'jury_avg': stats['jury_average']
 		}
 
-		return JsonResponse(response_data, safe=False)
-
 
 @csrf_exempt
+@rate_limit('review')
 def add_review(request, pk):
 	"""Комментарии"""
 
@@ -137,11 +101,6 @@ def add_review(request, pk):
 				message=message,
 			)
 
-			# Подсчет количества ответов
-			reply_count = 0
-			if instance.parent_id:
-				reply_count = Reviews.objects.filter(parent_id=instance.parent_id).count()
-
 			# Формируем ответ
 			new_comment = {
 				'id': instance.pk,
@@ -150,7 +109,7 @@ def add_review(request, pk):
 				'author': instance.fullname,
 				'message': instance.message,
 				'posted_date': instance.posted_date.strftime('%d.%m.%Y'),
-				'reply_count': reply_count,
+				'reply_count': instance.reply_count,
 			}
 
 			return JsonResponse(new_comment, safe=False)
@@ -164,6 +123,7 @@ def add_review(request, pk):
 
 @csrf_exempt
 @login_required
+@rate_limit('review')
 def edit_review(request, pk=None):
 
 	if request.method == 'GET':
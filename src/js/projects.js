@@ -8,6 +8,7 @@ document.addEventListener("DOMContentLoaded", function () {
 
     let preloader = document.querySelector('#preloader');
     let currentPage = 1, nextPage = true;
+    let nextCursor = preloader ? preloader.dataset.cursor : null;
     let preloaderVisible = false;
 
     const throttledJsonRequest = rafThrottle(jsonRequest);
@@ -26,6 +27,7 @@ document.addEventListener("DOMContentLoaded", function () {
         if (html) {
             nextPage = data['next_page'];
             currentPage = data['current_page'];
+            nextCursor = data['next'];
 
             if (currentPage === 1) {
                 const clone = preloader.cloneNode(true);
@@ -97,7 +99,8 @@ document.addEventListener("DOMContentLoaded", function () {
         nextPage = null;
 
         let url = preloader.href;
-        let params = 'page=' + String(currentPage + 1);
+        // курсор следующей страницы, либо номер страницы для совместимости
+        let params = nextCursor ? 'cursor=' + encodeURIComponent(nextCursor) : 'page=' + String(currentPage + 1);
         if (filterForm) {
             let filters = createFormData(filterForm);
             params += '&' + filters;